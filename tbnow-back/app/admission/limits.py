@@ -0,0 +1,180 @@
+"""
+Admission control for the expensive endpoints (/xray/analyze, /rag/query).
+
+Each policy combines a per-client token bucket (rate per minute plus a burst)
+with a global concurrency cap whose queue wait is bounded. Both are checked in
+the HTTP middleware before the request body is read, so a rejected request
+costs no upload parsing, decoding, embedding or model time:
+
+    429  the client's bucket is empty (Retry-After: seconds until a token)
+    503  the endpoint stayed at its concurrency cap for the whole queue wait
+         (Retry-After: the queue wait)
+
+Clients are identified by X-API-Key when it is one of TBNOW_API_KEYS
+(comma-separated), otherwise by IP address (the first X-Forwarded-For hop when
+TBNOW_TRUST_PROXY=1, e.g. behind nginx); an unknown key counts as its IP, so
+rotating keys doesn't escape the limit. At most TBNOW_RATE_LIMIT_MAX_CLIENTS
+buckets are kept, the least recently used going first. Limits are per worker
+process. TBNOW_RATE_LIMITING=0 disables all of it.
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app.monitoring.metrics import ADMISSION_REJECTIONS, ADMISSION_WAIT_SECONDS
+
+RATE_LIMITING_ENABLED = os.getenv("TBNOW_RATE_LIMITING", "1") == "1"
+TRUST_PROXY = os.getenv("TBNOW_TRUST_PROXY", "0") == "1"
+MAX_TRACKED_CLIENTS = int(os.getenv("TBNOW_RATE_LIMIT_MAX_CLIENTS", "10000"))
+API_KEYS = {key.strip() for key in os.getenv("TBNOW_API_KEYS", "").split(",") if key.strip()}
+
+class TokenBucket:
+    """rate tokens per second up to burst; one token per request"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """0 if a token was taken, otherwise seconds until one is available"""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class ClientRateLimiter:
+    """One token bucket per client key, at most max_clients of them (least recently used evicted)"""
+
+    def __init__(self, per_minute: float, burst: float, max_clients: int = MAX_TRACKED_CLIENTS):
+        self.rate = per_minute / 60
+        self.burst = max(burst, 1)
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, client: str) -> float:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self.rate, self.burst, now)
+                while len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+            return bucket.take(now)
+
+class ConcurrencyLimit:
+    """At most limit requests in flight; others wait up to max_wait seconds for a slot"""
+
+    def __init__(self, limit: int, max_wait: float):
+        self.limit = limit
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self) -> bool:
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = max(1, math.ceil(retry_after))
+
+    @property
+    def headers(self) -> dict:
+        return {"Retry-After": str(self.retry_after)}
+
+class Policy:
+    def __init__(self, path: str, per_minute: float, burst: float, max_concurrency: int, max_wait: float):
+        self.path = path
+        self.rate_limiter = ClientRateLimiter(per_minute, burst)
+        self.concurrency = ConcurrencyLimit(max_concurrency, max_wait)
+
+    async def acquire(self, client: str):
+        """Take a token and a concurrency slot (release() it afterwards), or raise Rejected"""
+        wait = self.rate_limiter.take(client)
+        if wait:
+            ADMISSION_REJECTIONS.inc(route=self.path, reason="rate_limited")
+            raise Rejected(429, "Too many requests from this client, please retry later", wait)
+        start = time.perf_counter()
+        admitted = await self.concurrency.acquire()
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start, route=self.path)
+        if not admitted:
+            ADMISSION_REJECTIONS.inc(route=self.path, reason="queue_timeout")
+            raise Rejected(503, "Server is busy, please retry later", self.concurrency.max_wait)
+
+    def release(self):
+        self.concurrency.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.concurrency.in_flight,
+            "waiting": self.concurrency.waiting,
+            "max_concurrency": self.concurrency.limit,
+            "max_queue_seconds": self.concurrency.max_wait,
+            "per_minute": self.rate_limiter.rate * 60,
+            "burst": self.rate_limiter.burst,
+            "tracked_clients": len(self.rate_limiter),
+        }
+
+def _policy(path: str, prefix: str, per_minute: float, burst: float, max_concurrency: int, max_wait: float):
+    return Policy(
+        path,
+        per_minute=float(os.getenv(f"{prefix}_RATE_PER_MINUTE", per_minute)),
+        burst=float(os.getenv(f"{prefix}_RATE_BURST", burst)),
+        max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", max_concurrency)),
+        max_wait=float(os.getenv(f"{prefix}_MAX_QUEUE_SECONDS", max_wait)),
+    )
+
+# X-ray work is CPU/GPU bound, RAG mostly waits on the LLM
+POLICIES = {
+    "/xray/analyze": _policy("/xray/analyze", "XRAY", per_minute=30, burst=10, max_concurrency=2, max_wait=5),
+    "/rag/query": _policy("/rag/query", "RAG", per_minute=20, burst=5, max_concurrency=8, max_wait=10),
+}
+
+def policy_for(method: str, path: str):
+    if not RATE_LIMITING_ENABLED or method != "POST":
+        return None
+    return POLICIES.get(path.rstrip("/") or "/")
+
+def client_key(headers, client, api_keys=API_KEYS) -> str:
+    api_key = headers.get("x-api-key")
+    if api_key and api_key in api_keys:
+        return "key:" + api_key
+    if TRUST_PROXY:
+        forwarded = headers.get("x-forwarded-for")
+        if forwarded:
+            return "ip:" + forwarded.split(",")[0].strip()
+    return "ip:" + (client.host if client else "unknown")
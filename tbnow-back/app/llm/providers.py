@@ -0,0 +1,243 @@
+"""
+LLM backends behind one interface, selectable per query type.
+
+    gemini  Google Gemini through google-genai (GEMINI_API_KEY, GEMINI_MODEL,
+            GEMINI_BASE_URL for a proxy or the load test's fake endpoint)
+    openai  any OpenAI-compatible /chat/completions server: vLLM, Ollama,
+            llama.cpp's llama-server, LM Studio, OpenAI itself
+            (OPENAI_BASE_URL, OPENAI_API_KEY, OPENAI_MODEL)
+    local   a GGUF model run on the CPU in-process with llama-cpp-python
+            (pip install llama-cpp-python; LOCAL_LLM_MODEL_PATH), for clinics
+            without a reliable connection
+
+LLM_PROVIDER picks the backend for every query type (default gemini), and
+LLM_PROVIDER_<TYPE> overrides it for one type: QUICK and DIAGNOSIS for
+/rag/query and record chat, SUMMARY for the conversation summaries, e.g.
+LLM_PROVIDER_QUICK=local with Gemini for diagnosis support.
+
+Every backend has generate(prompt) -> str and stream(prompt), which yields
+text chunks as they are produced; both raise LLMTimeoutError once the
+backend's <NAME>_TIMEOUT_SECONDS have passed. HTTP errors carry their status
+code in the message ("503 ...", "429 ..."), which is how query.py tells
+temporary failures from permanent ones. Each backend has its own circuit
+breaker, so an outage of one doesn't stop the others. Backends are created on
+first use, so an unused one needs no key, server or model file.
+
+Try a backend from the command line (from tbnow-back/):
+
+    LLM_PROVIDER=local LOCAL_LLM_MODEL_PATH=models/qwen2.5-1.5b-instruct-q4_k_m.gguf \\
+        python -m app.llm.providers "Apa gejala TBC pada anak?"
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import httpx
+from dotenv import load_dotenv
+
+from app.rag.breaker import CircuitBreaker
+
+load_dotenv()
+
+DEFAULT_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+QUERY_TYPES = ("quick", "diagnosis", "summary")
+
+class LLMTimeoutError(TimeoutError):
+    pass
+
+class LLMHTTPError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(f"{status_code} {detail}")
+        self.status_code = status_code
+
+class LLMProvider:
+    name = None
+
+    def __init__(self, model: str, timeout: float):
+        self.model = model
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(name=self.name)
+
+    def _stream(self, prompt: str):
+        raise NotImplementedError
+
+    def stream(self, prompt: str):
+        """Text chunks as they are generated"""
+        deadline = time.monotonic() + self.timeout
+        for chunk in self._stream(prompt):
+            if time.monotonic() > deadline:
+                raise LLMTimeoutError(f"{self.name} LLM timed out after {self.timeout:g}s")
+            if chunk:
+                yield chunk
+
+    def generate(self, prompt: str) -> str:
+        return "".join(self.stream(prompt))
+
+    def stats(self) -> dict:
+        return {"model": self.model, "timeout_seconds": self.timeout, "breaker": self.breaker.stats()}
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self):
+        from google import genai
+
+        super().__init__(os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite"),
+                         float(os.getenv("GEMINI_TIMEOUT_SECONDS", "30")))
+        http_options = {"timeout": int(self.timeout * 1000)}  # milliseconds
+        if os.getenv("GEMINI_BASE_URL"):
+            http_options["base_url"] = os.getenv("GEMINI_BASE_URL")
+        self.client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"), http_options=http_options)
+
+    def generate(self, prompt: str) -> str:
+        try:
+            return self.client.models.generate_content(model=self.model, contents=prompt).text or ""
+        except httpx.TimeoutException as e:
+            raise LLMTimeoutError(f"gemini LLM timed out after {self.timeout:g}s") from e
+
+    def _stream(self, prompt: str):
+        try:
+            for chunk in self.client.models.generate_content_stream(model=self.model, contents=prompt):
+                yield chunk.text or ""
+        except httpx.TimeoutException as e:
+            raise LLMTimeoutError(f"gemini LLM timed out after {self.timeout:g}s") from e
+
+class OpenAICompatibleProvider(LLMProvider):
+    name = "openai"
+
+    def __init__(self):
+        super().__init__(os.getenv("OPENAI_MODEL", "gpt-4o-mini"), float(os.getenv("OPENAI_TIMEOUT_SECONDS", "30")))
+        self.base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+        api_key = os.getenv("OPENAI_API_KEY")
+        self.client = httpx.Client(
+            base_url=self.base_url,
+            headers={"Authorization": f"Bearer {api_key}"} if api_key else {},
+            timeout=self.timeout,
+        )
+
+    def _request(self, prompt: str, stream: bool) -> dict:
+        return {"model": self.model, "messages": [{"role": "user", "content": prompt}], "stream": stream}
+
+    def _raise_for_status(self, response):
+        if response.status_code >= 400:
+            response.read()
+            raise LLMHTTPError(response.status_code, response.text[:200])
+
+    def generate(self, prompt: str) -> str:
+        try:
+            response = self.client.post("/chat/completions", json=self._request(prompt, stream=False))
+        except httpx.TimeoutException as e:
+            raise LLMTimeoutError(f"openai LLM timed out after {self.timeout:g}s") from e
+        self._raise_for_status(response)
+        return response.json()["choices"][0]["message"]["content"] or ""
+
+    def _stream(self, prompt: str):
+        try:
+            with self.client.stream("POST", "/chat/completions", json=self._request(prompt, stream=True)) as response:
+                self._raise_for_status(response)
+                # Server-sent events: "data: {...}" lines, then "data: [DONE]"
+                for line in response.iter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    choices = json.loads(data).get("choices") or [{}]
+                    yield (choices[0].get("delta") or {}).get("content") or ""
+        except httpx.TimeoutException as e:
+            raise LLMTimeoutError(f"openai LLM timed out after {self.timeout:g}s") from e
+
+class LocalProvider(LLMProvider):
+    name = "local"
+
+    def __init__(self):
+        try:
+            from llama_cpp import Llama
+        except ImportError as e:
+            raise RuntimeError("The local LLM backend needs llama-cpp-python: pip install llama-cpp-python") from e
+        model_path = os.getenv("LOCAL_LLM_MODEL_PATH", "")
+        if not os.path.exists(model_path):
+            raise RuntimeError(f"Local LLM model not found: LOCAL_LLM_MODEL_PATH={model_path!r} (a .gguf file)")
+
+        super().__init__(os.path.basename(model_path), float(os.getenv("LOCAL_LLM_TIMEOUT_SECONDS", "120")))
+        self.max_tokens = int(os.getenv("LOCAL_LLM_MAX_TOKENS", "512"))
+        start = time.perf_counter()
+        self.llama = Llama(
+            model_path=model_path,
+            n_ctx=int(os.getenv("LOCAL_LLM_CONTEXT", "8192")),
+            n_threads=int(os.getenv("LOCAL_LLM_THREADS", str(os.cpu_count() or 4))),
+            verbose=False,
+        )
+        print(f"✅ Local LLM {self.model} loaded in {time.perf_counter() - start:.1f}s")
+        # One generation at a time: the model's context isn't shared between threads
+        self._lock = threading.Lock()
+
+    def _stream(self, prompt: str):
+        if not self._lock.acquire(timeout=self.timeout):
+            raise LLMTimeoutError(f"local LLM busy for {self.timeout:g}s")
+        try:
+            for part in self.llama.create_chat_completion(messages=[{"role": "user", "content": prompt}],
+                                                          max_tokens=self.max_tokens, stream=True):
+                yield part["choices"][0]["delta"].get("content") or ""
+        finally:
+            self._lock.release()
+
+PROVIDERS = {
+    "gemini": GeminiProvider,
+    "openai": OpenAICompatibleProvider,
+    "local": LocalProvider,
+}
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+def provider_name(query_type: str) -> str:
+    name = os.getenv(f"LLM_PROVIDER_{query_type.upper()}", DEFAULT_PROVIDER) if query_type in QUERY_TYPES \
+        else DEFAULT_PROVIDER
+    if name not in PROVIDERS:
+        raise RuntimeError(f"Unknown LLM provider {name!r} for {query_type}; available: {', '.join(PROVIDERS)}")
+    return name
+
+def get_provider(query_type: str = "quick") -> LLMProvider:
+    """The backend configured for a query type, created on first use"""
+    name = provider_name(query_type)
+    with _instances_lock:
+        if name not in _instances:
+            _instances[name] = PROVIDERS[name]()
+        return _instances[name]
+
+def llm_stats() -> dict:
+    """Backend per query type, and model, timeout and breaker state of the backends created so far"""
+    routing = {}
+    for query_type in QUERY_TYPES:
+        try:
+            routing[query_type] = provider_name(query_type)
+        except RuntimeError as e:
+            routing[query_type] = str(e)
+    with _instances_lock:
+        providers = {name: provider.stats() for name, provider in _instances.items()}
+    return {"routing": routing, "providers": providers}
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream one answer from the configured LLM backend")
+    parser.add_argument("prompt")
+    parser.add_argument("--query-type", default="quick", choices=QUERY_TYPES)
+    args = parser.parse_args()
+
+    provider = get_provider(args.query_type)
+    start = time.perf_counter()
+    first = None
+    for chunk in provider.stream(args.prompt):
+        first = first or time.perf_counter() - start
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+    total = time.perf_counter() - start
+    print(f"\n\n[{provider.name} {provider.model}: first token {first or total:.2f}s, total {total:.2f}s]",
+          file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -23,64 +23,43 @@ import logging
 logging.getLogger('tensorflow').setLevel(logging.ERROR)
 logging.getLogger('tf_keras').setLevel(logging.ERROR)
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request, Response, BackgroundTasks, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse
 from app.rag.query import rag_answer
+from app.llm.providers import llm_stats
+from app.rag.memory import update_summary
 from PIL import Image
 import io
 import json
 import os
 from datetime import datetime
 import uuid
-import sqlite3
-from contextlib import contextmanager
+from typing import Optional
 from app.xray.inference import quick_screen
+from app.xray.registry import model_manager
+from app.xray.shadow import shadow_runner, shadow_store
+from app.xray.heatmaps import heatmap_store, ImmutableStaticFiles, HEATMAP_DIR
+from app.records.db import get_db, init_database, row_to_record, query_records, search_records
+from app.records.bulk import EXPORTERS
+from app.records.cache import record_cache, record_version, record_etag, etag_matches, load_record
+from app.monitoring.metrics import registry as metrics_registry, CONTENT_TYPE as METRICS_CONTENT_TYPE, HTTP_REQUEST_SECONDS
+from app.monitoring.tracing import request_span
+from app.admission.limits import POLICIES, Rejected, client_key, policy_for
+from app.monitoring.profiling import (PROFILING_ENABLED, MAX_PROFILE_SECONDS, StackSampler,
+                                      profile_for, render as render_profile, request_profiler)
+from fastapi.responses import JSONResponse
+import asyncio
+import hmac
+import time
 
 app = FastAPI(title="TBNow API")
+# Heatmaps are content-addressed, so they can be cached forever
+app.mount("/static/heatmaps", ImmutableStaticFiles(directory=HEATMAP_DIR, check_dir=False), name="heatmaps")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Database setup
-DATABASE_PATH = "data/tbnow.db"
-
-@contextmanager
-def get_db():
-    """Context manager for database connections"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row  # Enable column access by name
-    try:
-        yield conn
-    finally:
-        conn.close()
-
-def init_database():
-    """Initialize database tables"""
-    with get_db() as conn:
-        # Create patient_records table
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS patient_records (
-                id TEXT PRIMARY KEY,
-                patient_id TEXT UNIQUE,
-                date TEXT,
-                type TEXT,
-                status TEXT,
-                result TEXT,
-                patient_info TEXT,  -- JSON string
-                xray_result TEXT,   -- JSON string
-                chat_history TEXT,  -- JSON string
-                created_at TEXT,
-                updated_at TEXT
-            )
-        ''')
-        
-        # Create indexes for better performance
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_patient_id ON patient_records(patient_id)')
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_status ON patient_records(status)')
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_date ON patient_records(date)')
-        
-        conn.commit()
-
 # Initialize database on startup
 init_database()
 
@@ -91,10 +70,61 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """Rate limits and concurrency caps for the expensive endpoints, before the body is read"""
+    policy = policy_for(request.method, request.url.path)
+    if policy is None:
+        return await call_next(request)
+    try:
+        await policy.acquire(client_key(request.headers, request.client))
+    except Rejected as e:
+        # Rejected before routing: let observe_request label it by the route template
+        request.scope["route"] = next((r for r in app.routes if getattr(r, "path", None) == policy.path), None)
+        return JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
+    try:
+        return await call_next(request)
+    finally:
+        policy.release()
+
+# Registered last, so it wraps admission_control and also sees its rejections
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    """Per-request duration metric, root tracing span and, when armed, a request profile"""
+    start = time.perf_counter()
+    status = 500
+    profile = request_profiler.claim(request.url.path) if PROFILING_ENABLED else None
+    sampler = StackSampler(profile[0]).start() if profile else None
+    with request_span(f"{request.method} {request.url.path}", request.headers.get("traceparent")) as span:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            if span.trace_id:
+                response.headers["X-Trace-Id"] = span.trace_id
+            return response
+        finally:
+            # Label by route template (/records/{record_id}), never the raw path
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            span.update_name(f"{request.method} {route}")
+            span.set_attribute("http.method", request.method)
+            span.set_attribute("http.route", route)
+            span.set_attribute("http.status_code", status)
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method, route=route, status=status)
+            if sampler is not None and not profile[1].done():
+                profile[1].set_result(sampler.stop())
+
 
 class QueryRequest(BaseModel):
     question: str
     query_type: str = "quick"
+    mode: str = "generate"  # "retrieval": guideline passages only, no LLM call
+    # Retrieval filters (see GET /rag/filters); each list matches any of its values
+    documents: Optional[list[str]] = None  # substrings of guideline file names
+    language: Optional[str] = None         # "id" or "en"
+    topics: Optional[list[str]] = None     # topic tags assigned at ingest
+
+    def filters(self) -> dict:
+        return {"documents": self.documents, "language": self.language, "topics": self.topics}
 
 class PatientInfo(BaseModel):
     name: str = ""
@@ -117,16 +147,135 @@ class RecordUpdate(BaseModel):
     notes: str = ""
 
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of this worker's counters and stage latency histograms"""
+    return Response(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+# Sync handlers run in the threadpool, so a slow LLM call or forward pass doesn't
+# block the event loop and the admission concurrency caps mean what they say
+
 @app.post("/rag/query")
-async def rag_query(request: QueryRequest):
+def rag_query(request: QueryRequest):
     query_type = getattr(request, 'query_type', 'quick')
-    return rag_answer(request.question, query_type)
+    try:
+        return rag_answer(request.question, query_type, request.mode, request.filters())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/rag/filters")
+def rag_filters():
+    """Guideline documents, languages and topics that /rag/query can filter on, with chunk counts"""
+    from app.rag import query
+    if query.store is None:
+        return {"documents": [], "languages": {}, "topics": {}}
+    return {**query.store.filters(), "search": query.searcher.stats() if query.searcher else None}
 
 
 @app.post("/xray/analyze")
-async def analyze_xray(file: UploadFile = File(...)):
-    image = Image.open(io.BytesIO(await file.read()))
-    return quick_screen(image)
+def analyze_xray(file: UploadFile = File(...), heatmap: str = Query("overlay", pattern="^(overlay|cam)$")):
+    image = Image.open(io.BytesIO(file.file.read()))
+    return quick_screen(image, heatmap=heatmap)
+
+@app.get("/admin/limits")
+def admission_limits():
+    """Current in-flight/waiting counts and configured limits per protected endpoint"""
+    return {path: policy.stats() for path, policy in POLICIES.items()}
+
+@app.get("/admin/llm")
+def llm_status():
+    """LLM backend per query type, and each backend's model, timeout and circuit breaker state"""
+    return llm_stats()
+
+# Admin actions that change what is served or delete data need this token in X-Admin-Token
+ADMIN_TOKEN = os.getenv("TBNOW_ADMIN_TOKEN", "")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin actions are disabled; set TBNOW_ADMIN_TOKEN")
+    if not hmac.compare_digest((x_admin_token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Missing or invalid X-Admin-Token")
+
+@app.post("/admin/heatmaps/gc", dependencies=[Depends(require_admin)])
+def heatmaps_gc(retention_days: Optional[float] = None, dry_run: bool = False):
+    """Delete heatmaps no record references that are older than the retention window"""
+    if retention_days is None:
+        return heatmap_store.gc(dry_run=dry_run)
+    return heatmap_store.gc(retention_days, dry_run=dry_run)
+
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def profile(
+    seconds: float = Query(10, gt=0),
+    path: Optional[str] = None,
+    interval_ms: float = Query(5, ge=1, le=100),
+    format: str = Query("collapsed", pattern="^(collapsed|speedscope)$"),
+):
+    """
+    Sample this worker's stacks for `seconds`, or (with `path`) wait up to `seconds`
+    for the next request under that path prefix and profile just its duration.
+    Returns folded stacks or speedscope JSON for a flame graph.
+    """
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=403, detail="Profiling is disabled; set TBNOW_PROFILING=1")
+    seconds = min(seconds, MAX_PROFILE_SECONDS)
+    interval = interval_ms / 1000
+    if path is None:
+        try:
+            sampler = await profile_for(seconds, interval)
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        name = f"{seconds:g}s"
+    else:
+        try:
+            future = request_profiler.arm(path, interval)
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        try:
+            sampler = await asyncio.wait_for(asyncio.shield(future), seconds)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=408, detail=f"No request under {path} completed within {seconds:g}s")
+        finally:
+            request_profiler.disarm(future)
+        name = f"request {path}"
+
+    body, media_type = render_profile(sampler, format, name)
+    headers = {"X-Profile-Samples": str(sampler.sample_count), "X-Profile-Seconds": f"{sampler.duration:.3f}"}
+    if format == "speedscope":
+        return JSONResponse(body, headers=headers)
+    return Response(body, media_type=media_type, headers=headers)
+
+@app.get("/admin/xray/models")
+def xray_models():
+    """Registered X-ray model versions, the active one and the one this worker serves"""
+    return model_manager.status()
+
+@app.post("/admin/xray/models/{version}/activate", dependencies=[Depends(require_admin)])
+def activate_xray_model(version: str):
+    """Preload and warm up a registered version, then swap it in; other workers follow via the registry"""
+    try:
+        return model_manager.activate(version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+
+@app.get("/admin/xray/shadow")
+def xray_shadow_report(since: Optional[str] = None):
+    """Shadow model status and its agreement/latency against the served models"""
+    return {**shadow_runner.status(), "report": shadow_store.report(since)}
+
+@app.post("/admin/xray/shadow", dependencies=[Depends(require_admin)])
+def configure_xray_shadow(version: str, sample_rate: Optional[float] = None):
+    """Run a registered version as the shadow model on a sampled fraction of /xray/analyze"""
+    try:
+        return shadow_runner.configure(version, sample_rate)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/admin/xray/shadow", dependencies=[Depends(require_admin)])
+def disable_xray_shadow():
+    return shadow_runner.disable()
 
 # Records endpoints
 @app.get("/records")
@@ -136,24 +285,70 @@ async def get_records():
             SELECT * FROM patient_records 
             ORDER BY created_at DESC
         ''')
-        records = []
-        for row in cursor.fetchall():
-            record = dict(row)
-            # Parse JSON fields
-            record['patientInfo'] = json.loads(record['patient_info']) if record['patient_info'] else {}
-            record['xrayResult'] = json.loads(record['xray_result']) if record['xray_result'] else None
-            record['chatHistory'] = json.loads(record['chat_history']) if record['chat_history'] else []
-            # Remove old field names
-            del record['patient_info']
-            del record['xray_result'] 
-            del record['chat_history']
-            records.append(record)
+        records = [row_to_record(row) for row in cursor.fetchall()]
         return {"records": records}
 
+@app.get("/records/query")
+async def filter_records(
+    risk_level: Optional[str] = None,
+    min_confidence: Optional[float] = None,
+    max_confidence: Optional[float] = None,
+    gender: Optional[str] = None,
+    min_age: Optional[int] = None,
+    max_age: Optional[int] = None,
+    symptom: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    model_version: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    """Filter records in SQL by X-ray risk/confidence and patient demographics"""
+    records, total = query_records(
+        risk_level=risk_level,
+        min_confidence=min_confidence,
+        max_confidence=max_confidence,
+        gender=gender,
+        min_age=min_age,
+        max_age=max_age,
+        symptom=symptom,
+        status=status,
+        date_from=date_from,
+        date_to=date_to,
+        model_version=model_version,
+        limit=limit,
+        offset=offset,
+    )
+    return {"records": records, "total": total, "limit": limit, "offset": offset}
+
+@app.get("/records/search")
+async def search_records_endpoint(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+):
+    """Full-text search over patient name, symptoms, assessment and chat history"""
+    hits, total = search_records(q, limit=limit, offset=offset)
+    return {"results": hits, "total": total, "limit": limit, "offset": offset}
+
+@app.get("/records/export")
+def export_records(format: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    """Stream every record as NDJSON or CSV without loading the table into memory"""
+    exporter, media_type = EXPORTERS[format]
+    filename = f"tbnow-records-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{format}"
+    return StreamingResponse(
+        exporter(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
 @app.post("/records")
 async def create_record(request: DiagnosisRequest):
     # Generate patient ID
-    patient_id = f"TB-{datetime.now().year}-{str(len(get_records()['records']) + 1).zfill(3)}"
+    with get_db() as conn:
+        record_count = conn.execute('SELECT COUNT(*) FROM patient_records').fetchone()[0]
+    patient_id = f"TB-{datetime.now().year}-{str(record_count + 1).zfill(3)}"
     
     # Determine status based on assessment
     assessment_lower = request.assessment.lower()
@@ -203,33 +398,48 @@ async def create_record(request: DiagnosisRequest):
     
     return {"record": record, "message": "Record created successfully"}
 
+@app.get("/records/cache/stats")
+async def record_cache_stats():
+    return record_cache.stats()
+
+def get_record_or_404(record_id: str) -> dict:
+    """Cached record lookup shared by the record handlers (do not mutate the result)"""
+    record = load_record(record_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Record not found")
+    return record
+
 @app.get("/records/{record_id}")
-async def get_record(record_id: str):
-    with get_db() as conn:
-        cursor = conn.execute('SELECT * FROM patient_records WHERE id = ?', (record_id,))
-        row = cursor.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="Record not found")
-        
-        record = dict(row)
-        # Parse JSON fields
-        record['patientInfo'] = json.loads(record['patient_info']) if record['patient_info'] else {}
-        record['xrayResult'] = json.loads(record['xray_result']) if record['xray_result'] else None
-        record['chatHistory'] = json.loads(record['chat_history']) if record['chat_history'] else []
-        # Remove old field names
-        del record['patient_info']
-        del record['xray_result'] 
-        del record['chat_history']
-        return record
+async def get_record(record_id: str, request: Request, response: Response):
+    version = record_version(record_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Record not found")
 
+    # Polling clients revalidate with If-None-Match and get a bodiless 304
+    etag = record_etag(record_id, version)
+    if etag_matches(etag, request.headers.get("if-none-match")):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+    # The row may have changed or gone since the version lookup: tag the body actually sent
+    record = load_record(record_id, version)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Record not found")
+    response.headers["ETag"] = record_etag(record_id, record["updated_at"])
+    response.headers["Cache-Control"] = "no-cache"
+    return record
+
+# Sync like /rag/query: the LLM call must not block the event loop
 @app.post("/records/{record_id}/chat")
-async def add_chat_to_record(record_id: str, request: QueryRequest):
+def add_chat_to_record(record_id: str, request: QueryRequest, background_tasks: BackgroundTasks):
     # Get current record
-    record = await get_record(record_id)
+    record = get_record_or_404(record_id)
     
     # Get AI response using record-specific RAG
     from .rag.query import record_rag_answer
-    response = record_rag_answer(request.question, record, request.query_type)
+    try:
+        response = record_rag_answer(request.question, record, request.query_type, request.mode, request.filters())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     # Add to chat history
     chat_entry = {
@@ -237,34 +447,40 @@ async def add_chat_to_record(record_id: str, request: QueryRequest):
         "timestamp": datetime.now().isoformat(),
         "question": request.question,
         "response": response["answer"],
+        "sources": response.get("sources", []),
         "queryType": request.query_type
     }
     
-    chat_history = record.get("chatHistory", [])
-    chat_history.append(chat_entry)
+    updated_at = datetime.now().isoformat()
     
-    # Update record in database
+    # Append in SQL: concurrent chats on one record each add their turn instead of overwriting the list
     with get_db() as conn:
         conn.execute('''
             UPDATE patient_records 
-            SET chat_history = ?, updated_at = ?
+            SET chat_history = json_insert(coalesce(chat_history, '[]'), '$[#]', json(?)), updated_at = ?
             WHERE id = ?
         ''', (
-            json.dumps(chat_history),
-            datetime.now().isoformat(),
+            json.dumps(chat_entry),
+            updated_at,
             record_id
         ))
         conn.commit()
     
-    # Return updated record
-    updated_record = await get_record(record_id)
+    # Re-read rather than patch the snapshot from before the LLM call: other turns or the
+    # background summary may have been written meanwhile
+    record_cache.invalidate(record_id)
+    updated_record = get_record_or_404(record_id)
+
+    # Fold the previous turn into the stored conversation summary after the response is sent
+    background_tasks.add_task(update_summary, record_id)
     
     return {"chat": chat_entry, "record": updated_record}
 
 @app.put("/records/{record_id}")
 async def update_record(record_id: str, update: RecordUpdate):
     # Check if record exists
-    await get_record(record_id)
+    get_record_or_404(record_id)
+    updated_at = datetime.now().isoformat()
     
     # Update record in database
     with get_db() as conn:
@@ -274,24 +490,26 @@ async def update_record(record_id: str, update: RecordUpdate):
             WHERE id = ?
         ''', (
             update.status,
-            datetime.now().isoformat(),
+            updated_at,
             record_id
         ))
         conn.commit()
     
-    # Return updated record
-    updated_record = await get_record(record_id)
+    # Return the row as written: a snapshot from before the UPDATE could pin another writer's changes stale
+    record_cache.invalidate(record_id)
+    updated_record = get_record_or_404(record_id)
     
     return {"record": updated_record, "message": "Record updated successfully"}
 
 @app.delete("/records/{record_id}")
 async def delete_record(record_id: str):
     # Check if record exists
-    await get_record(record_id)
+    get_record_or_404(record_id)
     
     # Delete record from database
     with get_db() as conn:
         conn.execute('DELETE FROM patient_records WHERE id = ?', (record_id,))
         conn.commit()
+    record_cache.invalidate(record_id)
     
     return {"message": "Record deleted successfully"}
@@ -0,0 +1,185 @@
+"""
+Prometheus-style metrics for the API, served at GET /metrics.
+
+A small in-process registry of labelled counters and histograms rendered in
+the Prometheus text exposition format, so no client library is needed. Values
+are per process: with several uvicorn workers each one reports its own series
+and Prometheus scrapes (or sums) them per instance.
+
+Per-stage latencies all go into one histogram, tbnow_stage_seconds, labelled
+by stage (image_decode, preprocess, forward, gradcam_backward, heatmap_render,
+heatmap_write, embedding_encode, faiss_search, llm_call), so a dashboard can
+stack them to see which stage dominates the tail. SQLite statements are timed
+by operation in tbnow_sqlite_query_seconds via the connection get_db() opens.
+Each stage is also a tracing span (see tracing.py) when tracing is enabled.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from .tracing import span
+
+# Seconds; wide enough for sub-millisecond SQLite lookups and slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+_INF_BUCKET = 'le="+Inf"'
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                                for key, value in values]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        # Index of the first bucket with value <= upper bound; past the end means +Inf only
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with block in seconds, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._values.items())
+        lines = self.header()
+        for key, (counts, total, count) in values:
+            running = 0
+            for bound, c in zip(self.buckets, counts):
+                running += c
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {running}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, _INF_BUCKET)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # Re-imported module (e.g. under a reloader): keep the live series
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "tbnow_stage_seconds", "Duration of one pipeline stage", ["stage"])
+SQLITE_QUERY_SECONDS = registry.histogram(
+    "tbnow_sqlite_query_seconds", "Duration of SQLite statement execution", ["operation"])
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "tbnow_http_request_seconds", "HTTP request duration by route template", ["method", "route", "status"])
+CACHE_LOOKUPS = registry.counter(
+    "tbnow_cache_lookups_total", "Cache lookups by cache and result (hit/miss)", ["cache", "result"])
+LLM_RETRIES = registry.counter(
+    "tbnow_llm_retries_total", "LLM calls retried after a temporary failure")
+RAG_FALLBACKS = registry.counter(
+    "tbnow_rag_fallbacks_total", "RAG answers served from a fallback message instead of the LLM",
+    ["reason"])
+LLM_BREAKER_TRANSITIONS = registry.counter(
+    "tbnow_llm_breaker_transitions_total", "LLM circuit breaker state changes by backend and new state",
+    ["provider", "state"])
+ADMISSION_REJECTIONS = registry.counter(
+    "tbnow_admission_rejections_total", "Requests rejected before any work by rate limit or queue timeout",
+    ["route", "reason"])
+ADMISSION_WAIT_SECONDS = registry.histogram(
+    "tbnow_admission_wait_seconds", "Time spent waiting for a concurrency slot", ["route"])
+PROMPT_CHARS = registry.histogram(
+    "tbnow_llm_prompt_chars", "Size of prompts sent to the LLM in characters", ["prompt"],
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000))
+
+@contextmanager
+def stage_timer(stage: str):
+    """with stage_timer("forward"): ... -> one tbnow_stage_seconds observation (and a span when tracing)"""
+    with span(stage), STAGE_SECONDS.time(stage=stage):
+        yield
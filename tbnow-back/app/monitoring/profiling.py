@@ -0,0 +1,174 @@
+"""
+On-demand sampling profiler for a running server (POST /admin/profile).
+
+A background thread samples every thread's Python stack at a fixed interval
+through sys._current_frames(), so it sees the event loop, the threadpool
+running sync handlers and the batch workers alike, needs no restart or extra
+dependency, and costs nothing when idle. Samples are wall-clock: a thread
+blocked in I/O (e.g. waiting on Gemini) shows up where it waits.
+
+Profiles are returned as folded stacks ("thread;outer;...;inner count", for
+flamegraph.pl, inferno or speedscope) or as speedscope JSON with one profile
+per thread. A profile either covers N seconds of whatever the server is doing
+or is attached to the next request matching a path prefix; other requests in
+flight during that window are sampled too.
+
+Disabled unless TBNOW_PROFILING=1, and the endpoint needs the admin token
+(TBNOW_ADMIN_TOKEN). One time-window profile and one armed request profile
+run at a time; a second gets 409.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILING_ENABLED = os.getenv("TBNOW_PROFILING", "0") == "1"
+MAX_PROFILE_SECONDS = float(os.getenv("TBNOW_PROFILE_MAX_SECONDS", "60"))
+
+_STDLIB_DIR = os.path.dirname(os.__file__) + os.sep
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    marker = "site-packages" + os.sep
+    if marker in filename:
+        filename = filename.split(marker, 1)[1]
+    elif filename.startswith(_STDLIB_DIR):
+        filename = filename[len(_STDLIB_DIR):]
+    elif filename.startswith(os.getcwd()):
+        filename = os.path.relpath(filename)
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({filename}:{code.co_firstlineno})"
+
+class StackSampler:
+    """Counts folded stacks of all other threads every interval seconds"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = Counter()  # (thread name, frame labels outermost first) -> count
+        self.sample_count = 0
+        self.started_at = None
+        self.duration = 0.0
+        self._labels = {}  # code object -> label, computed once per function
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="tbnow-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+        return self
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _frame_label(code)
+        return label
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                self.samples[(names.get(thread_id, str(thread_id)), tuple(stack))] += 1
+            self.sample_count += 1
+
+    def collapsed(self) -> str:
+        """Folded stacks, one "thread;frame;...;frame count" line per unique stack"""
+        lines = [";".join((thread,) + stack) + f" {count}"
+                 for (thread, stack), count in self.samples.most_common()]
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self, name: str = "tbnow") -> dict:
+        """speedscope.app file format: one sampled profile per thread, weights in seconds"""
+        frames, frame_index = [], {}
+        profiles = {}
+        for (thread, stack), count in self.samples.items():
+            indices = []
+            for label in stack:
+                index = frame_index.get(label)
+                if index is None:
+                    index = frame_index[label] = len(frames)
+                    frames.append({"name": label})
+                indices.append(index)
+            profile = profiles.setdefault(thread, {
+                "type": "sampled", "name": f"{name} [{thread}]", "unit": "seconds",
+                "startValue": 0, "endValue": round(self.duration, 6), "samples": [], "weights": [],
+            })
+            profile["samples"].append(indices)
+            profile["weights"].append(round(count * self.interval, 6))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": list(profiles.values()),
+            "name": name,
+            "exporter": "tbnow-back",
+        }
+
+def render(sampler: StackSampler, fmt: str, name: str):
+    """(body, media type) for a finished sampler"""
+    if fmt == "speedscope":
+        return sampler.speedscope(name), "application/json"
+    return sampler.collapsed(), "text/plain; charset=utf-8"
+
+class RequestProfiler:
+    """Attaches a sampler to the next request whose path starts with a prefix"""
+
+    def __init__(self):
+        self._armed = None  # (path prefix, interval, future)
+        self._lock = threading.Lock()
+
+    def arm(self, path_prefix: str, interval: float) -> asyncio.Future:
+        with self._lock:
+            if self._armed is not None and not self._armed[2].done():
+                raise RuntimeError("Another request profile is already waiting")
+            future = asyncio.get_running_loop().create_future()
+            self._armed = (path_prefix, interval, future)
+            return future
+
+    def disarm(self, future: asyncio.Future):
+        with self._lock:
+            if self._armed is not None and self._armed[2] is future:
+                self._armed = None
+
+    def claim(self, path: str):
+        """The armed (interval, future) if this request should be profiled, at most once"""
+        with self._lock:
+            if self._armed is None or not path.startswith(self._armed[0]) or path.startswith("/admin/profile"):
+                return None
+            _, interval, future = self._armed
+            self._armed = None
+            return interval, future
+
+request_profiler = RequestProfiler()
+
+# Every sampler walks all stacks holding the GIL, so only one time-window profile runs at once
+_window_lock = threading.Lock()
+
+async def profile_for(seconds: float, interval: float) -> StackSampler:
+    """Sample the whole process for seconds without blocking the event loop"""
+    if not _window_lock.acquire(blocking=False):
+        raise RuntimeError("Another profile is already running")
+    try:
+        sampler = StackSampler(interval).start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()
+        return sampler
+    finally:
+        _window_lock.release()
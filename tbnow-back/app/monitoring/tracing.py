@@ -0,0 +1,209 @@
+"""
+Optional request-scoped tracing.
+
+Every HTTP request gets a root span (see the middleware in app/main.py), and
+the pipeline stages timed by metrics.stage_timer, SQLite statements and the
+RAG / X-ray entry points open child spans, so one trace shows where a slow
+request spent its time. Incoming W3C traceparent headers are continued and
+responses carry X-Trace-Id.
+
+TBNOW_TRACING selects the backend (default off, which costs one branch per
+span):
+    file  append finished spans as JSON lines (OTLP field names) to
+          TBNOW_TRACE_FILE, default data/traces.jsonl
+    otlp  export through the OpenTelemetry SDK to the collector configured by
+          the standard OTEL_EXPORTER_OTLP_* variables; needs
+          opentelemetry-sdk and opentelemetry-exporter-otlp
+"""
+
+import functools
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+TRACING_MODE = os.getenv("TBNOW_TRACING", "off").lower()
+TRACE_FILE = os.getenv("TBNOW_TRACE_FILE", "data/traces.jsonl")
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "tbnow-back")
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+class _NoopSpan:
+    trace_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def update_name(self, name):
+        pass
+
+    def record_exception(self, exc):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+class Span:
+    """A finished-on-exit span in the built-in file exporter"""
+
+    def __init__(self, name: str, trace_id: str, parent_id: str = None, attributes: dict = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = "OK"
+        self.start_ns = time.time_ns()
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def update_name(self, name):
+        self.name = name
+
+    def record_exception(self, exc):
+        self.status = "ERROR"
+        self.attributes["exception.type"] = type(exc).__name__
+        self.attributes["exception.message"] = str(exc)[:200]
+
+    def to_dict(self, end_ns: int) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": end_ns,
+            "duration_ms": round((end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "status": self.status,
+            "service": SERVICE_NAME,
+            "thread": threading.current_thread().name,
+        }
+
+class FileTracer:
+    """Spans tracked in a context variable and appended to a JSON-lines file"""
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        self._current = ContextVar("tbnow_span", default=None)
+        self._lock = threading.Lock()
+        self._file = None
+
+    def _write(self, record: dict):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._file.write(line)
+
+    def in_trace(self) -> bool:
+        return self._current.get() is not None
+
+    @contextmanager
+    def span(self, name: str, attributes: dict = None, traceparent: str = None):
+        parent = self._current.get()
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            match = _TRACEPARENT.match(traceparent or "")
+            trace_id, parent_id = match.groups() if match else (secrets.token_hex(16), None)
+        span = Span(name, trace_id, parent_id, attributes)
+        token = self._current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            self._current.reset(token)
+            self._write(span.to_dict(time.time_ns()))
+
+class _OtelSpan:
+    """Adapter exposing trace_id (hex) next to the OpenTelemetry span methods used here"""
+
+    def __init__(self, otel_span):
+        self._span = otel_span
+        self.trace_id = format(otel_span.get_span_context().trace_id, "032x")
+
+    def set_attribute(self, key, value):
+        self._span.set_attribute(key, value)
+
+    def update_name(self, name):
+        self._span.update_name(name)
+
+    def record_exception(self, exc):
+        self._span.record_exception(exc)
+
+class OtelTracer:
+    """The same interface on top of the OpenTelemetry SDK"""
+
+    def __init__(self):
+        from opentelemetry import propagate, trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+        provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(provider)
+        self._propagate = propagate
+        self._trace = trace
+        self._tracer = trace.get_tracer("tbnow")
+
+    def in_trace(self) -> bool:
+        return self._trace.get_current_span().get_span_context().is_valid
+
+    @contextmanager
+    def span(self, name: str, attributes: dict = None, traceparent: str = None):
+        context = self._propagate.extract({"traceparent": traceparent}) if traceparent else None
+        # start_as_current_span records exceptions and sets the error status itself
+        with self._tracer.start_as_current_span(name, context=context, attributes=attributes) as otel_span:
+            yield _OtelSpan(otel_span)
+
+def _create_tracer():
+    if TRACING_MODE == "file":
+        return FileTracer()
+    if TRACING_MODE == "otlp":
+        try:
+            return OtelTracer()
+        except ImportError as e:
+            print(f"⚠️  TBNOW_TRACING=otlp needs the OpenTelemetry SDK and OTLP exporter ({e}); tracing disabled")
+    elif TRACING_MODE not in ("off", "", "0"):
+        print(f"⚠️  Unknown TBNOW_TRACING={TRACING_MODE}; tracing disabled")
+    return None
+
+tracer = _create_tracer()
+
+def span(name: str, **attributes):
+    """with span("rag.answer", query_type=...) as s: ... (a no-op span when tracing is off)"""
+    if tracer is None:
+        return nullcontext(NOOP_SPAN)
+    return tracer.span(name, attributes)
+
+def child_span(name: str, **attributes):
+    """Like span(), but only inside an existing trace (e.g. SQLite statements, not startup DDL)"""
+    if tracer is None or not tracer.in_trace():
+        return nullcontext(NOOP_SPAN)
+    return tracer.span(name, attributes)
+
+def request_span(name: str, traceparent: str = None):
+    """Root span of an HTTP request, continuing the caller's trace if it sent traceparent"""
+    if tracer is None:
+        return nullcontext(NOOP_SPAN)
+    return tracer.span(name, traceparent=traceparent)
+
+def traced(name: str):
+    """Decorator: run the function inside a span called name"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,85 @@
+"""
+Circuit breaker around the LLM call, one per backend (app/llm/providers.py).
+
+After LLM_BREAKER_FAILURES consecutive failed calls (each after its retries)
+the breaker opens: for LLM_BREAKER_COOLDOWN_SECONDS every call fails at once
+with CircuitOpenError, so during an outage requests get the retrieval-only
+answer immediately instead of each one waiting through retries. After the
+cool-down a single trial call goes through (half-open); its success closes the
+breaker, its failure opens it for another cool-down.
+"""
+
+import os
+import threading
+import time
+
+from app.monitoring.metrics import LLM_BREAKER_TRANSITIONS
+
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM circuit breaker open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    def __init__(self, name: str = "llm", failure_threshold: int = BREAKER_FAILURES,
+                 cooldown: float = BREAKER_COOLDOWN_SECONDS):
+        self.name = name
+        self.failure_threshold = max(failure_threshold, 1)
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str):
+        if state != self.state:
+            self.state = state
+            LLM_BREAKER_TRANSITIONS.inc(provider=self.name, state=state)
+            print(f"LLM circuit breaker ({self.name}) {state}")
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go out now"""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if self.state == OPEN and remaining <= 0:
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            raise CircuitOpenError(max(remaining, 0.0))
+
+    def is_open(self) -> bool:
+        return self.state == OPEN
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_in_flight = False
+            self._transition(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+                self._transition(OPEN)
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "failure_threshold": self.failure_threshold,
+            "cooldown_seconds": self.cooldown,
+            "open_for_seconds": round(time.monotonic() - self.opened_at, 1) if self.state == OPEN else None,
+        }
@@ -0,0 +1,45 @@
+"""
+Guideline PDF text extraction and chunking strategies.
+
+ingest.py builds the served index with page_chunks (one chunk per PDF page,
+the original behaviour); benchmarks/rag_retrieval_bench.py compares every
+strategy in CHUNKERS on the same pages before one is switched in. Chunks keep
+the file name, page and character offsets within the page they came from,
+which ingest saves in the chunk store (store.py) for citations.
+"""
+
+import os
+
+from pypdf import PdfReader
+
+def extract_pages(pdf_dir: str = "data/guidelines") -> list:
+    """[{"doc": file name, "page": 1-based number, "text": ...}] for every PDF page"""
+    pages = []
+    for file in sorted(os.listdir(pdf_dir)):
+        if not file.lower().endswith(".pdf"):
+            continue
+        reader = PdfReader(os.path.join(pdf_dir, file))
+        for number, page in enumerate(reader.pages, start=1):
+            pages.append({"doc": file, "page": number, "text": page.extract_text() or ""})
+    return pages
+
+def page_chunks(pages: list) -> list:
+    """One chunk per page"""
+    return [{**page, "start": 0, "end": len(page["text"])} for page in pages]
+
+def window_chunks(pages: list, size: int = 1000, overlap: int = 200) -> list:
+    """Overlapping character windows within each page, so no chunk spans two pages"""
+    step = max(size - overlap, 1)
+    chunks = []
+    for page in pages:
+        text = page["text"]
+        for start in range(0, max(len(text) - overlap, 1), step):
+            end = min(start + size, len(text))
+            chunks.append({"doc": page["doc"], "page": page["page"], "start": start, "end": end,
+                           "text": text[start:end]})
+    return chunks
+
+CHUNKERS = {
+    "page": page_chunks,
+    "window": window_chunks,
+}
@@ -1,18 +1,18 @@
-from pypdf import PdfReader
 from sentence_transformers import SentenceTransformer
-import faiss, os, pickle
+import faiss, os
+
+from .chunking import extract_pages, page_chunks
+from .store import ChunkStore, LEGACY_CHUNKS_PATH, STORE_PATH
+from .tags import tag_chunks
 
 print(os.getcwd())
 MODEL = SentenceTransformer("all-MiniLM-L6-v2")
 
 def ingest_pdfs(pdf_dir="data/guidelines"):
     print("Starting ingest")
-    texts = []
-
-    for file in os.listdir(pdf_dir):
-        reader = PdfReader(os.path.join(pdf_dir, file))
-        for page in reader.pages:
-            texts.append(page.extract_text())
+    # Chunking changes should pass benchmarks/rag_retrieval_bench.py first
+    chunks = tag_chunks(page_chunks(extract_pages(pdf_dir)))
+    texts = [chunk["text"] for chunk in chunks]
 
     print(f"Extracted {len(texts)} texts")
     embeddings = MODEL.encode(texts)
@@ -21,7 +21,9 @@ def ingest_pdfs(pdf_dir="data/guidelines"):
     index.add(embeddings)
 
     faiss.write_index(index, "data/faiss.index")
-    pickle.dump(texts, open("data/chunks.pkl", "wb"))
+    ChunkStore.from_chunks(chunks).save(STORE_PATH)
+    if os.path.exists(LEGACY_CHUNKS_PATH):
+        os.remove(LEGACY_CHUNKS_PATH)  # superseded by the store, and would no longer match the index
 
     print("✅ RAG INGEST DONE")
 
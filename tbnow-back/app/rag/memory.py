@@ -0,0 +1,160 @@
+"""
+Conversation memory for record chat.
+
+Instead of the last five question/answer pairs verbatim (Gemini answers run to
+thousands of characters, so every turn made the next prompt bigger and
+slower), a record chat prompt carries a compact rolling summary of the earlier
+turns plus the last CHAT_VERBATIM_TURNS turns verbatim. The prompt size then
+stops growing after the first few turns.
+
+The summary is stored with the record (patient_records.conversation_summary,
+{"text", "turns", "updated_at"}, where turns is how many chat entries it
+covers). update_summary runs as a background task after each turn has been
+answered and saved, folding every entry but the newest into the summary, so
+the turn's latency doesn't include it. When the summary lags behind (the task
+hasn't finished yet, or history was imported), the missing turns are folded
+in extractively while the prompt is built.
+
+CHAT_SUMMARY_MODE=extractive (default) keeps, per turn, the question and the
+answer sentence that best matches it; no LLM call. CHAT_SUMMARY_MODE=llm asks
+the LLM (LLM_PROVIDER_SUMMARY, see app/llm/providers.py) to rewrite the summary and falls back to extractive if that fails.
+Either way the text is capped at CHAT_SUMMARY_MAX_CHARS, dropping the oldest
+turns first.
+"""
+
+import json
+import os
+import re
+from datetime import datetime
+
+from app.monitoring.metrics import PROMPT_CHARS
+from app.records.db import get_db
+from .passages import highlight, split_sentences
+
+SUMMARY_MODE = os.getenv("CHAT_SUMMARY_MODE", "extractive")
+SUMMARY_MAX_CHARS = int(os.getenv("CHAT_SUMMARY_MAX_CHARS", "1500"))
+VERBATIM_TURNS = int(os.getenv("CHAT_VERBATIM_TURNS", "1"))
+VERBATIM_MAX_CHARS = int(os.getenv("CHAT_VERBATIM_MAX_CHARS", "3000"))
+
+MAX_QUESTION_CHARS = 200
+MAX_POINT_CHARS = 300
+
+_MARKDOWN = re.compile(r"[*_#>`]+")
+# "**Rekomendasi**" or "## Rekomendasi" alone on a line, which split_sentences would glue to the next sentence
+_HEADING_LINE = re.compile(r"^(\s*(?:#+[^\n]*|\*\*[^*\n]+\*\*:?))[ \t]*\n", re.MULTILINE)
+
+SUMMARY_PROMPT = """Perbarui ringkasan konsultasi klinis berikut dengan percakapan baru di bawahnya.
+Tulis dalam bahasa Indonesia, maksimal {max_chars} karakter, sebagai poin-poin singkat.
+Pertahankan temuan klinis, rekomendasi pemeriksaan, dan keputusan penting; buang kalimat umum dan disclaimer.
+
+Ringkasan saat ini:
+{summary}
+
+Percakapan baru:
+{turns}
+
+Ringkasan baru:"""
+
+def _plain(text: str) -> str:
+    return " ".join(_MARKDOWN.sub("", text or "").split())
+
+def _clip(text: str, max_chars: int) -> str:
+    return text if len(text) <= max_chars else text[:max_chars].rsplit(" ", 1)[0] + " …"
+
+def turn_point(entry: dict) -> str:
+    """One summary line: the question and the answer sentence that best matches it"""
+    question = _clip(_plain(entry.get("question", "")), MAX_QUESTION_CHARS)
+    response = _HEADING_LINE.sub("\\1\n\n", entry.get("response", ""))
+    _, highlights = highlight(question, response, max_sentences=1)
+    if not highlights:
+        # The first sentence is usually a heading; take the first substantial one
+        highlights = [s for s in split_sentences(response) if len(_plain(s)) > 40][:1]
+    point = _clip(_plain(highlights[0]), MAX_POINT_CHARS) if highlights else "-"
+    return f"- T: {question} → J: {point}"
+
+def cap_summary(text: str, max_chars: int = SUMMARY_MAX_CHARS) -> str:
+    """Drop the oldest lines until the summary fits"""
+    lines = text.splitlines()
+    while len(lines) > 1 and len("\n".join(lines)) > max_chars:
+        lines.pop(0)
+    return _clip("\n".join(lines), max_chars)
+
+def extractive_summary(summary: str, entries: list) -> str:
+    return cap_summary("\n".join(filter(None, [summary] + [turn_point(entry) for entry in entries])))
+
+def llm_summary(summary: str, entries: list) -> str:
+    from .query import call_llm_with_retry  # query imports this module
+
+    turns = "\n\n".join(
+        f"T: {_plain(entry.get('question', ''))}\nJ: {_clip(_plain(entry.get('response', '')), VERBATIM_MAX_CHARS)}"
+        for entry in entries
+    )
+    prompt = SUMMARY_PROMPT.format(max_chars=SUMMARY_MAX_CHARS, summary=summary or "(belum ada)", turns=turns)
+    PROMPT_CHARS.observe(len(prompt), prompt="chat_summary")
+    return cap_summary(call_llm_with_retry(prompt, "summary")[0].strip())
+
+def summarize(summary: str, entries: list, mode: str = SUMMARY_MODE) -> str:
+    """The summary with entries folded in"""
+    if mode == "llm":
+        try:
+            return llm_summary(summary, entries)
+        except Exception as e:
+            print(f"⚠️  LLM chat summary failed, using extractive summary: {e}")
+    return extractive_summary(summary, entries)
+
+def stored_summary(record: dict):
+    """(summary text, turns it covers) for the record's chat history"""
+    summary = record.get("conversationSummary") or {}
+    turns = summary.get("turns", 0)
+    if turns > len(record.get("chatHistory") or []):
+        return "", 0  # history was replaced since; the summary no longer describes it
+    return summary.get("text", ""), turns
+
+def conversation_context(record: dict) -> list:
+    """Prompt lines: the summary of earlier turns and the latest turns verbatim"""
+    history = record.get("chatHistory") or []
+    if not history:
+        return []
+    summary, turns = stored_summary(record)
+    verbatim_from = max(len(history) - VERBATIM_TURNS, 0)
+    if turns < verbatim_from:
+        # Background update still pending: fold the gap in now, without storing it
+        summary = extractive_summary(summary, history[turns:verbatim_from])
+
+    lines = []
+    if summary:
+        lines += ["\nRINGKASAN KONSULTASI SEBELUMNYA:", summary]
+    lines.append("\nPERCAKAPAN TERAKHIR:")
+    for chat in history[verbatim_from:]:
+        lines.append(f"Q: {chat.get('question', '')}")
+        lines.append(f"A: {_clip(chat.get('response', ''), VERBATIM_MAX_CHARS)}")
+        lines.append("---")
+    return lines
+
+def update_summary(record_id: str, mode: str = SUMMARY_MODE):
+    """Fold all chat entries but the newest VERBATIM_TURNS into the stored summary"""
+    with get_db() as conn:
+        row = conn.execute('SELECT chat_history, conversation_summary FROM patient_records WHERE id = ?',
+                           (record_id,)).fetchone()
+    if row is None:
+        return
+    record = {
+        "chatHistory": json.loads(row["chat_history"]) if row["chat_history"] else [],
+        "conversationSummary": json.loads(row["conversation_summary"]) if row["conversation_summary"] else None,
+    }
+    history = record["chatHistory"]
+    summary, turns = stored_summary(record)
+    target = len(history) - VERBATIM_TURNS
+    if target <= turns:
+        return
+
+    updated = {"text": summarize(summary, history[turns:target], mode), "turns": target,
+               "updated_at": datetime.now().isoformat()}
+    with get_db() as conn:
+        # Only if no concurrent update replaced the summary meanwhile; bump updated_at so caches and ETags refresh
+        conn.execute('''
+            UPDATE patient_records
+            SET conversation_summary = ?, updated_at = ?
+            WHERE id = ? AND conversation_summary IS ?
+        ''', (json.dumps(updated), updated["updated_at"], record_id, row["conversation_summary"]))
+        conn.commit()
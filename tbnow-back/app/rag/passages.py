@@ -0,0 +1,85 @@
+"""
+Retrieval-only answers: the retrieved guideline passages themselves.
+
+Each passage is cut around the sentences that share the most words with the
+question, which are highlighted, and labelled with its source file and page.
+Used for the "retrieval" query mode and in place of canned text whenever the
+LLM is unavailable; it costs only the embedding and FAISS search already done
+for the prompt, so it is served in tens of milliseconds.
+"""
+
+import re
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+# Sentence ends, except after list numbers ("1. "); blank lines; bullets
+_SENTENCE_END = re.compile(r"(?<=[^\d\s][.!?])\s+|\n\s*\n|\s+(?=[●•▪]\s)")
+
+# Words too common to say anything about relevance
+STOPWORDS = {
+    "apa", "yang", "dan", "atau", "di", "ke", "dari", "untuk", "pada", "dengan", "adalah", "ini", "itu",
+    "saja", "bagaimana", "berapa", "kapan", "siapa", "apakah", "dalam", "tidak", "bisa", "harus", "akan",
+    "the", "and", "for", "with", "what", "which", "how", "does", "are", "is", "of", "to", "in", "on", "a",
+    "an", "be", "by", "or", "should", "when", "who", "why",
+}
+
+MAX_EXCERPT_CHARS = 600
+
+def _terms(text: str) -> set:
+    return {word for word in _WORD.findall(text.lower()) if len(word) > 2 and word not in STOPWORDS}
+
+def split_sentences(text: str) -> list:
+    # pypdf text wraps mid-sentence and pads words with runs of spaces
+    text = re.sub(r"(?<!\n)\n(?!\n)", " ", text)
+    return [re.sub(r"\s+", " ", s).strip() for s in _SENTENCE_END.split(text) if s and s.strip()]
+
+def highlight(question: str, text: str, max_sentences: int = 2, max_chars: int = MAX_EXCERPT_CHARS):
+    """(excerpt around the best-matching sentences with them in **bold**, the matching sentences)"""
+    sentences = split_sentences(text)
+    if not sentences:
+        return "", []
+    terms = _terms(question)
+    scores = [len(terms & _terms(sentence)) for sentence in sentences]
+    best = sorted((i for i, score in enumerate(scores) if score), key=lambda i: (-scores[i], i))[:max_sentences]
+    anchor = min(best) if best else 0
+
+    # Grow the excerpt from the first highlighted sentence while it fits
+    parts, length = [], 0
+    for i in range(max(anchor - 1, 0), len(sentences)):
+        sentence = sentences[i]
+        if parts and length + len(sentence) > max_chars:
+            break
+        parts.append(f"**{sentence}**" if i in best else sentence)
+        length += len(sentence) + 1
+    excerpt = " ".join(parts)
+    if len(excerpt) > max_chars + 4:
+        excerpt = excerpt[:max_chars].rsplit(" ", 1)[0] + " …"
+    return excerpt, [sentences[i] for i in sorted(best)]
+
+def build_passages(question: str, ids, distances, store) -> list:
+    """One dict per retrieved chunk of the ChunkStore, in retrieval order"""
+    passages = []
+    for chunk_id, distance in zip(ids, distances):
+        if chunk_id < 0:
+            continue
+        excerpt, highlights = highlight(question, store.text(chunk_id))
+        if not excerpt:
+            continue  # e.g. a scanned or blank PDF page
+        source = store.source(chunk_id)
+        passages.append({
+            "source": source["doc"] if source else None,
+            "page": source["page"] if source else None,
+            "citation": store.citation(chunk_id),
+            "excerpt": excerpt,
+            "highlights": highlights,
+            "distance": round(float(distance), 4),
+        })
+    return passages
+
+def format_passages(passages: list, heading: str) -> str:
+    """Markdown answer: the heading, then each excerpt with its citation"""
+    lines = [heading, ""]
+    for number, passage in enumerate(passages, start=1):
+        lines.append(f"**[{number}] {passage['citation']}**")
+        lines.append(f"> {passage['excerpt']}")
+        lines.append("")
+    return "\n".join(lines).rstrip()
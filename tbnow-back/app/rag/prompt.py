@@ -30,4 +30,18 @@ For quick guidance questions:
 
 Remember: You are a SUPPORT tool, not a replacement for clinical judgment.
 ALWAYS RESPOND IN INDONESIAN LANGUAGE.
-"""
\ No newline at end of file
+"""
+
+def format_question(question: str, query_type: str = "quick") -> str:
+    """The question as rag_answer embeds it and sends it to the LLM"""
+    if query_type == "diagnosis":
+        return f"""
+PERMINTAAN BANTUAN DIAGNOSIS PASIEN:
+
+{question}
+
+Berikan dukungan pengambilan keputusan klinis untuk screening TB berdasarkan informasi pasien di atas.
+Sertakan penilaian risiko, tes diagnostik yang direkomendasikan, dan pertimbangan klinis.
+"""
+    # quick guidance
+    return f"Pertanyaan bimbingan klinis cepat: {question}"
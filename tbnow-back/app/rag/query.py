@@ -1,68 +1,173 @@
 import faiss
-import pickle
 import os
 import time
 
 from sentence_transformers import SentenceTransformer
-from google import genai
 
-from .prompt import SYSTEM_PROMPT
+from app.llm.providers import LLMTimeoutError, get_provider
+from app.monitoring.metrics import LLM_RETRIES, PROMPT_CHARS, RAG_FALLBACKS, stage_timer
+from app.monitoring.tracing import traced
+from .breaker import CircuitOpenError
+from .memory import conversation_context
+from .passages import build_passages, format_passages
+from .prompt import SYSTEM_PROMPT, format_question
+from .store import GENERIC_CITATION, LEGACY_CHUNKS_PATH, STORE_PATH, load_store
+from .subindex import FilteredSearch
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Initialize Gemini client
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-
 # Load embedding model
 MODEL = SentenceTransformer("all-MiniLM-L6-v2")
 
-# Global variables for FAISS and chunks
+# Global variables for FAISS and the chunk store (text and source of each FAISS id)
 index = None
-chunks = None
+store = None
+searcher = None  # FilteredSearch over index
+
+def rag_data_ready() -> bool:
+    return os.path.exists("data/faiss.index") and (os.path.exists(STORE_PATH) or os.path.exists(LEGACY_CHUNKS_PATH))
 
 def load_rag_data():
-    global index, chunks
+    global index, store, searcher
     if index is None and os.path.exists("data/faiss.index"):
         index = faiss.read_index("data/faiss.index")
-    if chunks is None and os.path.exists("data/chunks.pkl"):
-        with open("data/chunks.pkl", "rb") as f:
-            chunks = pickle.load(f)
+        searcher = FilteredSearch(index)
+    if store is None:
+        store = load_store()
+        if store is not None and index is not None and len(store) != index.ntotal:
+            print(f"⚠️  Chunk store has {len(store)} chunks but the FAISS index {index.ntotal}; re-run ingest")
+
+def _is_temporary(error_message: str) -> bool:
+    return "503" in error_message or "UNAVAILABLE" in error_message or "overloaded" in error_message.lower()
 
-def call_gemini_with_retry(contents: str, max_retries: int = 2, retry_delay: float = 3.0):
+@traced("llm.generate")
+def call_llm_with_retry(prompt: str, query_type: str = "quick", max_retries: int = 2, retry_delay: float = 3.0):
     """
-    Call Gemini API with retry logic for temporary failures
+    (answer text, backend name) from the LLM backend configured for query_type,
+    retrying temporary failures. Raises CircuitOpenError without calling while
+    that backend's circuit breaker is open.
     """
+    provider = get_provider(query_type)
+    provider.breaker.before_call()
     for attempt in range(max_retries + 1):
         try:
-            response = client.models.generate_content(
-                model="gemini-2.5-flash-lite",
-                contents=contents
-            )
-            return response
+            with stage_timer("llm_call"):
+                text = provider.generate(prompt)
+            provider.breaker.record_success()
+            return text, provider.name
         except Exception as e:
             error_message = str(e)
             
             # Don't retry for permanent errors
-            if "400" in error_message or "401" in error_message or "403" in error_message:
+            if "400" in error_message:
+                # A rejected request still means the service is up
+                provider.breaker.record_success()
+                raise e
+            if "401" in error_message or "403" in error_message:
+                provider.breaker.record_failure()
                 raise e
             
-            # Retry for temporary errors
-            if attempt < max_retries and ("503" in error_message or "UNAVAILABLE" in error_message or "overloaded" in error_message.lower()):
-                print(f"Gemini API temporarily unavailable (attempt {attempt + 1}/{max_retries + 1}), retrying in {retry_delay}s...")
+            # Retry for temporary errors, unless other requests have opened the breaker meanwhile.
+            # A timeout already took the whole budget, so it isn't retried.
+            if (attempt < max_retries and _is_temporary(error_message) and not isinstance(e, LLMTimeoutError)
+                    and not provider.breaker.is_open()):
+                print(f"{provider.name} LLM temporarily unavailable (attempt {attempt + 1}/{max_retries + 1}), retrying in {retry_delay}s...")
+                LLM_RETRIES.inc()
                 time.sleep(retry_delay)
                 retry_delay *= 1.5  # Exponential backoff
                 continue
             
             # If we've exhausted retries or it's not a retryable error
+            provider.breaker.record_failure()
             raise e
 
 # Load data on import
 load_rag_data()
 
-def rag_answer(question: str, query_type: str = "quick"):
+def resolve_filters(filters: dict = None):
+    """
+    (cache key, chunk ids) for {"documents", "language", "topics"} filters, or
+    (None, None) without any. Raises ValueError for unknown values or when no
+    chunk matches.
+    """
+    filters = {name: value for name, value in (filters or {}).items() if value}
+    if not filters:
+        return None, None
+    ids = store.select(doc=filters.get("documents"), lang=filters.get("language"), topic=filters.get("topics"))
+    if len(ids) == 0:
+        raise ValueError(f"No guideline passages match the filters {filters}")
+    key = tuple((name, tuple(sorted([value] if isinstance(value, str) else value)))
+                for name, value in sorted(filters.items()))
+    return key, ids
+
+def search_guidelines(formatted_question: str, k: int, filters: dict = None):
+    """(chunk ids, L2 distances) of the k nearest guideline chunks matching the filters"""
+    key, candidates = resolve_filters(filters)
+    with stage_timer("embedding_encode"):
+        q_embed = MODEL.encode([formatted_question])
+    with stage_timer("faiss_search"):
+        D, I = searcher.search(q_embed, k, key, candidates)
+    return I[0], D[0]
+
+def _with_text(ids) -> list:
+    # Blank or scanned PDF pages are indexed too, but give the LLM nothing to cite
+    return [i for i in ids if i >= 0 and store.text(i).strip()]
+
+def build_context(ids) -> str:
+    """Retrieved chunks for the prompt, each under its citation"""
+    return "\n\n".join(f"[{store.citation(i)}]\n{store.text(i)}" for i in _with_text(ids))
+
+def cite(ids):
+    """(citation labels, [{"doc", "page", "start", "end"}]) of the retrieved chunks, in retrieval order"""
+    ids = _with_text(ids)
+    labels = list(dict.fromkeys(store.citation(i) for i in ids))
+    citations = [source for source in (store.source(i) for i in ids) if source]
+    return labels, citations
+
+def passage_response(question: str, ids, distances, heading: str, disclaimer: str, extra_sources=()) -> dict:
+    """Retrieval-only answer: the retrieved passages with citations and highlighted sentences"""
+    passages = build_passages(question, ids, distances, store)
+    return {
+        "answer": format_passages(passages, heading),
+        "sources": list(extra_sources) + list(dict.fromkeys(passage["citation"] for passage in passages)),
+        "citations": cite(ids)[1],
+        "passages": passages,
+        "disclaimer": disclaimer,
+        "mode": "retrieval",
+    }
+
+PASSAGES_INTRO = "Berikut kutipan pedoman yang paling relevan dengan pertanyaan Anda:"
+
+def llm_failure_response(error: Exception, question: str, ids, distances, extra_sources=()) -> dict:
+    """The retrieved passages under a notice saying why the AI answer is missing"""
+    error_message = str(error)
+    if isinstance(error, (CircuitOpenError, LLMTimeoutError)) or _is_temporary(error_message):
+        RAG_FALLBACKS.inc(reason="circuit_open" if isinstance(error, CircuitOpenError) else "unavailable")
+        heading = f"⚠️ **Layanan AI sementara tidak tersedia**\n\nModel AI sedang mengalami gangguan. {PASSAGES_INTRO}"
+        disclaimer = "Bukan diagnosis medis - layanan AI tidak tersedia"
+    elif "429" in error_message or "rate limit" in error_message.lower():
+        RAG_FALLBACKS.inc(reason="rate_limited")
+        heading = f"⚠️ **Batas permintaan tercapai**\n\nTerlalu banyak permintaan dalam waktu singkat. {PASSAGES_INTRO}"
+        disclaimer = "Bukan diagnosis medis - batas permintaan tercapai"
+    else:
+        RAG_FALLBACKS.inc(reason="error")
+        heading = (f"⚠️ **Kesalahan sistem**\n\nTerjadi kesalahan saat memproses permintaan Anda: "
+                   f"{error_message[:100]}...\n\n{PASSAGES_INTRO}")
+        disclaimer = "Bukan diagnosis medis - kesalahan sistem"
+    return passage_response(question, ids, distances, heading, disclaimer, extra_sources)
+
+@traced("rag.answer")
+def rag_answer(question: str, query_type: str = "quick", mode: str = "generate", filters: dict = None):
+    """
+    mode="retrieval" skips the LLM and returns the top guideline passages; the
+    same passages are returned whenever the LLM call fails or its breaker is open.
+    filters ({"documents", "language", "topics"}) restrict retrieval; an
+    unknown value or one matching nothing raises ValueError.
+    """
     # Check if data files exist
-    if not os.path.exists("data/faiss.index") or not os.path.exists("data/chunks.pkl"):
+    if not rag_data_ready():
+        RAG_FALLBACKS.inc(reason="not_ingested")
         return {
             "answer": "Data belum diingest. Silakan jalankan script ingestion setelah menambahkan file PDF ke folder data/guidelines/.",
             "sources": [],
@@ -70,32 +175,23 @@ def rag_answer(question: str, query_type: str = "quick"):
         }
 
     # Ensure data is loaded
-    if index is None or chunks is None:
+    if index is None or store is None:
         load_rag_data()
 
     # Format question based on type
-    if query_type == "diagnosis":
-        formatted_question = f"""
-PERMINTAAN BANTUAN DIAGNOSIS PASIEN:
+    formatted_question = format_question(question, query_type)
 
-{question}
+    # Embed user question and retrieve
+    ids, distances = search_guidelines(formatted_question, 5, filters)
 
-Berikan dukungan pengambilan keputusan klinis untuk screening TB berdasarkan informasi pasien di atas.
-Sertakan penilaian risiko, tes diagnostik yang direkomendasikan, dan pertimbangan klinis.
-"""
-    else:  # quick guidance
-        formatted_question = f"Pertanyaan bimbingan klinis cepat: {question}"
-
-    # Embed user question
-    q_embed = MODEL.encode([formatted_question])
-    _, I = index.search(q_embed, 5)
+    if mode == "retrieval":
+        return passage_response(question, ids, distances, f"📚 **Kutipan pedoman terkait**\n\n{PASSAGES_INTRO}",
+                                "Bukan diagnosis medis - kutipan pedoman tanpa ringkasan AI")
 
     # Build context
-    context = "\n".join([chunks[i] for i in I[0]])
+    context = build_context(ids)
 
-    # Call Gemini
-    try:
-        response = call_gemini_with_retry(f"""
+    prompt = f"""
 {SYSTEM_PROMPT}
 
 Context:
@@ -103,39 +199,32 @@ Context:
 
 Question:
 {formatted_question}
-""")
+"""
+    PROMPT_CHARS.observe(len(prompt), prompt="rag")
+
+    # Call the LLM backend configured for this query type
+    try:
+        answer, provider = call_llm_with_retry(prompt, query_type)
+        labels, citations = cite(ids)
         return {
-            "answer": response.text,
-            "sources": ["Pedoman TB WHO / SOP Kemenkes"],
+            "answer": answer,
+            "provider": provider,
+            "sources": labels or [GENERIC_CITATION],
+            "citations": citations,
             "disclaimer": "Bukan diagnosis medis"
         }
     except Exception as e:
-        error_message = str(e)
-        if "503" in error_message or "UNAVAILABLE" in error_message or "overloaded" in error_message.lower():
-            return {
-                "answer": "⚠️ **Layanan AI sementara tidak tersedia**\n\nModel AI sedang mengalami beban tinggi. Silakan coba lagi dalam beberapa menit.\n\n**Saran sementara:**\n- Gunakan pengetahuan klinis Anda untuk penilaian awal\n- Periksa gejala pasien secara menyeluruh\n- Lakukan pemeriksaan fisik dan tes dasar\n- Konsultasikan dengan spesialis jika diperlukan",
-                "sources": ["Fallback Response"],
-                "disclaimer": "Bukan diagnosis medis - layanan AI tidak tersedia"
-            }
-        elif "429" in error_message or "rate limit" in error_message.lower():
-            return {
-                "answer": "⚠️ **Batas permintaan tercapai**\n\nTerlalu banyak permintaan dalam waktu singkat. Silakan tunggu sebentar sebelum mencoba lagi.\n\n**Informasi alternatif:**\n- Tinjau pedoman TB WHO secara manual\n- Gunakan alat diagnostik standar\n- Konsultasikan dengan tim medis",
-                "sources": ["Rate Limited"],
-                "disclaimer": "Bukan diagnosis medis - batas permintaan tercapai"
-            }
-        else:
-            return {
-                "answer": f"⚠️ **Kesalahan sistem**\n\nTerjadi kesalahan saat memproses permintaan Anda: {error_message[:100]}...\n\nSilakan coba lagi atau hubungi administrator sistem.",
-                "sources": ["Error Response"],
-                "disclaimer": "Bukan diagnosis medis - kesalahan sistem"
-            }
-
-def record_rag_answer(question: str, record_data: dict, query_type: str = "quick"):
+        return llm_failure_response(e, question, ids, distances)
+
+@traced("rag.record_answer")
+def record_rag_answer(question: str, record_data: dict, query_type: str = "quick", mode: str = "generate",
+                      filters: dict = None):
     """
     Generate RAG answer specific to a patient record
     """
     # Check if data files exist
-    if not os.path.exists("data/faiss.index") or not os.path.exists("data/chunks.pkl"):
+    if not rag_data_ready():
+        RAG_FALLBACKS.inc(reason="not_ingested")
         return {
             "answer": "Data belum diingest. Silakan jalankan script ingestion setelah menambahkan file PDF ke folder data/guidelines/.",
             "sources": [],
@@ -143,7 +232,7 @@ def record_rag_answer(question: str, record_data: dict, query_type: str = "quick
         }
 
     # Ensure data is loaded
-    if index is None or chunks is None:
+    if index is None or store is None:
         load_rag_data()
 
     # Extract record-specific context
@@ -175,11 +264,15 @@ Berikan bimbingan klinis yang dipersonalisasi berdasarkan data pasien di atas.
 """
 
     # Embed user question with record context
-    q_embed = MODEL.encode([formatted_question])
-    _, I = index.search(q_embed, 3)  # Fewer chunks since we have specific record data
+    ids, distances = search_guidelines(formatted_question, 3, filters)  # Fewer chunks since we have specific record data
+
+    if mode == "retrieval":
+        return passage_response(question, ids, distances, f"📚 **Kutipan pedoman terkait**\n\n{PASSAGES_INTRO}",
+                                "Bukan diagnosis medis - kutipan pedoman tanpa ringkasan AI",
+                                ["Data Rekam Medis Pasien"])
 
     # Build context from clinical guidelines
-    clinical_context = "\n".join([chunks[i] for i in I[0]])
+    clinical_context = build_context(ids)
 
     # Combine record context with clinical guidelines
     full_context = f"""
@@ -190,9 +283,7 @@ PEDOMAN KLINIS REFERENSI:
 {clinical_context}
 """
 
-    # Call Gemini with record-specific context
-    try:
-        response = call_gemini_with_retry(f"""
+    prompt = f"""
 {SYSTEM_PROMPT}
 
 Konteks Pasien Spesifik:
@@ -203,32 +294,22 @@ Pertanyaan:
 
 Instruksi: Berikan jawaban yang sangat spesifik untuk pasien ini berdasarkan data rekam medis mereka.
 Jangan berikan nasihat umum - fokus pada situasi klinis pasien ini.
-""")
+"""
+    PROMPT_CHARS.observe(len(prompt), prompt="record_chat")
+
+    # Call the LLM with record-specific context
+    try:
+        answer, provider = call_llm_with_retry(prompt, query_type)
+        labels, citations = cite(ids)
         return {
-            "answer": response.text,
-            "sources": ["Data Rekam Medis Pasien", "Pedoman TB WHO / SOP Kemenkes"],
+            "answer": answer,
+            "provider": provider,
+            "sources": ["Data Rekam Medis Pasien"] + (labels or [GENERIC_CITATION]),
+            "citations": citations,
             "disclaimer": "Bukan diagnosis medis - konsultasikan dengan spesialis"
         }
     except Exception as e:
-        error_message = str(e)
-        if "503" in error_message or "UNAVAILABLE" in error_message or "overloaded" in error_message.lower():
-            return {
-                "answer": "⚠️ **Layanan AI sementara tidak tersedia**\n\nModel AI sedang mengalami beban tinggi. Silakan coba lagi dalam beberapa menit.\n\n**Saran alternatif untuk pasien ini:**\n- Tinjau data rekam medis secara manual\n- Gunakan pengetahuan klinis Anda untuk penilaian\n- Lakukan pemeriksaan fisik menyeluruh\n- Pertimbangkan konsultasi dengan spesialis TB",
-                "sources": ["Fallback Response"],
-                "disclaimer": "Bukan diagnosis medis - layanan AI tidak tersedia"
-            }
-        elif "429" in error_message or "rate limit" in error_message.lower():
-            return {
-                "answer": "⚠️ **Batas permintaan tercapai**\n\nTerlalu banyak permintaan dalam waktu singkat. Silakan tunggu sebentar sebelum mencoba lagi.\n\n**Informasi pasien tersedia:**\n- Data rekam medis lengkap dapat dilihat di atas\n- Riwayat konsultasi tersimpan dalam record\n- Hasil X-ray tersedia untuk review manual",
-                "sources": ["Rate Limited"],
-                "disclaimer": "Bukan diagnosis medis - batas permintaan tercapai"
-            }
-        else:
-            return {
-                "answer": f"⚠️ **Kesalahan sistem**\n\nTerjadi kesalahan saat memproses konsultasi pasien ini: {error_message[:100]}...\n\n**Data pasien masih tersedia untuk review manual:**\n- Riwayat lengkap dapat dilihat di record\n- Hasil pemeriksaan tersimpan\n- Chat history tersedia",
-                "sources": ["Error Response"],
-                "disclaimer": "Bukan diagnosis medis - kesalahan sistem"
-            }
+        return llm_failure_response(e, question, ids, distances, ["Data Rekam Medis Pasien"])
 
 
 def build_record_context(record_data: dict) -> str:
@@ -267,13 +348,8 @@ def build_record_context(record_data: dict) -> str:
     if "result" in record_data:
         context_parts.append(f"\nASSESMENT AWAL: {record_data['result']}")
 
-    # Previous Chat History
-    if "chatHistory" in record_data and record_data["chatHistory"]:
-        context_parts.append("\nRIWAYAT KONSULTASI SEBELUMNYA:")
-        for chat in record_data["chatHistory"][-5:]:  # Last 5 conversations
-            context_parts.append(f"Q: {chat.get('question', '')}")
-            context_parts.append(f"A: {chat.get('response', '')}")
-            context_parts.append("---")
+    # Previous chat: rolling summary plus the last turn verbatim
+    context_parts += conversation_context(record_data)
 
     # Status and Date
     if "status" in record_data:
@@ -0,0 +1,216 @@
+"""
+Columnar chunk store saved next to the FAISS index (data/chunks.npz).
+
+Row i describes FAISS id i: the source document, its 1-based page, the
+chunk's character offsets within that page's extracted text, its language and
+topic tags (tags.py, as a bitmask over the topic names) and the chunk text.
+Columns are plain NumPy arrays, with document names stored once and
+texts kept as one UTF-8 buffer plus offsets, so the file stays compact, loads
+without pickle and can be filtered with vectorized comparisons (e.g. all ids
+of one document).
+
+Answers cite chunks as "<file>, hlm. <page>". The store can be inspected
+without the PDFs:
+
+    python -m app.rag.store                        # documents, pages, chunks
+    python -m app.rag.store --doc DR-TB --page 11  # chunks of matching rows
+    python -m app.rag.store --grep BPaLM --show    # with their text
+    python -m app.rag.store --topic children --lang id
+
+An index ingested before the store existed only has data/chunks.pkl (texts
+without sources); it still loads, with a generic citation for every chunk.
+"""
+
+import argparse
+import os
+import pickle
+
+import numpy as np
+
+STORE_PATH = "data/chunks.npz"
+LEGACY_CHUNKS_PATH = "data/chunks.pkl"
+GENERIC_CITATION = "Pedoman TB WHO / SOP Kemenkes"
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+class ChunkStore:
+    def __init__(self, docs, doc, page, start, end, text, text_offsets,
+                 langs=(), lang=None, topic_names=(), topics=None):
+        self.docs = [str(name) for name in docs]
+        self.doc = np.asarray(doc, dtype=np.int16)           # index into docs, -1 if unknown
+        self.page = np.asarray(page, dtype=np.int32)
+        self.start = np.asarray(start, dtype=np.int32)       # offsets within the page text
+        self.end = np.asarray(end, dtype=np.int32)
+        self._text = np.asarray(text, dtype=np.uint8)
+        self._text_offsets = np.asarray(text_offsets, dtype=np.int64)
+        # Stores written before tagging have no languages or topics
+        self.langs = [str(name) for name in langs]
+        self.lang = np.full(len(self.doc), -1, dtype=np.int8) if lang is None else np.asarray(lang, dtype=np.int8)
+        self.topic_names = [str(name) for name in topic_names]
+        self.topics = np.zeros(len(self.doc), dtype=np.uint32) if topics is None else np.asarray(topics, dtype=np.uint32)
+
+    @classmethod
+    def from_chunks(cls, chunks: list) -> "ChunkStore":
+        """From chunking.py dicts ({"doc", "page", "start", "end", "text"}, plus tags.py's "lang" and "topics";
+        all but "text" optional)"""
+        docs = sorted({chunk["doc"] for chunk in chunks if chunk.get("doc")})
+        doc_ids = {name: i for i, name in enumerate(docs)}
+        langs = sorted({chunk["lang"] for chunk in chunks if chunk.get("lang")})
+        lang_ids = {name: i for i, name in enumerate(langs)}
+        topic_names = sorted({topic for chunk in chunks for topic in chunk.get("topics", ())})
+        if len(topic_names) > 32:
+            raise ValueError(f"At most 32 topics fit the bitmask, got {len(topic_names)}")
+        topic_bits = {name: 1 << i for i, name in enumerate(topic_names)}
+        encoded = [chunk["text"].encode("utf-8") for chunk in chunks]
+        return cls(
+            docs,
+            [doc_ids.get(chunk.get("doc"), -1) for chunk in chunks],
+            [chunk.get("page", 0) for chunk in chunks],
+            [chunk.get("start", 0) for chunk in chunks],
+            [chunk.get("end", len(chunk["text"])) for chunk in chunks],
+            np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            np.concatenate([[0], np.cumsum([len(data) for data in encoded], dtype=np.int64)]),
+            langs,
+            [lang_ids.get(chunk.get("lang"), -1) for chunk in chunks],
+            topic_names,
+            [sum(topic_bits[topic] for topic in chunk.get("topics", ())) for chunk in chunks],
+        )
+
+    @classmethod
+    def from_texts(cls, texts: list) -> "ChunkStore":
+        return cls.from_chunks([{"text": text or ""} for text in texts])
+
+    def save(self, path: str = STORE_PATH):
+        # Written through a file object so np.savez doesn't append .npz to the name
+        with open(path, "wb") as f:
+            np.savez(f, docs=np.array(self.docs, dtype=str), doc=self.doc, page=self.page, start=self.start,
+                     end=self.end, text=self._text, text_offsets=self._text_offsets,
+                     langs=np.array(self.langs, dtype=str), lang=self.lang,
+                     topic_names=np.array(self.topic_names, dtype=str), topics=self.topics)
+
+    @classmethod
+    def load(cls, path: str = STORE_PATH) -> "ChunkStore":
+        with np.load(path) as data:
+            tagged = "lang" in data.files
+            return cls(data["docs"].tolist(), data["doc"], data["page"], data["start"], data["end"],
+                       data["text"], data["text_offsets"],
+                       data["langs"].tolist() if tagged else (), data["lang"] if tagged else None,
+                       data["topic_names"].tolist() if tagged else (), data["topics"] if tagged else None)
+
+    def __len__(self):
+        return len(self.doc)
+
+    def text(self, i: int) -> str:
+        return self._text[self._text_offsets[i]:self._text_offsets[i + 1]].tobytes().decode("utf-8")
+
+    def source(self, i: int):
+        """{"doc", "page", "start", "end"} of chunk i, or None if the store has no sources"""
+        if self.doc[i] < 0:
+            return None
+        return {"doc": self.docs[self.doc[i]], "page": int(self.page[i]),
+                "start": int(self.start[i]), "end": int(self.end[i])}
+
+    def citation(self, i: int) -> str:
+        if self.doc[i] < 0:
+            return GENERIC_CITATION
+        return f"{self.docs[self.doc[i]]}, hlm. {self.page[i]}"
+
+    def tags(self, i: int) -> dict:
+        return {
+            "lang": self.langs[self.lang[i]] if self.lang[i] >= 0 else None,
+            "topics": [name for bit, name in enumerate(self.topic_names) if self.topics[i] >> bit & 1],
+        }
+
+    def select(self, doc=None, page: int = None, lang=None, topic=None) -> np.ndarray:
+        """
+        Ids of the matching chunks, in index order. doc, lang and topic each take
+        a name or a list of names, any of which may match; doc matches a
+        case-insensitive substring of the file name. Unknown languages and
+        topics raise ValueError.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if doc is not None:
+            patterns = [pattern.lower() for pattern in _as_list(doc)]
+            matching = [i for i, name in enumerate(self.docs) if any(p in name.lower() for p in patterns)]
+            mask &= np.isin(self.doc, matching)
+        if page is not None:
+            mask &= self.page == page
+        if lang is not None:
+            unknown = set(_as_list(lang)) - set(self.langs)
+            if unknown:
+                raise ValueError(f"Unknown language {sorted(unknown)}; known: {self.langs}")
+            mask &= np.isin(self.lang, [self.langs.index(name) for name in _as_list(lang)])
+        if topic is not None:
+            unknown = set(_as_list(topic)) - set(self.topic_names)
+            if unknown:
+                raise ValueError(f"Unknown topic {sorted(unknown)}; known: {self.topic_names}")
+            bits = sum(1 << self.topic_names.index(name) for name in _as_list(topic))
+            mask &= (self.topics & np.uint32(bits)) != 0
+        return np.flatnonzero(mask)
+
+    def documents(self) -> list:
+        """[{"doc", "chunks", "pages"}] per source document"""
+        documents = []
+        for i, name in enumerate(self.docs):
+            rows = self.doc == i
+            documents.append({"doc": name, "chunks": int(rows.sum()), "pages": int(self.page[rows].max())})
+        return documents
+
+    def filters(self) -> dict:
+        """The filter values with their chunk counts"""
+        return {
+            "documents": self.documents(),
+            "languages": {name: int((self.lang == i).sum()) for i, name in enumerate(self.langs)},
+            "topics": {name: int((self.topics >> bit & 1).sum()) for bit, name in enumerate(self.topic_names)},
+        }
+
+def load_store(store_path: str = STORE_PATH, legacy_path: str = LEGACY_CHUNKS_PATH):
+    """The ingested store, a source-less one from a pre-store chunks.pkl, or None"""
+    if os.path.exists(store_path):
+        return ChunkStore.load(store_path)
+    if os.path.exists(legacy_path):
+        with open(legacy_path, "rb") as f:
+            return ChunkStore.from_texts(pickle.load(f))
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the RAG chunk store (from tbnow-back/)")
+    parser.add_argument("--store", default=STORE_PATH)
+    parser.add_argument("--doc", help="Substring of the document file name")
+    parser.add_argument("--page", type=int)
+    parser.add_argument("--lang")
+    parser.add_argument("--topic")
+    parser.add_argument("--grep", help="Only chunks containing this text (case-insensitive)")
+    parser.add_argument("--show", action="store_true", help="Print chunk texts")
+    args = parser.parse_args()
+
+    store = load_store(args.store)
+    if store is None:
+        raise SystemExit(f"{args.store} not found; run python -m app.rag.ingest first")
+    if all(value is None for value in (args.doc, args.page, args.lang, args.topic, args.grep)):
+        filters = store.filters()
+        for document in filters["documents"]:
+            print(f"{document['chunks']:6d} chunks  {document['pages']:4d} pages  {document['doc']}")
+        print(f"{len(store):6d} chunks total")
+        for kind in ("languages", "topics"):
+            print(f"{kind}: " + ", ".join(f"{name} ({count})" for name, count in filters[kind].items()))
+        return
+    try:
+        ids = store.select(args.doc, args.page, args.lang, args.topic)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    for i in ids:
+        text = store.text(i)
+        if args.grep and args.grep.lower() not in text.lower():
+            continue
+        tags = store.tags(i)
+        print(f"#{i:<5d} {store.citation(i)}  [{store.start[i]}:{store.end[i]}]  {len(text)} chars  "
+              f"{tags['lang'] or '-'} {','.join(tags['topics'])}")
+        if args.show:
+            print(f"    {' '.join(text.split())}\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Filtered FAISS search over a subset of chunk ids.
+
+For the served flat index, each distinct filter gets its own flat sub-index
+over just the matching vectors (reconstructed from the full index, no
+re-embedding), built on first use and kept in a small LRU cache. A flat search
+costs time proportional to the vectors scanned, so a filtered search is
+cheaper than an unfiltered one, and the results equal those of the full index
+restricted to the subset. Other index types (IVF, HNSW) can't be sliced that
+way and are searched with an IDSelector, which skips the excluded ids during
+the normal search.
+
+Cached sub-indexes belong to one loaded index; query.py makes a new
+FilteredSearch when it loads the index.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+MAX_CACHED_SUBINDEXES = int(os.getenv("RAG_MAX_CACHED_SUBINDEXES", "32"))
+
+class FilteredSearch:
+    def __init__(self, index, max_entries: int = MAX_CACHED_SUBINDEXES):
+        self.index = index
+        self.max_entries = max_entries
+        self.sliceable = isinstance(index, faiss.IndexFlat)
+        self._subindexes = OrderedDict()  # filter key -> (sub-index, its ids in the full index)
+        self._lock = threading.Lock()
+
+    def _subindex(self, key, ids: np.ndarray):
+        with self._lock:
+            if key in self._subindexes:
+                self._subindexes.move_to_end(key)
+                return self._subindexes[key]
+            sub = faiss.IndexFlat(self.index.d, self.index.metric_type)
+            sub.add(self.index.reconstruct_batch(ids.astype(np.int64)))
+            self._subindexes[key] = (sub, ids)
+            if len(self._subindexes) > self.max_entries:
+                self._subindexes.popitem(last=False)
+            return sub, ids
+
+    def search(self, embeddings, k: int, key=None, ids=None):
+        """(distances, ids) like index.search; key and ids restrict it to those chunk ids"""
+        if ids is None or len(ids) == self.index.ntotal:
+            return self.index.search(embeddings, k)
+        if len(ids) == 0:
+            return (np.full((len(embeddings), k), np.inf, dtype=np.float32),
+                    np.full((len(embeddings), k), -1, dtype=np.int64))
+        if not self.sliceable:
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(ids.astype(np.int64)))
+            return self.index.search(embeddings, k, params=params)
+        sub, sub_ids = self._subindex(key, ids)
+        D, I = sub.search(embeddings, k)
+        return D, np.where(I >= 0, sub_ids[np.maximum(I, 0)], -1)
+
+    def stats(self) -> dict:
+        return {
+            "cached_subindexes": len(self._subindexes),
+            "max_cached_subindexes": self.max_entries,
+            "cached_vectors": int(sum(sub.ntotal for sub, _ in self._subindexes.values())),
+        }
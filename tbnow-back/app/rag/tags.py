@@ -0,0 +1,53 @@
+"""
+Language and topic tags assigned to each chunk at ingest, for filtered retrieval.
+
+Both are cheap keyword heuristics over the chunk text, so they need no model
+and re-running the ingest reproduces them exactly. A chunk gets a topic when at
+least MIN_TOPIC_HITS of the topic's terms occur in it (one passing mention of
+"anak" doesn't make a page about children); it can have several topics or
+none. Terms match at the start of a word, so "resistan" covers "resistance"
+and "resistant".
+"""
+
+import re
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+LANGUAGE_STOPWORDS = {
+    "id": {"yang", "dan", "untuk", "dengan", "pada", "adalah", "tidak", "dari", "ini", "dalam", "akan", "atau"},
+    "en": {"the", "and", "of", "to", "with", "for", "is", "are", "in", "be", "should", "or"},
+}
+
+TOPICS = {
+    "screening": ["skrining", "screening", "penapisan", "investigasi kontak", "contact investigation",
+                  "penemuan kasus", "case finding"],
+    "diagnosis": ["diagnos", "xpert", "tcm", "tes cepat", "rapid test", "mwrd", "sputum", "dahak", "mikroskop",
+                  "culture", "biakan", "rontgen", "x-ray", "radiograf", "lpa"],
+    "treatment": ["pengobatan", "treatment", "regimen", "paduan", "oat", "dosis", "dose", "obat"],
+    "drug_resistant": ["mdr", "rr-tb", "xdr", "resistan", "tb ro", "tb-ro", "bpal", "bedaquiline", "bdq"],
+    "prevention": ["tpt", "pencegahan", "preventive", "prevention", "bcg", "infeksi laten", "latent", "ilt"],
+    "children": ["anak", "child", "pediatri", "paediatri", "adolescent", "remaja", "bayi", "infant"],
+    "hiv": ["hiv", "odhiv", "odha", "arv", "antiretroviral"],
+}
+
+MIN_TOPIC_HITS = 2
+
+_TOPIC_PATTERNS = {
+    topic: re.compile(r"\b(?:" + "|".join(re.escape(term) for term in terms) + ")", re.IGNORECASE)
+    for topic, terms in TOPICS.items()
+}
+
+def detect_language(text: str):
+    """"id" or "en" by stopword counts, None for text with neither (e.g. a blank page)"""
+    words = _WORD.findall(text.lower())
+    counts = {lang: sum(word in stopwords for word in words) for lang, stopwords in LANGUAGE_STOPWORDS.items()}
+    lang = max(counts, key=counts.get)
+    return lang if counts[lang] else None
+
+def topic_tags(text: str) -> list:
+    return [topic for topic, pattern in _TOPIC_PATTERNS.items() if len(pattern.findall(text)) >= MIN_TOPIC_HITS]
+
+def tag_chunks(chunks: list) -> list:
+    """The chunks with "lang" and "topics" added"""
+    return [{**chunk, "lang": detect_language(chunk["text"]), "topics": topic_tags(chunk["text"])}
+            for chunk in chunks]
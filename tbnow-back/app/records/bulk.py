@@ -0,0 +1,247 @@
+# tbnow-back/app/records/bulk.py
+"""
+Streaming bulk import/export of patient records.
+
+Import reads NDJSON or a JSON array incrementally and inserts in batched
+transactions; export streams NDJSON or CSV straight from a cursor. Neither
+side ever holds the whole table in memory.
+
+Usage:
+    python -m app.records.bulk import records.ndjson
+    python -m app.records.bulk export --format csv --output records.csv
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+
+from . import db
+
+BATCH_SIZE = 1000
+READ_CHUNK_SIZE = 1 << 16
+
+# Export/import columns with the field each one has in the legacy data/patient_records.json
+RECORD_FIELDS = (
+    ("id", "id"),
+    ("patient_id", "patientId"),
+    ("date", "date"),
+    ("type", "type"),
+    ("status", "status"),
+    ("result", "result"),
+    ("patient_info", "patientInfo"),
+    ("xray_result", "xrayResult"),
+    ("chat_history", "chatHistory"),
+    ("conversation_summary", "conversationSummary"),
+    ("created_at", "createdAt"),
+    ("updated_at", "updatedAt"),
+)
+JSON_COLUMNS = {"patient_info", "xray_result", "chat_history", "conversation_summary"}
+
+INSERT_SQL = f'''
+    INSERT INTO patient_records ({', '.join(column for column, _ in RECORD_FIELDS)})
+    VALUES ({', '.join('?' for _ in RECORD_FIELDS)})
+    ON CONFLICT DO NOTHING
+'''
+
+
+def iter_json_records(fp):
+    """
+    Yield records from a text stream containing either NDJSON or a JSON array,
+    decoding one object at a time.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    in_array = None
+    eof = False
+
+    while True:
+        # Skip whitespace and array punctuation between objects
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) or eof:
+                break
+            chunk = fp.read(READ_CHUNK_SIZE)
+            buffer, pos = buffer[pos:] + chunk, 0
+            eof = not chunk
+
+        if pos >= len(buffer):
+            return
+
+        if in_array is None:
+            in_array = buffer[pos] == "["
+            if in_array:
+                pos += 1
+                continue
+        if in_array and buffer[pos] == "]":
+            return
+
+        try:
+            obj, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # Object spans the chunk boundary: read more and retry
+            chunk = fp.read(READ_CHUNK_SIZE)
+            buffer, pos = buffer[pos:] + chunk, 0
+            eof = not chunk
+            continue
+
+        yield obj
+        pos = end
+
+
+def _record_params(record: dict) -> tuple:
+    """Accept both legacy JSON-file (camelCase) and DB-shaped (snake_case) records"""
+    if not record.get("id") or not record.get("patientId", record.get("patient_id")):
+        raise ValueError("record needs 'id' and 'patientId'")
+    values = []
+    for column, field in RECORD_FIELDS:
+        value = record[field] if field in record else record.get(column)
+        if column in JSON_COLUMNS and value is not None and not isinstance(value, str):
+            value = json.dumps(value)
+        values.append(value)
+    return tuple(values)
+
+
+def import_records(records, batch_size: int = BATCH_SIZE, progress=None):
+    """
+    Insert records in batched transactions, skipping ids/patient ids that already exist.
+    Returns (inserted, skipped, failed).
+    """
+    inserted = skipped = failed = 0
+
+    with db.get_db() as conn:
+        conn.execute('PRAGMA synchronous = NORMAL')
+
+        def flush(batch):
+            nonlocal inserted, skipped
+            with conn:  # one transaction per batch
+                # rowcount excludes rows written by the FTS triggers
+                added = conn.executemany(INSERT_SQL, batch).rowcount
+            inserted += added
+            skipped += len(batch) - added
+            if progress:
+                progress(inserted, skipped, failed)
+
+        batch = []
+        for record in records:
+            try:
+                batch.append(_record_params(record))
+            except (KeyError, TypeError, ValueError) as e:
+                failed += 1
+                label = record.get('patientId', 'unknown') if isinstance(record, dict) else 'unknown'
+                print(f"❌ Skipping malformed record {label}: {e}")
+                continue
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+
+    return inserted, skipped, failed
+
+
+def import_file(path: str, batch_size: int = BATCH_SIZE, progress=None):
+    """Stream-import an NDJSON or JSON array file"""
+    with open(path, "r", encoding="utf-8") as f:
+        return import_records(iter_json_records(f), batch_size=batch_size, progress=progress)
+
+
+def _iter_rows(batch_size: int = BATCH_SIZE):
+    columns = ', '.join(column for column, _ in RECORD_FIELDS)
+    # The generator may be resumed from different threads by the streaming response
+    with db.get_db(check_same_thread=False) as conn:
+        cursor = conn.execute(f'SELECT {columns} FROM patient_records ORDER BY created_at')
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from rows
+
+
+def export_ndjson(batch_size: int = BATCH_SIZE):
+    """
+    Yield one JSON record per line in the legacy data/patient_records.json shape
+    (patientId, createdAt, updatedAt, ...; not the snake_case keys GET /records/{id}
+    returns), so the file is re-importable with import_file and migrate_to_sqlite.py
+    """
+    for row in _iter_rows(batch_size):
+        parts = []
+        for column, field in RECORD_FIELDS:
+            value = row[column]
+            if column in JSON_COLUMNS:
+                # Splice the stored JSON text in as-is instead of decoding and re-encoding
+                encoded = value or "null"
+            else:
+                encoded = json.dumps(value, ensure_ascii=False)
+            parts.append(f'"{field}": {encoded}')
+        yield "{" + ", ".join(parts) + "}\n"
+
+
+def export_csv(batch_size: int = BATCH_SIZE):
+    """Yield CSV text with one row per record; JSON columns stay as JSON strings"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column for column, _ in RECORD_FIELDS])
+
+    count = 0
+    for row in _iter_rows(batch_size):
+        writer.writerow([row[column] for column, _ in RECORD_FIELDS])
+        count += 1
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+EXPORTERS = {
+    "ndjson": (export_ndjson, "application/x-ndjson"),
+    "csv": (export_csv, "text/csv"),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import/export TBNow patient records")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="Import an NDJSON or JSON array file")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    export_parser = subparsers.add_parser("export", help="Export all records")
+    export_parser.add_argument("--format", choices=sorted(EXPORTERS), default="ndjson")
+    export_parser.add_argument("--output", "-o", help="Output file (default: stdout)")
+    export_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    args = parser.parse_args()
+    db.init_database()
+
+    if args.command == "import":
+        start = time.time()
+
+        def progress(inserted, skipped, failed):
+            print(f"   ... {inserted} inserted, {skipped} skipped, {failed} failed", file=sys.stderr)
+
+        inserted, skipped, failed = import_file(args.path, args.batch_size, progress)
+        elapsed = time.time() - start
+        print(f"✅ Imported {inserted} records ({skipped} existing skipped, {failed} malformed) in {elapsed:.1f}s",
+              file=sys.stderr)
+    else:
+        exporter, _ = EXPORTERS[args.format]
+        out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+        try:
+            for chunk in exporter(args.batch_size):
+                out.write(chunk)
+        finally:
+            if args.output:
+                out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# tbnow-back/app/records/cache.py
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from app.monitoring.metrics import CACHE_LOOKUPS
+
+from .db import get_db, row_to_record
+
+class RecordCache:
+    """
+    In-process LRU of decoded records, keyed by id and validated against
+    updated_at so a write from another worker is never served stale.
+    Cached records are shared: callers must not mutate them.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # id -> (updated_at, record)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, record_id: str, version: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(record_id)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(cache="records", result="miss")
+                return None
+            self._entries.move_to_end(record_id)
+            self.hits += 1
+            CACHE_LOOKUPS.inc(cache="records", result="hit")
+            return entry[1]
+
+    def put(self, record: dict):
+        with self._lock:
+            self._entries[record['id']] = (record['updated_at'], record)
+            self._entries.move_to_end(record['id'])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, record_id: str):
+        with self._lock:
+            if self._entries.pop(record_id, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+record_cache = RecordCache()
+
+def record_version(record_id: str) -> Optional[str]:
+    """Current updated_at of a record (primary-key lookup, no JSON decoding)"""
+    with get_db() as conn:
+        row = conn.execute('SELECT updated_at FROM patient_records WHERE id = ?', (record_id,)).fetchone()
+    if row is None:
+        record_cache.invalidate(record_id)
+        return None
+    return row['updated_at']
+
+def record_etag(record_id: str, version: str) -> str:
+    return '"' + hashlib.sha1(f"{record_id}:{version}".encode()).hexdigest()[:20] + '"'
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    """Whether an If-None-Match header (a comma-separated list of tags, weak W/ tags, or *) matches etag"""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+def load_record(record_id: str, version: Optional[str] = None) -> Optional[dict]:
+    """Read-through lookup of a decoded record; returns None if it doesn't exist"""
+    if version is None:
+        version = record_version(record_id)
+        if version is None:
+            return None
+
+    record = record_cache.get(record_id, version)
+    if record is not None:
+        return record
+
+    with get_db() as conn:
+        row = conn.execute('SELECT * FROM patient_records WHERE id = ?', (record_id,)).fetchone()
+    if row is None:
+        record_cache.invalidate(record_id)
+        return None
+
+    record = row_to_record(row)
+    record_cache.put(record)
+    return record
@@ -0,0 +1,276 @@
+# tbnow-back/app/records/db.py
+import json
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from app.monitoring.metrics import SQLITE_QUERY_SECONDS
+from app.monitoring.tracing import child_span
+
+# Database setup
+DATABASE_PATH = "data/tbnow.db"
+
+# Generated columns projected out of the JSON blobs so dashboards can filter
+# in SQL instead of decoding every row in Python. They are VIRTUAL, so adding
+# them to an existing database is a metadata-only change.
+GENERATED_COLUMNS = {
+    "risk_level": "TEXT GENERATED ALWAYS AS (json_extract(xray_result, '$.risk_level')) VIRTUAL",
+    "xray_confidence": "REAL GENERATED ALWAYS AS (json_extract(xray_result, '$.confidence')) VIRTUAL",
+    "patient_gender": "TEXT GENERATED ALWAYS AS (json_extract(patient_info, '$.gender')) VIRTUAL",
+    "patient_age": "INTEGER GENERATED ALWAYS AS "
+                   "(CAST(NULLIF(json_extract(patient_info, '$.age'), '') AS INTEGER)) VIRTUAL",
+    "patient_symptoms": "TEXT GENERATED ALWAYS AS (json_extract(patient_info, '$.symptoms')) VIRTUAL",
+    "heatmap_url": "TEXT GENERATED ALWAYS AS (json_extract(xray_result, '$.heatmap_url')) VIRTUAL",
+    "xray_model_version": "TEXT GENERATED ALWAYS AS (json_extract(xray_result, '$.model_version')) VIRTUAL",
+}
+
+# Full-text index over the searchable parts of a record. Rows share the rowid of
+# patient_records and are kept in sync by the triggers below.
+FTS_COLUMNS = ("patient_id", "name", "symptoms", "result", "chat")
+FTS_WEIGHTS = (5.0, 5.0, 3.0, 2.0, 1.0)  # bm25 weights, same order as FTS_COLUMNS
+
+def _fts_values(alias: str) -> str:
+    """SQL expressions producing FTS_COLUMNS for a patient_records row alias"""
+    return f"""
+        {alias}.patient_id,
+        json_extract({alias}.patient_info, '$.name'),
+        json_extract({alias}.patient_info, '$.symptoms'),
+        {alias}.result,
+        (SELECT group_concat(
+                    coalesce(json_extract(value, '$.question'), '') || ' ' ||
+                    coalesce(json_extract(value, '$.response'), ''), ' ')
+         FROM json_each(coalesce({alias}.chat_history, '[]')))
+    """
+
+class TimedConnection(sqlite3.Connection):
+    """
+    Connection that records each statement's execution time by operation
+    (select, insert, ...). For SELECTs this covers planning and the first step,
+    which includes any sort; rows fetched afterwards are not timed.
+    """
+
+    def execute(self, sql, parameters=()):
+        operation = _operation(sql)
+        start = time.perf_counter()
+        try:
+            with child_span(f"sqlite.{operation}"):
+                return super().execute(sql, parameters)
+        finally:
+            SQLITE_QUERY_SECONDS.observe(time.perf_counter() - start, operation=operation)
+
+    def executemany(self, sql, seq_of_parameters):
+        operation = _operation(sql)
+        start = time.perf_counter()
+        try:
+            with child_span(f"sqlite.{operation}"):
+                return super().executemany(sql, seq_of_parameters)
+        finally:
+            SQLITE_QUERY_SECONDS.observe(time.perf_counter() - start, operation=operation)
+
+def _operation(sql: str) -> str:
+    words = sql.split(None, 1)
+    return words[0].lower() if words else "empty"
+
+@contextmanager
+def get_db(check_same_thread: bool = True):
+    """Context manager for database connections"""
+    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=check_same_thread, factory=TimedConnection)
+    conn.row_factory = sqlite3.Row  # Enable column access by name
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def init_database():
+    """Initialize database tables"""
+    with get_db() as conn:
+        # Create patient_records table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS patient_records (
+                id TEXT PRIMARY KEY,
+                patient_id TEXT UNIQUE,
+                date TEXT,
+                type TEXT,
+                status TEXT,
+                result TEXT,
+                patient_info TEXT,  -- JSON string
+                xray_result TEXT,   -- JSON string
+                chat_history TEXT,  -- JSON string
+                conversation_summary TEXT,  -- JSON string, see app/rag/memory.py
+                created_at TEXT,
+                updated_at TEXT
+            )
+        ''')
+
+        # Add generated columns missing from databases created before they existed.
+        # table_xinfo (unlike table_info) also lists generated columns.
+        existing = {row['name'] for row in conn.execute('PRAGMA table_xinfo(patient_records)')}
+        for name, definition in GENERATED_COLUMNS.items():
+            if name not in existing:
+                conn.execute(f'ALTER TABLE patient_records ADD COLUMN {name} {definition}')
+        if 'conversation_summary' not in existing:
+            conn.execute('ALTER TABLE patient_records ADD COLUMN conversation_summary TEXT')
+
+        # Create indexes for better performance
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_patient_id ON patient_records(patient_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_status ON patient_records(status)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_date ON patient_records(date)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_created_at ON patient_records(created_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_risk_level ON patient_records(risk_level, created_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_xray_confidence ON patient_records(xray_confidence)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_gender_age ON patient_records(patient_gender, patient_age)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_heatmap_url ON patient_records(heatmap_url)')
+
+        init_search_index(conn)
+
+        conn.commit()
+
+def init_search_index(conn):
+    """Create the FTS5 table and its sync triggers, backfilling existing rows once"""
+    fts_exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'records_fts'"
+    ).fetchone()
+    if not fts_exists:
+        conn.execute(f'''
+            CREATE VIRTUAL TABLE records_fts USING fts5(
+                {', '.join(FTS_COLUMNS)},
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        ''')
+        conn.execute(f'''
+            INSERT INTO records_fts (rowid, {', '.join(FTS_COLUMNS)})
+            SELECT p.rowid, {_fts_values('p')} FROM patient_records p
+        ''')
+
+    columns = ', '.join(FTS_COLUMNS)
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS records_fts_insert AFTER INSERT ON patient_records BEGIN
+            INSERT INTO records_fts (rowid, {columns}) VALUES (new.rowid, {_fts_values('new')});
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS records_fts_delete AFTER DELETE ON patient_records BEGIN
+            DELETE FROM records_fts WHERE rowid = old.rowid;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS records_fts_update
+        AFTER UPDATE OF patient_id, patient_info, result, chat_history ON patient_records BEGIN
+            DELETE FROM records_fts WHERE rowid = old.rowid;
+            INSERT INTO records_fts (rowid, {columns}) VALUES (new.rowid, {_fts_values('new')});
+        END
+    ''')
+
+def row_to_record(row) -> dict:
+    """Convert a patient_records row into the API record shape"""
+    record = dict(row)
+    # Parse JSON fields
+    record['patientInfo'] = json.loads(record['patient_info']) if record['patient_info'] else {}
+    record['xrayResult'] = json.loads(record['xray_result']) if record['xray_result'] else None
+    record['chatHistory'] = json.loads(record['chat_history']) if record['chat_history'] else []
+    summary = record.get('conversation_summary')
+    record['conversationSummary'] = json.loads(summary) if summary else None
+    # Remove old field names (generated columns are only exposed via filters)
+    for key in ('patient_info', 'xray_result', 'chat_history', 'conversation_summary', *GENERATED_COLUMNS):
+        record.pop(key, None)
+    return record
+
+def query_records(risk_level=None, min_confidence=None, max_confidence=None,
+                  gender=None, min_age=None, max_age=None, symptom=None,
+                  status=None, date_from=None, date_to=None, model_version=None,
+                  limit: int = 100, offset: int = 0):
+    """
+    Filter records in SQL using the generated columns.
+    Returns (records, total) where total ignores limit/offset.
+    """
+    clauses = []
+    params = []
+
+    if risk_level:
+        clauses.append('risk_level = ?')
+        params.append(risk_level)
+    if min_confidence is not None:
+        clauses.append('xray_confidence >= ?')
+        params.append(min_confidence)
+    if max_confidence is not None:
+        clauses.append('xray_confidence <= ?')
+        params.append(max_confidence)
+    if gender:
+        clauses.append('patient_gender = ?')
+        params.append(gender)
+    if min_age is not None:
+        clauses.append('patient_age >= ?')
+        params.append(min_age)
+    if max_age is not None:
+        clauses.append('patient_age <= ?')
+        params.append(max_age)
+    if symptom:
+        clauses.append("patient_symptoms LIKE ? ESCAPE '\\'")
+        escaped = symptom.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        params.append(f'%{escaped}%')
+    if status:
+        clauses.append('status = ?')
+        params.append(status)
+    if date_from:
+        clauses.append('date >= ?')
+        params.append(date_from)
+    if date_to:
+        clauses.append('date <= ?')
+        params.append(date_to)
+    if model_version:
+        clauses.append('xray_model_version = ?')
+        params.append(model_version)
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    with get_db() as conn:
+        total = conn.execute(f'SELECT COUNT(*) FROM patient_records {where}', params).fetchone()[0]
+        cursor = conn.execute(f'''
+            SELECT * FROM patient_records
+            {where}
+            ORDER BY created_at DESC
+            LIMIT ? OFFSET ?
+        ''', (*params, limit, offset))
+        records = [row_to_record(row) for row in cursor.fetchall()]
+
+    return records, total
+
+def _fts_query(text: str) -> str:
+    """Turn free text into a safe FTS5 query: every word is a quoted prefix term"""
+    terms = re.findall(r'\w+', text, flags=re.UNICODE)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def search_records(q: str, limit: int = 20, offset: int = 0):
+    """
+    Ranked full-text search over patient name, symptoms, assessment and chat.
+    Returns (hits, total); each hit is a record with 'score' and 'snippet'.
+    """
+    match = _fts_query(q)
+    if not match:
+        return [], 0
+
+    weights = ', '.join(str(w) for w in FTS_WEIGHTS)
+    with get_db() as conn:
+        total = conn.execute(
+            'SELECT COUNT(*) FROM records_fts WHERE records_fts MATCH ?', (match,)
+        ).fetchone()[0]
+        cursor = conn.execute(f'''
+            SELECT p.*,
+                   bm25(records_fts, {weights}) AS score,
+                   snippet(records_fts, -1, '<mark>', '</mark>', '…', 12) AS snippet
+            FROM records_fts
+            JOIN patient_records p ON p.rowid = records_fts.rowid
+            WHERE records_fts MATCH ?
+            ORDER BY score
+            LIMIT ? OFFSET ?
+        ''', (match, limit, offset))
+
+        hits = []
+        for row in cursor.fetchall():
+            record = row_to_record(row)
+            # bm25 is lower-is-better; flip it so clients can sort descending
+            record['score'] = -record['score']
+            hits.append(record)
+
+    return hits, total
@@ -1,13 +1,23 @@
+import argparse
 import os
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torchvision import datasets, transforms, models
-from torch.utils.data import DataLoader, random_split
+from torchvision import models
+from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel as DDP
 import matplotlib.pyplot as plt
 from sklearn.metrics import classification_report, confusion_matrix
 import numpy as np
 import time
+import json
+import random
+from contextlib import nullcontext
+from datetime import datetime
+
+from xray_dataset import CACHE_DIR, CACHE_SIZE, CachedXrayDataset, build_cache, train_transforms, eval_transforms
 
 # Config
 data_dir = "data/xray"  # Folder berisi train/ dan test/
@@ -17,235 +27,504 @@ num_epochs = 20  # Increased epochs
 learning_rate = 1e-4
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 model_save_path = "app/xray/model_tb.pth"
-
-print(f"Using device: {device}")
-print(f"Training data directory: {data_dir}")
-
-# Enhanced data transforms with more augmentation
-train_transforms = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.RandomHorizontalFlip(p=0.5),
-    transforms.RandomRotation(15),
-    transforms.RandomAffine(degrees=0, translate=(0.1, 0.1)),
-    transforms.ColorJitter(brightness=0.1, contrast=0.1, saturation=0.1),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
-])
-
-val_transforms = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
-])
-
-# Load datasets
-print("Loading datasets...")
-train_dataset = datasets.ImageFolder(
-    os.path.join(data_dir, "train"), transform=train_transforms
-)
-test_dataset = datasets.ImageFolder(
-    os.path.join(data_dir, "test"), transform=val_transforms
-)
-
-# Create validation split from training data (80% train, 20% val)
-train_size = int(0.8 * len(train_dataset))
-val_size = len(train_dataset) - train_size
-train_dataset, val_dataset = random_split(train_dataset, [train_size, val_size])
-
-# Apply validation transforms to val_dataset
-val_dataset.dataset.transform = val_transforms
-
-train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=0)
-val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, num_workers=0)
-test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False, num_workers=0)
-
-print(f"Train samples: {len(train_dataset)}")
-print(f"Validation samples: {len(val_dataset)}")
-print(f"Test samples: {len(test_dataset)}")
-
-# Model with fine-tuning
-try:
-    # Try new torchvision API first
-    model = models.resnet18(weights=models.ResNet18_Weights.DEFAULT)
-except AttributeError:
-    # Fallback to old API
-    model = models.resnet18(pretrained=True)
-
-# Freeze early layers, fine-tune later layers
-for param in model.parameters():
-    param.requires_grad = False
-
-# Unfreeze the last few layers
-for param in model.layer4.parameters():
-    param.requires_grad = True
-
-# Replace classifier
-model.fc = nn.Sequential(
-    nn.Dropout(0.5),
-    nn.Linear(model.fc.in_features, num_classes)
-)
-model = model.to(device)
-
-# Loss & optimizer (only optimize unfrozen parameters)
-criterion = nn.CrossEntropyLoss()
-optimizer = optim.Adam([
-    {'params': model.layer4.parameters()},
-    {'params': model.fc.parameters()}
-], lr=learning_rate)
-
-# Learning rate scheduler
-scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='max', factor=0.5, patience=3)
-
-# Training tracking
-train_losses = []
-val_accuracies = []
-best_val_acc = 0.0
+num_workers = min(4, os.cpu_count() or 1)
+split_seed = 42
 patience = 7
-patience_counter = 0
-
-print("Starting training...")
-start_time = time.time()
-
-for epoch in range(num_epochs):
-    epoch_start = time.time()
-
-    # Training phase
+checkpoint_dir = "data/checkpoints"
+metrics_log_path = "training_metrics.jsonl"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the TBNow X-ray model")
+    parser.add_argument("--data-dir", default=data_dir)
+    parser.add_argument("--epochs", type=int, default=num_epochs)
+    parser.add_argument("--batch-size", type=int, default=batch_size)
+    parser.add_argument("--lr", type=float, default=learning_rate)
+    parser.add_argument("--num-workers", type=int, default=num_workers,
+                        help="DataLoader worker processes (0 = load in the main process)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="Where preprocessed image caches are stored")
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE, help="Side length of cached images")
+    parser.add_argument("--output", default=model_save_path)
+    parser.add_argument("--amp", choices=["off", "bf16", "fp16"], default="off",
+                        help="Mixed precision via torch.autocast (bf16 on CPU; fp16 needs CUDA)")
+    parser.add_argument("--channels-last", action="store_true", help="Use NHWC memory format")
+    parser.add_argument("--compile", action="store_true", help="Wrap the model with torch.compile")
+    parser.add_argument("--patience", type=int, default=patience, help="Early stopping patience (epochs)")
+    parser.add_argument("--checkpoint-dir", default=checkpoint_dir,
+                        help="Where full training checkpoints (last.pth) are written")
+    parser.add_argument("--checkpoint-every", type=int, default=1, help="Checkpoint every N epochs")
+    parser.add_argument("--resume", nargs="?", const="latest", default=None,
+                        help="Resume from a checkpoint path (default: <checkpoint-dir>/last.pth)")
+    parser.add_argument("--metrics-log", default=metrics_log_path, help="Per-epoch metrics (JSONL)")
+    parser.add_argument("--accum-steps", type=int, default=1,
+                        help="Gradient accumulation steps (effective batch = batch-size x accum-steps x world size)")
+    parser.add_argument("--dist-backend", default="gloo", help="torch.distributed backend when launched with torchrun")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Intra-op threads per process (default: CPU cores / processes on this host)")
+    return parser.parse_args()
+
+
+# Distributed state: a single process unless launched with torchrun
+rank = 0
+world_size = 1
+
+
+def is_main_process():
+    return rank == 0
+
+
+def log(*args, **kwargs):
+    """print, on rank 0 only"""
+    if is_main_process():
+        print(*args, **kwargs)
+
+
+def setup_distributed(args):
+    """
+    Join the process group when started by torchrun, e.g.
+      torchrun --nproc_per_node 4 app/scripts/train_tb_model.py
+      torchrun --nnodes 2 --node_rank 0 --master_addr 10.0.0.1 --nproc_per_node 8 app/scripts/train_tb_model.py
+    """
+    global rank, world_size, device
+    local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", 1))
+    # torchrun defaults OMP_NUM_THREADS to 1; split this host's cores between its processes instead
+    torch.set_num_threads(args.threads or max(1, (os.cpu_count() or 1) // local_world_size))
+
+    if int(os.environ.get("WORLD_SIZE", 1)) <= 1:
+        return False
+
+    dist.init_process_group(backend=args.dist_backend)
+    rank = dist.get_rank()
+    world_size = dist.get_world_size()
+    if device.type == "cuda":
+        local_rank = int(os.environ.get("LOCAL_RANK", 0))
+        torch.cuda.set_device(local_rank)
+        device = torch.device("cuda", local_rank)
+    return True
+
+
+def all_reduce_sum(*values):
+    """Sum scalars across processes (identity when not distributed)"""
+    if world_size == 1:
+        return values
+    tensor = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(tensor)
+    return tuple(tensor.tolist())
+
+
+def autocast_context(amp: str):
+    if amp == "off":
+        return nullcontext()
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16 if amp == "bf16" else torch.float16)
+
+
+def to_device(images, labels, channels_last: bool):
+    images = images.to(device, non_blocking=True)
+    if channels_last:
+        images = images.contiguous(memory_format=torch.channels_last)
+    return images, labels.to(device, non_blocking=True)
+
+
+def make_loader(dataset, args, shuffle, distributed=False):
+    workers = args.num_workers
+    # Each process sees its own shard; call sampler.set_epoch() to reshuffle per epoch
+    sampler = DistributedSampler(dataset, shuffle=shuffle) if distributed else None
+    return DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        shuffle=shuffle and sampler is None,
+        sampler=sampler,
+        num_workers=workers,
+        pin_memory=device.type == "cuda",
+        persistent_workers=workers > 0,
+        prefetch_factor=4 if workers > 0 else None,
+    )
+
+
+def build_datasets(args):
+    """Cached train/val/test datasets; train and val are separate instances over a fixed split"""
+    # Rank 0 builds the caches; the others wait and then just validate them
+    if world_size > 1 and not is_main_process():
+        dist.barrier()
+    train_cache = build_cache(os.path.join(args.data_dir, "train"), args.cache_dir, args.cache_size)
+    test_cache = build_cache(os.path.join(args.data_dir, "test"), args.cache_dir, args.cache_size)
+    if world_size > 1 and is_main_process():
+        dist.barrier()
+
+    # Create validation split from training data (80% train, 20% val)
+    num_train_images = len(np.load(train_cache.replace(".npy", "_labels.npy")))
+    permutation = torch.randperm(num_train_images, generator=torch.Generator().manual_seed(split_seed)).numpy()
+    train_size = int(0.8 * num_train_images)
+
+    train_dataset = CachedXrayDataset(train_cache, permutation[:train_size], train_transforms())
+    val_dataset = CachedXrayDataset(train_cache, permutation[train_size:], eval_transforms())
+    test_dataset = CachedXrayDataset(test_cache, transform=eval_transforms())
+    return train_dataset, val_dataset, test_dataset
+
+
+def build_model():
+    # Model with fine-tuning
+    try:
+        # Try new torchvision API first
+        model = models.resnet18(weights=models.ResNet18_Weights.DEFAULT)
+    except AttributeError:
+        # Fallback to old API
+        model = models.resnet18(pretrained=True)
+
+    # Freeze early layers, fine-tune later layers
+    for param in model.parameters():
+        param.requires_grad = False
+
+    # Unfreeze the last few layers
+    for param in model.layer4.parameters():
+        param.requires_grad = True
+
+    # Replace classifier
+    model.fc = nn.Sequential(
+        nn.Dropout(0.5),
+        nn.Linear(model.fc.in_features, num_classes)
+    )
+    return model.to(device)
+
+
+def train_one_epoch(run_model, model, loader, criterion, optimizer, scaler, args, ddp_model=None):
+    """
+    One pass over this process's shard of the training set, stepping the
+    optimizer every args.accum_steps batches. Returns (loss, accuracy, images
+    seen) aggregated over all processes.
+    """
     model.train()
     running_loss = 0.0
     correct = 0
     total = 0
-
-    for images, labels in train_loader:
-        images, labels = images.to(device), labels.to(device)
-
-        optimizer.zero_grad()
-        outputs = model(images)
-        loss = criterion(outputs, labels)
-        loss.backward()
-        optimizer.step()
+    num_batches = len(loader)
+
+    optimizer.zero_grad()
+    for step, (images, labels) in enumerate(loader):
+        images, labels = to_device(images, labels, args.channels_last)
+        should_step = (step + 1) % args.accum_steps == 0 or step + 1 == num_batches
+        # The last group of an epoch can be shorter; average over the micro-batches it actually has
+        group_start = step - step % args.accum_steps
+        group_size = min(args.accum_steps, num_batches - group_start)
+
+        # Skip the DDP gradient all-reduce on micro-batches that don't step
+        sync_context = ddp_model.no_sync() if ddp_model is not None and not should_step else nullcontext()
+        with sync_context:
+            with autocast_context(args.amp):
+                outputs = run_model(images)
+                loss = criterion(outputs, labels)
+            scaler.scale(loss / group_size).backward()
+
+        if should_step:
+            scaler.step(optimizer)
+            scaler.update()
+            optimizer.zero_grad()
 
         running_loss += loss.item() * images.size(0)
         _, predicted = outputs.max(1)
         total += labels.size(0)
         correct += predicted.eq(labels).sum().item()
 
-    train_loss = running_loss / len(train_dataset)
-    train_acc = correct / total
+    running_loss, correct, total = all_reduce_sum(running_loss, correct, total)
+    return running_loss / total, correct / total, int(total)
 
-    # Validation phase
+
+def evaluate(run_model, model, loader, criterion, args):
+    """Returns (loss, accuracy) over a validation loader"""
     model.eval()
-    val_correct = 0
-    val_total = 0
-    val_loss = 0.0
+    correct = 0
+    total = 0
+    running_loss = 0.0
 
     with torch.no_grad():
-        for images, labels in val_loader:
-            images, labels = images.to(device), labels.to(device)
-            outputs = model(images)
-            loss = criterion(outputs, labels)
+        for images, labels in loader:
+            images, labels = to_device(images, labels, args.channels_last)
+            with autocast_context(args.amp):
+                outputs = run_model(images)
+                loss = criterion(outputs, labels)
 
-            val_loss += loss.item() * images.size(0)
+            running_loss += loss.item() * images.size(0)
             _, predicted = outputs.max(1)
-            val_total += labels.size(0)
-            val_correct += predicted.eq(labels).sum().item()
-
-    val_acc = val_correct / val_total
-    val_loss = val_loss / len(val_dataset)
-
-    epoch_time = time.time() - epoch_start
-
-    print(f"Epoch [{epoch+1}/{num_epochs}] ({epoch_time:.1f}s)")
-    print(".4f")
-    print(".4f")
-
-    # Track metrics
-    train_losses.append(train_loss)
-    val_accuracies.append(val_acc)
-
-    # Learning rate scheduling
-    scheduler.step(val_acc)
-
-    # Save best model
-    if val_acc > best_val_acc:
-        best_val_acc = val_acc
-        torch.save({
-            'epoch': epoch,
-            'model_state_dict': model.state_dict(),
-            'optimizer_state_dict': optimizer.state_dict(),
-            'val_acc': val_acc,
-            'train_loss': train_loss
-        }, model_save_path)
-        print(".4f")
-        patience_counter = 0
-    else:
-        patience_counter += 1
-
-    # Early stopping
-    if patience_counter >= patience:
-        print(f"Early stopping at epoch {epoch+1}")
-        break
-
-total_time = time.time() - start_time
-print(".1f")
-
-# Load best model for testing
-checkpoint = torch.load(model_save_path)
-model.load_state_dict(checkpoint['model_state_dict'])
-model.eval()
-
-# Test on test set
-test_correct = 0
-test_total = 0
-all_preds = []
-all_labels = []
-
-with torch.no_grad():
-    for images, labels in test_loader:
-        images, labels = images.to(device), labels.to(device)
-        outputs = model(images)
-        _, predicted = outputs.max(1)
-        test_total += labels.size(0)
-        test_correct += predicted.eq(labels).sum().item()
-
-        all_preds.extend(predicted.cpu().numpy())
-        all_labels.extend(labels.cpu().numpy())
-
-test_acc = test_correct / test_total
-print(".4f")
-
-# Classification report
-print("\nClassification Report:")
-print(classification_report(all_labels, all_preds, target_names=['Normal', 'TB']))
-
-# Confusion matrix
-cm = confusion_matrix(all_labels, all_preds)
-print("\nConfusion Matrix:")
-print("Predicted -> Normal    TB")
-print(f"Actual Normal: {cm[0][0]:3d}    {cm[0][1]:3d}")
-print(f"Actual TB:     {cm[1][0]:3d}    {cm[1][1]:3d}")
-
-# Plot training curves
-plt.figure(figsize=(12, 4))
-
-plt.subplot(1, 2, 1)
-plt.plot(train_losses, label='Training Loss')
-plt.xlabel('Epoch')
-plt.ylabel('Loss')
-plt.title('Training Loss')
-plt.legend()
-
-plt.subplot(1, 2, 2)
-plt.plot(val_accuracies, label='Validation Accuracy')
-plt.xlabel('Epoch')
-plt.ylabel('Accuracy')
-plt.title('Validation Accuracy')
-plt.legend()
-
-plt.tight_layout()
-plt.savefig('training_curves.png', dpi=150, bbox_inches='tight')
-print("Training curves saved as 'training_curves.png'")
-
-print("\n🎉 Training completed successfully!")
-print(f"Best validation accuracy: {best_val_acc:.4f}")
-print(f"Test accuracy: {test_acc:.4f}")
-print(f"Model saved to: {model_save_path}")
+            total += labels.size(0)
+            correct += predicted.eq(labels).sum().item()
+
+    # DistributedSampler pads shards to equal length, so a few samples may count twice
+    running_loss, correct, total = all_reduce_sum(running_loss, correct, total)
+    return running_loss / total, correct / total
+
+
+def save_checkpoint(path, model, optimizer, scheduler, scaler, state, args):
+    """Full training state, written atomically so an interruption never leaves a torn file"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    checkpoint = {
+        **state,
+        'model_state_dict': model.state_dict(),
+        'optimizer_state_dict': optimizer.state_dict(),
+        'scheduler_state_dict': scheduler.state_dict(),
+        'scaler_state_dict': scaler.state_dict(),
+        'rng_state': {
+            'python': random.getstate(),
+            'numpy': np.random.get_state(),
+            'torch': torch.get_rng_state(),
+            'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+        },
+        'args': vars(args),
+    }
+    tmp_path = path + ".tmp"
+    torch.save(checkpoint, tmp_path)
+    os.replace(tmp_path, path)
+    print(f"  Checkpoint saved to {path}")
+
+
+def load_checkpoint(path, model, optimizer, scheduler, scaler):
+    """Restore everything save_checkpoint wrote; returns the tracking state"""
+    checkpoint = torch.load(path, map_location=device, weights_only=False)
+    model.load_state_dict(checkpoint['model_state_dict'])
+    optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+    scheduler.load_state_dict(checkpoint['scheduler_state_dict'])
+    scaler.load_state_dict(checkpoint['scaler_state_dict'])
+
+    rng = checkpoint['rng_state']
+    random.setstate(rng['python'])
+    np.random.set_state(rng['numpy'])
+    torch.set_rng_state(rng['torch'].cpu())
+    if rng['cuda'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(rng['cuda'])
+
+    return {key: checkpoint[key] for key in
+            ("epoch", "best_val_acc", "patience_counter", "train_losses", "val_accuracies")}
+
+
+def main():
+    args = parse_args()
+    distributed = setup_distributed(args)
+    # Different augmentation randomness per process
+    torch.manual_seed(split_seed + rank)
+
+    log(f"Using device: {device}")
+    log(f"Training data directory: {args.data_dir}")
+    if distributed:
+        log(f"Distributed: {world_size} processes ({args.dist_backend}), "
+            f"{torch.get_num_threads()} threads each")
+
+    # Load datasets
+    log("Loading datasets...")
+    train_dataset, val_dataset, test_dataset = build_datasets(args)
+
+    train_loader = make_loader(train_dataset, args, shuffle=True, distributed=distributed)
+    val_loader = make_loader(val_dataset, args, shuffle=False, distributed=distributed)
+    test_loader = make_loader(test_dataset, args, shuffle=False)
+
+    log(f"Train samples: {len(train_dataset)}")
+    log(f"Validation samples: {len(val_dataset)}")
+    log(f"Test samples: {len(test_dataset)}")
+    log(f"DataLoader workers: {args.num_workers}")
+    log(f"Effective batch size: {args.batch_size * args.accum_steps * world_size}")
+
+    model = build_model()
+    if args.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    # Checkpoints are always saved from the unwrapped module (no module./_orig_mod. prefixes)
+    ddp_model = DDP(model, device_ids=[device.index] if device.type == "cuda" else None) if distributed else None
+    run_model = ddp_model or model
+    if args.compile:
+        run_model = torch.compile(run_model)
+    if args.amp == "fp16" and device.type != "cuda":
+        raise SystemExit("--amp fp16 requires CUDA; use --amp bf16 on CPU")
+    scaler = torch.cuda.amp.GradScaler(enabled=args.amp == "fp16")
+    log(f"Precision: {args.amp}, channels_last: {args.channels_last}, compile: {args.compile}")
+
+    # Loss & optimizer (only optimize unfrozen parameters)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam([
+        {'params': model.layer4.parameters()},
+        {'params': model.fc.parameters()}
+    ], lr=args.lr)
+
+    # Learning rate scheduler
+    scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='max', factor=0.5, patience=3)
+
+    # Training tracking
+    state = {
+        "epoch": -1,  # last completed epoch
+        "best_val_acc": 0.0,
+        "patience_counter": 0,
+        "train_losses": [],
+        "val_accuracies": [],
+    }
+
+    checkpoint_path = os.path.join(args.checkpoint_dir, "last.pth")
+    if args.resume:
+        resume_path = checkpoint_path if args.resume == "latest" else args.resume
+        state = load_checkpoint(resume_path, model, optimizer, scheduler, scaler)
+        log(f"Resumed from {resume_path} after epoch {state['epoch'] + 1} "
+            f"(best val acc {state['best_val_acc']:.4f}, patience {state['patience_counter']}/{args.patience})")
+
+    # Only rank 0 writes logs, checkpoints and the exported model
+    metrics_log = open(args.metrics_log, "a" if args.resume else "w", encoding="utf-8") if is_main_process() else None
+
+    log("Starting training...")
+    start_time = time.time()
+
+    for epoch in range(state["epoch"] + 1, args.epochs):
+        if state["patience_counter"] >= args.patience:
+            log(f"Early stopping already reached before epoch {epoch+1}")
+            break
+
+        epoch_start = time.time()
+        if distributed:
+            train_loader.sampler.set_epoch(epoch)
+
+        # Training phase
+        train_loss, train_acc, train_images = train_one_epoch(
+            run_model, model, train_loader, criterion, optimizer, scaler, args, ddp_model
+        )
+        train_time = time.time() - epoch_start
+
+        # Validation phase
+        val_start = time.time()
+        val_loss, val_acc = evaluate(run_model, model, val_loader, criterion, args)
+        val_time = time.time() - val_start
+
+        epoch_time = time.time() - epoch_start
+
+        log(f"Epoch [{epoch+1}/{args.epochs}] ({epoch_time:.1f}s, {train_images / train_time:.1f} img/s)")
+        log(f"  Train Loss: {train_loss:.4f}, Train Acc: {train_acc:.4f}")
+        log(f"  Val Loss: {val_loss:.4f}, Val Acc: {val_acc:.4f}")
+
+        # Track metrics
+        state["train_losses"].append(train_loss)
+        state["val_accuracies"].append(val_acc)
+
+        # Learning rate scheduling (val_acc is identical on every rank, so decisions agree)
+        scheduler.step(val_acc)
+
+        # Save best model
+        improved = val_acc > state["best_val_acc"]
+        if improved:
+            state["best_val_acc"] = val_acc
+            if is_main_process():
+                torch.save({
+                    'epoch': epoch,
+                    'model_state_dict': model.state_dict(),
+                    'optimizer_state_dict': optimizer.state_dict(),
+                    'val_acc': val_acc,
+                    'train_loss': train_loss
+                }, args.output)
+            log(f"  New best model saved (Val Acc: {val_acc:.4f})")
+            state["patience_counter"] = 0
+        else:
+            state["patience_counter"] += 1
+
+        state["epoch"] = epoch
+        if metrics_log is not None:
+            metrics_log.write(json.dumps({
+                "epoch": epoch + 1,
+                "train_loss": train_loss,
+                "train_acc": train_acc,
+                "val_loss": val_loss,
+                "val_acc": val_acc,
+                "best_val_acc": state["best_val_acc"],
+                "lr": optimizer.param_groups[0]["lr"],
+                "epoch_time_s": round(epoch_time, 3),
+                "train_time_s": round(train_time, 3),
+                "val_time_s": round(val_time, 3),
+                "train_images_per_sec": round(train_images / train_time, 2),
+                "world_size": world_size,
+                "timestamp": datetime.now().isoformat(),
+            }) + "\n")
+            metrics_log.flush()
+
+        stop = state["patience_counter"] >= args.patience
+        if (epoch + 1) % args.checkpoint_every == 0 or stop or epoch + 1 == args.epochs:
+            if is_main_process():
+                save_checkpoint(checkpoint_path, model, optimizer, scheduler, scaler, state, args)
+            if distributed:
+                dist.barrier()
+
+        # Early stopping
+        if stop:
+            log(f"Early stopping at epoch {epoch+1}")
+            break
+
+    train_losses = state["train_losses"]
+    val_accuracies = state["val_accuracies"]
+    best_val_acc = state["best_val_acc"]
+
+    if distributed:
+        dist.destroy_process_group()
+    if not is_main_process():
+        return
+    metrics_log.close()
+
+    total_time = time.time() - start_time
+    print(f"Training finished in {total_time:.1f}s")
+
+    # Load best model for testing
+    checkpoint = torch.load(args.output)
+    model.load_state_dict(checkpoint['model_state_dict'])
+    model.eval()
+
+    # Test on test set
+    test_correct = 0
+    test_total = 0
+    all_preds = []
+    all_labels = []
+
+    with torch.no_grad():
+        for images, labels in test_loader:
+            images, labels = to_device(images, labels, args.channels_last)
+            with autocast_context(args.amp):
+                # Bare module: the other ranks have exited, so no DDP forward here
+                outputs = model(images)
+            _, predicted = outputs.max(1)
+            test_total += labels.size(0)
+            test_correct += predicted.eq(labels).sum().item()
+
+            all_preds.extend(predicted.cpu().numpy())
+            all_labels.extend(labels.cpu().numpy())
+
+    test_acc = test_correct / test_total
+    print(f"Test Accuracy: {test_acc:.4f}")
+
+    # Classification report
+    print("\nClassification Report:")
+    print(classification_report(all_labels, all_preds, target_names=['Normal', 'TB']))
+
+    # Confusion matrix
+    cm = confusion_matrix(all_labels, all_preds)
+    print("\nConfusion Matrix:")
+    print("Predicted -> Normal    TB")
+    print(f"Actual Normal: {cm[0][0]:3d}    {cm[0][1]:3d}")
+    print(f"Actual TB:     {cm[1][0]:3d}    {cm[1][1]:3d}")
+
+    # Plot training curves
+    plt.figure(figsize=(12, 4))
+
+    plt.subplot(1, 2, 1)
+    plt.plot(train_losses, label='Training Loss')
+    plt.xlabel('Epoch')
+    plt.ylabel('Loss')
+    plt.title('Training Loss')
+    plt.legend()
+
+    plt.subplot(1, 2, 2)
+    plt.plot(val_accuracies, label='Validation Accuracy')
+    plt.xlabel('Epoch')
+    plt.ylabel('Accuracy')
+    plt.title('Validation Accuracy')
+    plt.legend()
+
+    plt.tight_layout()
+    plt.savefig('training_curves.png', dpi=150, bbox_inches='tight')
+    print("Training curves saved as 'training_curves.png'")
+
+    print("\n🎉 Training completed successfully!")
+    print(f"Best validation accuracy: {best_val_acc:.4f}")
+    print(f"Test accuracy: {test_acc:.4f}")
+    print(f"Model saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    # Guarded so DataLoader worker processes (spawned on Windows/macOS) don't re-run training
+    main()
@@ -0,0 +1,145 @@
+"""
+Preprocessed X-ray dataset cache for training.
+
+Every image under an ImageFolder split (e.g. data/xray/train) is decoded once
+with the serving preprocessing (app/xray/preprocessing.py: grayscale uint8,
+resized to CACHE_SIZE x CACHE_SIZE) and stored in a single .npy file that
+workers memory-map. Augmentation then runs on these small tensors instead of
+re-decoding full-size JPEG/PNGs every epoch.
+
+With the default CACHE_SIZE (the model input size) evaluation inputs are
+bit-identical to what the server feeds the model.
+"""
+
+import json
+import os
+import sys
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+from torchvision import datasets, transforms
+import torchvision.transforms.functional as TF
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from app.xray.preprocessing import IMAGE_SIZE, PREPROCESSING, load_gray, normalize
+
+CACHE_SIZE = IMAGE_SIZE
+CACHE_DIR = "data/cache"
+
+
+def _load_resized(path: str, size: int = CACHE_SIZE) -> np.ndarray:
+    with Image.open(path) as image:
+        return load_gray(image, size)
+
+
+def _fingerprint(samples) -> list:
+    return [[os.path.relpath(path), label, os.path.getsize(path), int(os.path.getmtime(path))]
+            for path, label in samples]
+
+
+def build_cache(split_dir: str, cache_dir: str = CACHE_DIR, size: int = CACHE_SIZE, workers: int = None) -> str:
+    """
+    Build (or reuse) the cache for one ImageFolder split and return its .npy path.
+    The cache is rebuilt whenever files are added, removed or modified.
+    """
+    folder = datasets.ImageFolder(split_dir)  # lists files only, decodes nothing
+    name = os.path.basename(os.path.normpath(split_dir))
+    os.makedirs(cache_dir, exist_ok=True)
+    array_path = os.path.join(cache_dir, f"{name}_{size}.npy")
+    meta_path = os.path.join(cache_dir, f"{name}_{size}.json")
+
+    meta = {
+        "size": size,
+        "preprocessing": PREPROCESSING,
+        "classes": folder.classes,
+        "samples": _fingerprint(folder.samples),
+    }
+    if os.path.exists(array_path) and os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            if json.load(f) == meta:
+                return array_path
+
+    print(f"Building {size}px cache for {split_dir} ({len(folder.samples)} images)...")
+    array = np.lib.format.open_memmap(
+        array_path + ".tmp.npy", mode="w+", dtype=np.uint8, shape=(len(folder.samples), size, size)
+    )
+    paths = [path for path, _ in folder.samples]
+    with Pool(workers or os.cpu_count()) as pool:
+        for i, image in enumerate(pool.imap(partial(_load_resized, size=size), paths, chunksize=16)):
+            array[i] = image
+    array.flush()
+    del array
+    os.replace(array_path + ".tmp.npy", array_path)
+
+    np.save(os.path.join(cache_dir, f"{name}_{size}_labels.npy"),
+            np.array(folder.targets, dtype=np.int64))
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return array_path
+
+
+class CachedXrayDataset(Dataset):
+    """
+    Dataset over a cache built by build_cache, optionally restricted to a
+    subset of indices. Each split gets its own instance (and transform).
+    """
+
+    def __init__(self, array_path: str, indices=None, transform=None):
+        self.array_path = array_path
+        self.labels = np.load(array_path.replace(".npy", "_labels.npy"))
+        self.indices = np.arange(len(self.labels)) if indices is None else np.asarray(indices)
+        self.transform = transform
+        self._images = None  # memory-mapped lazily, once per worker process
+
+    @property
+    def targets(self):
+        return self.labels[self.indices]
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        if self._images is None:
+            self._images = np.load(self.array_path, mmap_mode="r")
+        index = self.indices[i]
+        image = torch.from_numpy(np.array(self._images[index]))[None]  # 1 x H x W uint8
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, int(self.labels[index])
+
+    def __getstate__(self):
+        # Never pickle the memmap into worker processes
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+
+def _resize_to(size: int):
+    """Resize uint8 1xHxW unless the cache is already at the model input size"""
+    def resize(image: torch.Tensor) -> torch.Tensor:
+        if tuple(image.shape[-2:]) == (size, size):
+            return image
+        return TF.resize(image, [size, size], antialias=True)
+    return resize
+
+
+def train_transforms(size: int = IMAGE_SIZE):
+    return transforms.Compose([
+        _resize_to(size),
+        transforms.RandomHorizontalFlip(p=0.5),
+        transforms.RandomRotation(15),
+        transforms.RandomAffine(degrees=0, translate=(0.1, 0.1)),
+        transforms.ColorJitter(brightness=0.1, contrast=0.1),
+        normalize,
+    ])
+
+
+def eval_transforms(size: int = IMAGE_SIZE):
+    return transforms.Compose([
+        _resize_to(size),
+        normalize,
+    ])
@@ -0,0 +1,83 @@
+"""
+Background micro-batching for X-ray model work that is off the request path.
+
+Items submitted to a BatchWorker are queued and handled by one daemon thread,
+which groups whatever arrives within max_wait_ms (up to max_batch items) into
+a single call. One batched forward pass is much cheaper than many single-image
+ones, and a bounded queue means that under load work is dropped rather than
+piling up CPU behind live requests.
+"""
+
+import queue
+import threading
+import time
+
+class BatchWorker:
+    def __init__(self, name: str, process_batch, max_batch: int = 8,
+                 max_wait_ms: float = 20.0, max_queue: int = 64):
+        self.name = name
+        self.process_batch = process_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.submitted = 0
+        self.dropped = 0
+        self.processed = 0
+        self.batches = 0
+        self.errors = 0
+
+    def submit(self, item) -> bool:
+        """Queue item without blocking; False if the queue is full and it was dropped"""
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        return True
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self.process_batch(batch)
+                self.processed += len(batch)
+                self.batches += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️  {self.name} batch failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "processed": self.processed,
+            "batches": self.batches,
+            "errors": self.errors,
+            "mean_batch_size": round(self.processed / self.batches, 2) if self.batches else 0.0,
+        }
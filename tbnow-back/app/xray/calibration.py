@@ -0,0 +1,62 @@
+"""
+Calibration artifact for the X-ray model.
+
+evaluate_model.py fits a softmax temperature and picks the High/Medium risk
+cutoffs on cached test-set outputs, then writes them here as JSON. quick_screen
+loads the artifact at import; without one it falls back to the original
+uncalibrated 0.90/0.80 cutoffs.
+"""
+
+import json
+import os
+import tempfile
+from datetime import datetime
+
+CALIBRATION_PATH = os.getenv(
+    "XRAY_CALIBRATION_PATH", os.path.join(os.path.dirname(__file__), "calibration.json")
+)
+
+DEFAULT_CALIBRATION = {
+    "temperature": 1.0,
+    # TB probability at or above which a scan is High / Medium risk
+    "thresholds": {"high": 0.90, "medium": 0.80},
+}
+
+
+def load_calibration(path: str = CALIBRATION_PATH) -> dict:
+    """The calibration artifact at path, or the defaults if it is missing or invalid"""
+    if not os.path.exists(path):
+        return DEFAULT_CALIBRATION
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            calibration = json.load(f)
+        temperature = float(calibration["temperature"])
+        high = float(calibration["thresholds"]["high"])
+        medium = float(calibration["thresholds"]["medium"])
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"⚠️  Ignoring invalid calibration file {path}: {e}")
+        return DEFAULT_CALIBRATION
+    if temperature <= 0 or not 0 <= medium <= high <= 1:
+        print(f"⚠️  Ignoring calibration file {path}: need temperature > 0 and 0 <= medium <= high <= 1")
+        return DEFAULT_CALIBRATION
+    return {**calibration, "temperature": temperature, "thresholds": {"high": high, "medium": medium}}
+
+
+def save_calibration(calibration: dict, path: str = CALIBRATION_PATH) -> str:
+    """Atomically write the artifact (quick_screen may be reading it)"""
+    calibration = {**calibration, "created_at": datetime.now().isoformat()}
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(calibration, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def risk_level(prob_tb: float, thresholds: dict) -> str:
+    """High / Medium / Low for a calibrated TB probability"""
+    if prob_tb >= thresholds["high"]:
+        return "High"
+    if prob_tb >= thresholds["medium"]:
+        return "Medium"
+    return "Low"
@@ -1,65 +1,118 @@
-import torch, cv2, uuid
+import torch, cv2
 import numpy as np
-import os
+import threading
 import warnings
+from contextlib import nullcontext
+from PIL import Image
+from app.monitoring.metrics import stage_timer
+from .heatmaps import heatmap_store, HEATMAP_MAX_DIM
 
 # Suppress warnings
 warnings.filterwarnings('ignore', category=UserWarning)
 warnings.filterwarnings('ignore', category=DeprecationWarning)
 warnings.filterwarnings('ignore', category=RuntimeWarning)
 
-def generate_cam(model, input_tensor, original_image):
+# Per-thread render buffers, keyed by overlay size, reused across requests
+_buffers = threading.local()
+
+def _render_buffers(height: int, width: int):
+    cache = getattr(_buffers, "by_size", None)
+    if cache is None:
+        cache = _buffers.by_size = {}
+    buffers = cache.get((height, width))
+    if buffers is None:
+        if len(cache) >= 8:  # X-rays come in a handful of sizes; don't grow unbounded
+            cache.clear()
+        buffers = cache[(height, width)] = (
+            np.empty((height, width), dtype=np.float32),    # upsampled CAM
+            np.empty((height, width), dtype=np.uint8),      # CAM as 0-255
+            np.empty((height, width, 3), dtype=np.uint8),   # colormapped heatmap
+            np.empty((height, width, 3), dtype=np.uint8),   # blended overlay
+        )
+    return buffers
+
+def _synchronize(tensor: torch.Tensor):
+    """Wait for queued CUDA kernels so stage timings measure the work, not the launch"""
+    if tensor.is_cuda:
+        torch.cuda.synchronize(tensor.device)
+
+def compute_cam(model, input_tensor, pred_class: int = 1, forward_context=nullcontext, record_stages: bool = True):
+    """
+    Run one forward/backward pass and return (cam, logits): the low-res
+    (e.g. 7x7) Grad-CAM for pred_class normalized to [0, 1], and the model output.
+    forward_context wraps only the forward pass (e.g. an autocast context).
+    record_stages=False keeps the passes out of the stage metrics (warmup).
+    """
+    timer = stage_timer if record_stages else (lambda stage: nullcontext())
     activations = []
     gradients = []
+    thread_id = threading.get_ident()
 
     def forward_hook(_, __, output):
+        # The hook is on the shared model: ignore forwards of concurrent requests
+        if threading.get_ident() != thread_id:
+            return
         activations.append(output)
+        # Capture the gradient on the activation tensor itself
+        output.register_hook(gradients.append)
 
-    def backward_hook(_, grad_in, grad_out):
-        gradients.append(grad_out[0])
-
-    layer = model.layer4[-1]
-    layer.register_forward_hook(forward_hook)
-    layer.register_backward_hook(backward_hook)
+    handle = model.layer4[-1].register_forward_hook(forward_hook)
+    try:
+        with timer("forward"):
+            with forward_context():
+                output = model(input_tensor)
+            _synchronize(output)
+        with timer("gradcam_backward"):
+            output[0, pred_class].backward()
+            _synchronize(output)
+    finally:
+        # Hooks must not accumulate across requests
+        handle.remove()
 
-    output = model(input_tensor)
-    pred_class = 1  # Class for TB
-    output[0, pred_class].backward()
+    with torch.no_grad():
+        # float() undoes reduced precision from autocast before the NumPy handoff
+        weights = gradients[0].float().mean(dim=[2,3], keepdim=True)
+        cam = (weights * activations[0].float()).sum(dim=1)[0].clamp_(min=0)
 
-    weights = gradients[0].mean(dim=[2,3], keepdim=True)
-    cam = (weights * activations[0]).sum(dim=1).squeeze()
-    cam = cam.clamp(min=0).detach().numpy()
-    
-    # Normalize CAM, handling edge case where max is 0
-    cam_max = cam.max()
-    if cam_max > 0:
-        cam = cam / cam_max
-    else:
-        # If all values are 0, create a uniform heatmap
-        cam = np.ones_like(cam) * 0.5
+        # Normalize CAM, handling edge case where max is 0
+        cam_max = cam.max()
+        if cam_max > 0:
+            cam = cam / cam_max
+        else:
+            # If all values are 0, create a uniform heatmap
+            cam = torch.full_like(cam, 0.5)
 
-    cam = cv2.resize(cam, original_image.size)
-    
     # Ensure cam values are valid (handle any remaining NaN/inf values)
-    cam = np.nan_to_num(cam, nan=0.0, posinf=1.0, neginf=0.0)
-    cam = np.clip(cam, 0.0, 1.0)
-    
-    heatmap = cv2.applyColorMap((cam*255).astype("uint8"), cv2.COLORMAP_JET)
+    cam = np.nan_to_num(cam.cpu().numpy(), nan=0.0, posinf=1.0, neginf=0.0)
+    np.clip(cam, 0.0, 1.0, out=cam)
+    return cam, output.detach().float()
 
-    # Ensure original_image is RGB
-    if original_image.mode != 'RGB':
-        original_image = original_image.convert('RGB')
+def render_overlay(cam: np.ndarray, original_image: Image.Image, max_dim: int = HEATMAP_MAX_DIM) -> np.ndarray:
+    """
+    Blend the CAM over the image at no more than max_dim on the longest side.
+    The image is downscaled first, so the CAM is only ever upsampled to the
+    overlay size. Returns a reused buffer: encode or copy it before the next call.
+    """
+    width, height = original_image.size
+    scale = min(1.0, max_dim / max(width, height))
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    image = original_image
+    if size != image.size:
+        # reducing_gap lets PIL use its fast integer reduce() before resampling
+        image = image.resize(size, Image.BILINEAR, reducing_gap=2.0)
 
-    overlay = cv2.addWeighted(
-        np.array(original_image), 0.6, heatmap, 0.4, 0
-    )
+    # Ensure image is RGB
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
 
-    filename = f"{uuid.uuid4()}.png"
-    path = f"static/heatmaps/{filename}"
-    
-    # Ensure directory exists
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    
-    cv2.imwrite(path, overlay)
+    cam_resized, cam_u8, heatmap, overlay = _render_buffers(size[1], size[0])
+    cv2.resize(cam, size, dst=cam_resized)
+    cv2.convertScaleAbs(cam_resized, dst=cam_u8, alpha=255)
+    cv2.applyColorMap(cam_u8, cv2.COLORMAP_JET, dst=heatmap)
+    cv2.addWeighted(np.asarray(image), 0.6, heatmap, 0.4, 0, dst=overlay)
+    return overlay
 
-    return f"/static/heatmaps/{filename}"
+def generate_cam(model, input_tensor, original_image):
+    cam, _ = compute_cam(model, input_tensor)
+    # Downscaled, compressed and content-addressed; see heatmaps.py
+    return heatmap_store.save(render_overlay(cam, original_image))
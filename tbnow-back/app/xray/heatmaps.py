@@ -0,0 +1,146 @@
+"""
+Content-addressed storage for Grad-CAM heatmaps.
+
+Overlays are downscaled, encoded as WebP/JPEG and named after the hash of the
+encoded bytes, so identical analyses share one file. Files referenced from
+patient_records.xray_result are kept; unreferenced files older than the
+retention window are garbage-collected.
+
+Usage:
+    python -m app.xray.heatmaps gc [--retention-days 30] [--dry-run]
+"""
+
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from fastapi.staticfiles import StaticFiles
+
+from app.monitoring.metrics import CACHE_LOOKUPS
+from app.records.db import get_db, init_database
+
+HEATMAP_DIR = "static/heatmaps"
+HEATMAP_URL_PREFIX = "/static/heatmaps/"
+HEATMAP_EXTENSIONS = (".webp", ".jpg", ".png")
+
+# Configurable via environment
+HEATMAP_FORMAT = os.getenv("HEATMAP_FORMAT", "webp").lower()  # webp | jpeg
+HEATMAP_QUALITY = int(os.getenv("HEATMAP_QUALITY", "80"))
+HEATMAP_MAX_DIM = int(os.getenv("HEATMAP_MAX_DIM", "768"))
+HEATMAP_RETENTION_DAYS = float(os.getenv("HEATMAP_RETENTION_DAYS", "30"))
+
+class HeatmapStore:
+    def __init__(self, directory: str = HEATMAP_DIR, fmt: str = HEATMAP_FORMAT,
+                 quality: int = HEATMAP_QUALITY, max_dim: int = HEATMAP_MAX_DIM):
+        if fmt not in ("webp", "jpeg"):
+            raise ValueError(f"Unsupported heatmap format: {fmt}")
+        self.directory = directory
+        self.fmt = fmt
+        self.quality = quality
+        self.max_dim = max_dim
+
+    def encode(self, image: np.ndarray) -> bytes:
+        """Downscale so the longest side is at most max_dim, then encode"""
+        height, width = image.shape[:2]
+        scale = self.max_dim / max(height, width)
+        if scale < 1:
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+        if self.fmt == "webp":
+            ok, buffer = cv2.imencode(".webp", image, [cv2.IMWRITE_WEBP_QUALITY, self.quality])
+        else:
+            ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise RuntimeError(f"Failed to encode heatmap as {self.fmt}")
+        return buffer.tobytes()
+
+    def save(self, image: np.ndarray) -> str:
+        """Store an overlay image and return its public URL"""
+        data = self.encode(image)
+        extension = ".webp" if self.fmt == "webp" else ".jpg"
+        filename = hashlib.sha256(data).hexdigest()[:32] + extension
+        path = os.path.join(self.directory, filename)
+
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(path):
+            # Deduplicated: refresh mtime so the retention window restarts
+            os.utime(path)
+            CACHE_LOOKUPS.inc(cache="heatmaps", result="hit")
+        else:
+            CACHE_LOOKUPS.inc(cache="heatmaps", result="miss")
+            # Write to a temp file and rename so readers never see partial files
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+        return HEATMAP_URL_PREFIX + filename
+
+    def referenced_files(self) -> set:
+        """Filenames referenced by xray_result.heatmap_url in patient_records"""
+        with get_db() as conn:
+            rows = conn.execute(
+                'SELECT DISTINCT heatmap_url FROM patient_records WHERE heatmap_url IS NOT NULL'
+            ).fetchall()
+        return {
+            row['heatmap_url'][len(HEATMAP_URL_PREFIX):]
+            for row in rows
+            if row['heatmap_url'].startswith(HEATMAP_URL_PREFIX)
+        }
+
+    def gc(self, retention_days: float = HEATMAP_RETENTION_DAYS, dry_run: bool = False) -> dict:
+        """
+        Delete heatmaps that no record references and that are older than the
+        retention window (analyses are saved to a record after the fact).
+        """
+        if not os.path.isdir(self.directory):
+            return {"deleted": 0, "kept": 0, "freed_bytes": 0, "dry_run": dry_run}
+
+        referenced = self.referenced_files()
+        cutoff = time.time() - retention_days * 86400
+        deleted = kept = freed = 0
+
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or not entry.name.endswith(HEATMAP_EXTENSIONS):
+                continue
+            stat = entry.stat()
+            if entry.name in referenced or stat.st_mtime > cutoff:
+                kept += 1
+                continue
+            if not dry_run:
+                os.remove(entry.path)
+            deleted += 1
+            freed += stat.st_size
+
+        return {"deleted": deleted, "kept": kept, "freed_bytes": freed, "dry_run": dry_run}
+
+class ImmutableStaticFiles(StaticFiles):
+    """Static files whose names never change content (content-addressed heatmaps)"""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+heatmap_store = HeatmapStore()
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage stored Grad-CAM heatmaps")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    gc_parser = subparsers.add_parser("gc", help="Delete unreferenced heatmaps past the retention window")
+    gc_parser.add_argument("--retention-days", type=float, default=HEATMAP_RETENTION_DAYS)
+    gc_parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    init_database()
+    result = heatmap_store.gc(args.retention_days, args.dry_run)
+    action = "Would delete" if args.dry_run else "Deleted"
+    print(f"🧹 {action} {result['deleted']} heatmaps ({result['freed_bytes'] / 1e6:.1f} MB), kept {result['kept']}")
+
+if __name__ == "__main__":
+    main()
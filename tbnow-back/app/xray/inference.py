@@ -1,47 +1,52 @@
 import torch
+import numpy as np
 from PIL import Image
-import torchvision.transforms as T
-from .model import load_tb_model
-from .gradcam import generate_cam
+from app.monitoring.metrics import stage_timer
+from app.monitoring.tracing import traced
+from .model import autocast_context, prepare_input
+from .gradcam import compute_cam, render_overlay
+from .heatmaps import heatmap_store
+from .registry import model_manager
+from .preprocessing import decode, preprocess
+from .calibration import risk_level
+from .shadow import shadow_runner, SHADOW_VERSION
+import time
 import warnings
-import os
 
 # Suppress warnings
 warnings.filterwarnings('ignore', category=UserWarning)
 warnings.filterwarnings('ignore', category=DeprecationWarning)
 warnings.filterwarnings('ignore', category=RuntimeWarning)
 
-# Validate model exists before loading
-model_path = os.path.join(os.path.dirname(__file__), "model_tb.pth")
-if not os.path.exists(model_path):
-    print(f"WARNING: Model file not found at {model_path}")
-    print("X-ray analysis will not work properly!")
-    model = None
-else:
+# Load the registry's active version (or model_tb.pth) and follow later swaps
+if model_manager.load_active():
+    print("X-ray model loaded successfully")
+model_manager.start_polling()
+
+if SHADOW_VERSION:
     try:
-        model = load_tb_model()
-        print("X-ray model loaded successfully")
+        shadow_runner.configure(SHADOW_VERSION)
+        print(f"Shadow X-ray model {SHADOW_VERSION} on {shadow_runner.sample_rate:.0%} of analyses")
     except Exception as e:
-        print(f"ERROR loading X-ray model: {e}")
-        model = None
+        print(f"⚠️  Shadow model {SHADOW_VERSION} not loaded: {e}")
 
-transform = T.Compose([
-    T.Resize((224, 224)),
-    T.Grayscale(3),
-    T.ToTensor(),
-    T.Normalize([0.485,0.456,0.406], [0.229,0.224,0.225])
-])
+@traced("xray.quick_screen")
+def quick_screen(image: Image.Image, heatmap: str = "overlay"):
+    """
+    Screen a chest X-ray. heatmap="overlay" stores a rendered Grad-CAM overlay
+    and returns its URL; heatmap="cam" skips rendering and returns the raw
+    low-res CAM grid for client-side rendering.
+    """
+    # Shadow batches wait until no live analysis is running, so they don't compete for the torch threads
+    with shadow_runner.live_analysis():
+        return _screen(image, heatmap)
 
-transform = T.Compose([
-    T.Resize((224, 224)),
-    T.Grayscale(3),
-    T.ToTensor(),
-    T.Normalize([0.485,0.456,0.406], [0.229,0.224,0.225])
-])
+def _screen(image: Image.Image, heatmap: str):
+    # One snapshot for the whole request: a concurrent swap doesn't affect it
+    loaded = model_manager.current()
 
-def quick_screen(image: Image.Image):
     # Check if model is available
-    if model is None:
+    if loaded is None:
         return {
             "risk_level": "Error",
             "confidence": 0.0,
@@ -49,27 +54,41 @@ def quick_screen(image: Image.Image):
             "recommendations": "Hubungi administrator sistem untuk memperbaiki model X-ray.",
             "follow_up_questions": [],
             "heatmap_url": None,
+            "model_version": None,
             "note": "Sistem X-ray analysis tidak tersedia"
         }
 
-    x = transform(image).unsqueeze(0)
+    # Uploads are opened lazily; decoding happens here, timed apart from the resize/normalize
+    with stage_timer("image_decode"):
+        decode(image)
+
+    # Fresh tensor per request: the shadow worker may still hold it after we return
+    with stage_timer("preprocess"):
+        x = prepare_input(preprocess(image, loaded.metadata["preprocessing"]["size"]))
     x.requires_grad = True
 
-    output = model(x)
-    probabilities = torch.softmax(output, dim=1)
-    prob_tb = probabilities[0, 1].item()  # Probability of TB (class 1)
-    prob_normal = probabilities[0, 0].item()  # Probability of Normal (class 0)
+    # Softmax temperature and risk cutoffs fitted by evaluate_model.py for this version
+    calibration = loaded.calibration
 
-    # Debug logging (can be removed in production)
-    print(f"X-ray Analysis - TB: {prob_tb:.3f}, Normal: {prob_normal:.3f}")
+    # A single forward/backward pass yields both the prediction and the CAM
+    # (timed as the forward and gradcam_backward stages inside compute_cam)
+    start = time.perf_counter()
+    cam, output = compute_cam(loaded.model, x, forward_context=autocast_context)
+    model_ms = (time.perf_counter() - start) * 1000
+    probabilities = torch.softmax(output / calibration["temperature"], dim=1)
+    prob_tb = probabilities[0, 1].item()  # Probability of TB (class 1)
 
-    heatmap_path = generate_cam(model, x, image)
+    heatmap_path = None
+    if heatmap == "overlay":
+        with stage_timer("heatmap_render"):
+            overlay = render_overlay(cam, image)
+        with stage_timer("heatmap_write"):
+            heatmap_path = heatmap_store.save(overlay)
 
-    # More conservative thresholds for medical diagnosis
-    # Require strong evidence for TB detection to avoid false positives
-    # Bias toward normal classification for medical safety
-    if prob_tb > 0.90 and prob_normal < 0.10:
-        risk = "High"
+    # Conservative cutoffs for medical diagnosis: the calibration targets high
+    # precision so that normal scans are rarely flagged
+    risk = risk_level(prob_tb, calibration["thresholds"])
+    if risk == "High":
         observations = "Terdeteksi area abnormal pada paru-paru yang menunjukkan kemungkinan infiltrat, kavitas, atau lesi aktif TB. Heatmap menunjukkan area fokal dengan aktivitas tinggi."
         recommendations = "Segera lakukan pemeriksaan klinis lengkap dan konfirmasi diagnosis dengan pemeriksaan sputum BTA, kultur, atau PCR. Pertimbangkan isolasi pasien dan kontak tracing."
         follow_up_questions = [
@@ -78,8 +97,7 @@ def quick_screen(image: Image.Image):
             "Apakah pasien mengalami penurunan berat badan?",
             "Apakah ada gejala demam atau keringat malam?"
         ]
-    elif prob_tb > 0.80 and prob_normal < 0.20:
-        risk = "Medium"
+    elif risk == "Medium":
         observations = "Terdapat indikasi abnormalitas pada struktur paru-paru yang memerlukan evaluasi lebih lanjut. Heatmap menunjukkan area dengan aktivitas sedang yang perlu diperhatikan."
         recommendations = "Lakukan pemeriksaan klinis menyeluruh dan pertimbangkan pemeriksaan penunjang tambahan seperti tes sputum atau rontgen berulang dalam 2-4 minggu."
         follow_up_questions = [
@@ -89,7 +107,6 @@ def quick_screen(image: Image.Image):
             "Apakah pasien perokok atau memiliki riwayat TB sebelumnya?"
         ]
     else:
-        risk = "Low"
         observations = "Struktur paru-paru tampak normal tanpa indikasi signifikan kelainan TB. Heatmap menunjukkan aktivitas rendah pada area paru-paru."
         recommendations = "Lanjutkan pemantauan rutin kesehatan. Jika muncul gejala baru, segera konsultasikan dengan tenaga kesehatan."
         follow_up_questions = [
@@ -99,12 +116,19 @@ def quick_screen(image: Image.Image):
             "Kapan pemeriksaan kesehatan terakhir dilakukan?"
         ]
 
-    return {
+    result = {
         "risk_level": risk,
         "confidence": round(prob_tb, 2),
         "observations": observations,
         "recommendations": recommendations,
         "follow_up_questions": follow_up_questions,
         "heatmap_url": heatmap_path,
+        "model_version": loaded.version,
         "note": "Hasil ini bukan diagnosis definitif dan harus dikonfirmasi oleh tenaga kesehatan profesional"
     }
+    if heatmap == "cam":
+        result["cam"] = np.round(cam, 3).tolist()
+
+    # Candidate model on a sample of traffic, in the background (see shadow.py)
+    shadow_runner.maybe_submit(x, loaded, prob_tb, risk, model_ms)
+    return result
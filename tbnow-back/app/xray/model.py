@@ -1,10 +1,11 @@
 import torch
 import torchvision.models as models
 import torch.nn as nn
-import torchvision.transforms as transforms
-from PIL import Image
 import os
 import warnings
+from contextlib import nullcontext
+# PREPROCESSING (what every registered model is trained for) is re-exported for the registry
+from .preprocessing import PREPROCESSING
 
 # Suppress warnings
 warnings.filterwarnings('ignore', category=UserWarning)
@@ -12,69 +13,74 @@ warnings.filterwarnings('ignore', category=DeprecationWarning)
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-# Load model architecture
-model = models.resnet18(weights=None)  # must match your training
-model.fc = nn.Linear(model.fc.in_features, 2)  # TB vs Normal
+# Runtime options (environment): XRAY_PRECISION=fp32|bf16 runs the forward pass
+# under torch.autocast, XRAY_CHANNELS_LAST=1 stores weights/inputs NHWC, and
+# XRAY_COMPILE=1 compiles the model used for batched, gradient-free prediction.
+# Grad-CAM always runs on the eager model because it relies on module hooks.
+XRAY_PRECISION = os.getenv("XRAY_PRECISION", "fp32").lower()
+XRAY_CHANNELS_LAST = os.getenv("XRAY_CHANNELS_LAST", "0") == "1"
+XRAY_COMPILE = os.getenv("XRAY_COMPILE", "0") == "1"
+AUTOCAST_DTYPES = {"bf16": torch.bfloat16, "fp16": torch.float16}
 
-# Load weights (adjust path if needed)
-model_path = os.path.join(os.path.dirname(__file__), "model_tb.pth")
-try:
-    checkpoint = torch.load(model_path, map_location=device)
+def build_model(state_dict=None) -> nn.Module:
+    """ResNet18 with a 2-class head matching the checkpoint (train_tb_model.py adds Dropout)"""
+    model = models.resnet18(weights=None)  # must match your training
+    if state_dict is not None and 'fc.1.weight' in state_dict:
+        model.fc = nn.Sequential(nn.Dropout(0.5), nn.Linear(model.fc.in_features, 2))
+    else:
+        model.fc = nn.Linear(model.fc.in_features, 2)  # TB vs Normal
+    if state_dict is not None:
+        model.load_state_dict(state_dict)
+    return model
+
+def load_state_dict(path: str) -> dict:
+    checkpoint = torch.load(path, map_location=device)
     if isinstance(checkpoint, dict) and 'model_state_dict' in checkpoint:
         # New checkpoint format with metadata
-        model.load_state_dict(checkpoint['model_state_dict'])
-        print(f"Loaded model checkpoint from epoch {checkpoint.get('epoch', 'unknown')}")
-    else:
-        # Legacy format (direct state_dict)
-        model.load_state_dict(checkpoint)
-        print("Loaded legacy model format")
-except Exception as e:
-    print(f"Error loading model: {e}")
-    print("Using untrained model - predictions may be inaccurate!")
+        return checkpoint['model_state_dict']
+    # Legacy format (direct state_dict)
+    return checkpoint
 
-model = model.to(device)
-model.eval()
+class LoadedModel:
+    """One model version ready for serving: eager model (Grad-CAM), compiled model (batch prediction) and metadata"""
 
-def load_tb_model():
-    return model
+    def __init__(self, version: str, weights_path: str, metadata: dict):
+        self.version = version
+        self.metadata = metadata
+        self.calibration = metadata["calibration"]
 
-# Preprocess image
-def preprocess_image(image: Image.Image):
-    transform = transforms.Compose([
-        transforms.Resize((224, 224)),  # Adjust size as per training
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])  # ImageNet norms
-    ])
-    return transform(image).unsqueeze(0).to(device)
+        model = build_model(load_state_dict(weights_path)).to(device)
+        model.eval()
+        # Serving never updates weights; Grad-CAM only needs gradients w.r.t. activations,
+        # so skip computing weight gradients in the backward pass
+        model.requires_grad_(False)
+        if XRAY_CHANNELS_LAST:
+            model = model.to(memory_format=torch.channels_last)
+        self.model = model
 
-# Predict
-def predict(image_tensor):
-    with torch.no_grad():
-        outputs = model(image_tensor)
-        probabilities = torch.softmax(outputs, dim=1)
-        confidence, predicted = torch.max(probabilities, 1)
-        return predicted.item(), confidence.item()
+        self.compiled_model = model
+        if XRAY_COMPILE:
+            try:
+                self.compiled_model = torch.compile(model)
+            except Exception as e:
+                print(f"torch.compile unavailable, using eager model: {e}")
 
-# Risk level
-def get_risk_level(pred, conf):
-    if pred == 1:  # TB
-        if conf > 0.8:
-            return "High"
-        elif conf > 0.6:
-            return "Medium"
-        else:
-            return "Low"
-    else:
-        return "Low"  # Normal
+def load_tb_model():
+    """The eager model of the active version (None if no model could be loaded)"""
+    from .registry import model_manager
+    loaded = model_manager.current()
+    return loaded.model if loaded else None
+
+def autocast_context():
+    """Autocast context for forward passes, per XRAY_PRECISION (no-op for fp32)"""
+    dtype = AUTOCAST_DTYPES.get(XRAY_PRECISION)
+    if dtype is None:
+        return nullcontext()
+    return torch.autocast(device_type=device.type, dtype=dtype)
 
-# Main analysis
-def analyze_xray(image: Image.Image):
-    image_tensor = preprocess_image(image)
-    pred, conf = predict(image_tensor)
-    risk = get_risk_level(pred, conf)
-    return {
-        "risk_level": risk,
-        "confidence": round(conf, 2),
-        "prediction": "TB" if pred == 1 else "Normal",
-        "note": "Not a medical diagnosis"
-    }
+def prepare_input(image_tensor: torch.Tensor) -> torch.Tensor:
+    """Move a batch to the model's device and memory format"""
+    image_tensor = image_tensor.to(device)
+    if XRAY_CHANNELS_LAST:
+        image_tensor = image_tensor.contiguous(memory_format=torch.channels_last)
+    return image_tensor
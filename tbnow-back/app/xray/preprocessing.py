@@ -0,0 +1,94 @@
+"""
+X-ray preprocessing shared by training and serving.
+
+Images are decoded straight to single-channel uint8 (JPEG draft mode skips
+the RGB conversion), resized once with PIL bilinear, and normalized into a
+float tensor. The model takes 3 ImageNet-normalized channels, but for a
+grayscale image they differ only by mean/std, so each channel is written by
+broadcasting the single plane against per-channel scale/shift in one
+addcmul; the 3 identical copies Grayscale(3) used to create never exist.
+
+The training cache (app/scripts/xray_dataset.py) stores load_gray() output
+and normalizes with normalize_into(), so evaluation inputs are bit-identical
+to serving inputs; see test_preprocessing.py.
+"""
+
+import io
+
+import numpy as np
+import torch
+from PIL import Image
+
+IMAGE_SIZE = 224
+MEAN = [0.485, 0.456, 0.406]
+STD = [0.229, 0.224, 0.225]
+
+# Recorded in model registry metadata and the dataset cache fingerprint
+PREPROCESSING = {
+    "size": IMAGE_SIZE,
+    "grayscale": True,
+    "resize": "pil-bilinear",
+    "mean": MEAN,
+    "std": STD,
+}
+
+# x / 255 normalized with (x - mean) / std  ==  x * scale + shift
+_SCALE = (1.0 / (255.0 * torch.tensor(STD))).view(3, 1, 1)
+_SHIFT = (-torch.tensor(MEAN) / torch.tensor(STD)).view(3, 1, 1)
+
+
+def decode(image: Image.Image) -> Image.Image:
+    """Decode an opened image's pixels in place, JPEGs directly to luma"""
+    # draft() is a no-op for other formats and for images that are already loaded
+    image.draft("L", None)
+    image.load()
+    return image
+
+def load_gray(image: Image.Image, size: int = IMAGE_SIZE) -> np.ndarray:
+    """Decode an opened image (if not done yet) to a size x size uint8 array"""
+    decode(image)
+    if image.mode != "L":
+        image = image.convert("L")
+    if image.size != (size, size):
+        image = image.resize((size, size), Image.BILINEAR)
+    return np.array(image, dtype=np.uint8)  # writable, so torch.from_numpy can share it
+
+
+def decode_gray(data: bytes, size: int = IMAGE_SIZE) -> np.ndarray:
+    with Image.open(io.BytesIO(data)) as image:
+        return load_gray(image, size)
+
+
+def normalize_into(out: torch.Tensor, gray) -> torch.Tensor:
+    """Write the normalized 3 x H x W tensor for a uint8 H x W (or 1 x H x W) plane into out"""
+    if isinstance(gray, np.ndarray):
+        gray = torch.from_numpy(gray)
+    plane = gray.reshape(1, *gray.shape[-2:]).to(torch.float32)
+    return torch.addcmul(_SHIFT, plane, _SCALE, out=out)
+
+
+def normalize(gray) -> torch.Tensor:
+    size = gray.shape[-2:]
+    return normalize_into(torch.empty(3, *size), gray)
+
+
+def batch_buffer(batch_size: int, size: int = IMAGE_SIZE) -> torch.Tensor:
+    """A batch tensor to reuse across preprocess_batch calls"""
+    return torch.empty(batch_size, 3, size, size)
+
+
+def preprocess_batch(images, out: torch.Tensor = None, size: int = IMAGE_SIZE) -> torch.Tensor:
+    """
+    PIL images -> normalized N x 3 x size x size. With out (see batch_buffer),
+    fills its first N rows and returns that view instead of allocating.
+    """
+    if out is None:
+        out = batch_buffer(len(images), size)
+    for i, image in enumerate(images):
+        normalize_into(out[i], load_gray(image, size))
+    return out[:len(images)]
+
+
+def preprocess(image: Image.Image, size: int = IMAGE_SIZE) -> torch.Tensor:
+    """One image as a freshly allocated 1 x 3 x size x size batch"""
+    return preprocess_batch([image], size=size)
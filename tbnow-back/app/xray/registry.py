@@ -0,0 +1,288 @@
+"""
+X-ray model registry and hot-swap.
+
+Each registered version lives in XRAY_MODEL_REGISTRY/<version>/ as model.pth
+plus metadata.json (val_acc, calibration thresholds, preprocessing, source).
+The version is a content hash of the weights, the same one the cached-logits
+evaluation uses. A pointer file, ACTIVE, names the version being served.
+
+Every server process holds the active model in a ModelManager. Activating a
+version loads and warms it up next to the current one and then swaps a single
+reference, so in-flight requests finish on the model they started with. The
+process that handles the admin request swaps at once and rewrites ACTIVE;
+other workers poll ACTIVE and swap the same way within XRAY_MODEL_POLL_SECONDS.
+A worker that fails to load the active version keeps serving its current model
+and doesn't retry until ACTIVE is rewritten.
+
+Without any registered version, app/xray/model_tb.pth is served as before.
+
+Usage:
+    python -m app.xray.registry register path/to/model.pth [--calibration app/xray/calibration.json] [--activate]
+    python -m app.xray.registry list
+    python -m app.xray.registry activate <version>
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from app.monitoring.tracing import traced
+from .calibration import CALIBRATION_PATH, load_calibration
+
+REGISTRY_DIR = os.getenv("XRAY_MODEL_REGISTRY", "data/models")
+LEGACY_MODEL_PATH = os.path.join(os.path.dirname(__file__), "model_tb.pth")
+POLL_SECONDS = float(os.getenv("XRAY_MODEL_POLL_SECONDS", "5"))
+
+def weights_version(path: str) -> str:
+    """Short content hash of a weights file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+def _write_atomic(path: str, text: str):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+class ModelRegistry:
+    """Versioned model artifacts on disk"""
+
+    def __init__(self, directory: str = REGISTRY_DIR):
+        self.directory = directory
+        self.active_path = os.path.join(directory, "ACTIVE")
+
+    def weights_path(self, version: str) -> str:
+        return os.path.join(self.directory, version, "model.pth")
+
+    def metadata(self, version: str) -> dict:
+        path = os.path.join(self.directory, version, "metadata.json")
+        if not os.path.exists(path):
+            raise KeyError(f"Unknown model version: {version}")
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def versions(self) -> list:
+        """Metadata of every registered version, newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        versions = [self.metadata(entry.name) for entry in os.scandir(self.directory)
+                    if entry.is_dir() and os.path.exists(os.path.join(entry.path, "metadata.json"))]
+        return sorted(versions, key=lambda m: m["created_at"], reverse=True)
+
+    def active_version(self):
+        try:
+            with open(self.active_path, "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def active_mtime(self):
+        """Modification time of ACTIVE; changes whenever a version is (re)activated"""
+        try:
+            return os.stat(self.active_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def set_active(self, version: str):
+        self.metadata(version)  # must exist
+        os.makedirs(self.directory, exist_ok=True)
+        _write_atomic(self.active_path, version + "\n")
+
+    def register(self, weights_path: str, calibration_path: str = CALIBRATION_PATH, **extra) -> dict:
+        """Copy weights into the registry with their metadata; returns the metadata"""
+        from .model import PREPROCESSING
+        import torch
+
+        version = weights_version(weights_path)
+        version_dir = os.path.join(self.directory, version)
+        os.makedirs(version_dir, exist_ok=True)
+
+        checkpoint = torch.load(weights_path, map_location="cpu", weights_only=False)
+        training = {}
+        if isinstance(checkpoint, dict) and 'model_state_dict' in checkpoint:
+            training = {key: checkpoint[key] for key in ("epoch", "val_acc", "train_loss") if key in checkpoint}
+        calibration = load_calibration(calibration_path)
+
+        metadata = {
+            "version": version,
+            "created_at": datetime.now().isoformat(),
+            "source": os.path.abspath(weights_path),
+            "val_acc": training.get("val_acc"),
+            "training": training,
+            "calibration": {"temperature": calibration["temperature"], "thresholds": calibration["thresholds"]},
+            "preprocessing": PREPROCESSING,
+            **extra,
+        }
+        target = self.weights_path(version)
+        if not os.path.exists(target):
+            shutil.copyfile(weights_path, target + ".tmp")
+            os.replace(target + ".tmp", target)
+        _write_atomic(os.path.join(version_dir, "metadata.json"), json.dumps(metadata, indent=2))
+        return metadata
+
+def warmup(loaded, runs: int = 2):
+    """Run the serving paths once so first requests don't pay for lazy init/compilation"""
+    import torch
+    from .model import prepare_input, autocast_context
+    from .gradcam import compute_cam
+
+    size = loaded.metadata["preprocessing"]["size"]
+    for _ in range(runs):
+        x = prepare_input(torch.zeros(1, 3, size, size))
+        with torch.inference_mode(), autocast_context():
+            loaded.compiled_model(x)
+        x.requires_grad = True
+        compute_cam(loaded.model, x, forward_context=autocast_context, record_stages=False)
+
+class ModelManager:
+    """The model this process serves, swapped atomically"""
+
+    def __init__(self, registry: ModelRegistry):
+        self.registry = registry
+        self._current = None
+        self._swap_lock = threading.Lock()  # one load/swap at a time
+        self._poller = None
+        self._failed = None  # (version, ACTIVE mtime) that failed to load; not retried until ACTIVE changes
+
+    def current(self):
+        """Snapshot of the active LoadedModel; hold on to it for the whole request"""
+        return self._current
+
+    @traced("xray.load_model")
+    def load_version(self, version: str):
+        """Load and warm up a version without serving it ('legacy' loads model_tb.pth)"""
+        from .model import LoadedModel, PREPROCESSING
+        start = time.perf_counter()
+        if version == "legacy":
+            # Unregistered model_tb.pth with the standalone calibration file
+            calibration = load_calibration()
+            metadata = {
+                "version": weights_version(LEGACY_MODEL_PATH),
+                "val_acc": None,
+                "calibration": {"temperature": calibration["temperature"], "thresholds": calibration["thresholds"]},
+                "preprocessing": PREPROCESSING,
+            }
+            loaded = LoadedModel(metadata["version"], LEGACY_MODEL_PATH, metadata)
+        else:
+            loaded = LoadedModel(version, self.registry.weights_path(version), self.registry.metadata(version))
+        warmup(loaded)
+        print(f"X-ray model {loaded.version} loaded and warmed up in {time.perf_counter() - start:.1f}s")
+        return loaded
+
+    def load_active(self):
+        """Load the registry's active version (or the legacy model_tb.pth) at startup"""
+        version = self.registry.active_version()
+        if version is None:
+            if not os.path.exists(LEGACY_MODEL_PATH):
+                print(f"WARNING: No active model in {self.registry.directory} and no {LEGACY_MODEL_PATH}")
+                print("X-ray analysis will not work properly!")
+                return None
+            version = "legacy"
+        try:
+            with self._swap_lock:
+                self._current = self.load_version(version)
+        except Exception as e:
+            print(f"ERROR loading X-ray model {version}: {e}")
+            self._failed = (version, self.registry.active_mtime())
+        return self._current
+
+    def activate(self, version: str) -> dict:
+        """Preload and warm up version, swap it in, and point every other worker at it"""
+        self.registry.metadata(version)  # KeyError for unknown versions, before any work
+        with self._swap_lock:
+            previous = self._current.version if self._current else None
+            if previous != version:
+                self._current = self.load_version(version)
+            self.registry.set_active(version)
+        return {"active": version, "previous": previous}
+
+    def poll_once(self):
+        """Follow ACTIVE if another process changed it"""
+        version = self.registry.active_version()
+        current = self._current.version if self._current else None
+        if version is None or version == current:
+            return
+        # A corrupt or missing version would otherwise be reloaded and warmed up on every poll
+        attempt = (version, self.registry.active_mtime())
+        if attempt == self._failed:
+            return
+        with self._swap_lock:
+            if self._current is None or self._current.version != version:
+                print(f"Active X-ray model changed to {version}, swapping")
+                try:
+                    self._current = self.load_version(version)
+                except Exception as e:
+                    self._failed = attempt
+                    print(f"⚠️  Could not load X-ray model {version}, keeping {current} until ACTIVE changes: {e}")
+
+    def start_polling(self, interval: float = POLL_SECONDS):
+        if self._poller is not None or interval <= 0:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.poll_once()
+                except Exception as e:
+                    print(f"⚠️  Model poll failed: {e}")
+
+        self._poller = threading.Thread(target=run, name="xray-model-poller", daemon=True)
+        self._poller.start()
+
+    def status(self) -> dict:
+        loaded = self._current
+        return {
+            "loaded": loaded.version if loaded else None,
+            "active": self.registry.active_version(),
+            "versions": self.registry.versions(),
+        }
+
+model_registry = ModelRegistry()
+model_manager = ModelManager(model_registry)
+
+def main():
+    parser = argparse.ArgumentParser(description="X-ray model registry")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    register = subparsers.add_parser("register", help="Add a weights file to the registry")
+    register.add_argument("weights")
+    register.add_argument("--calibration", default=CALIBRATION_PATH,
+                          help="Calibration artifact from evaluate_model.py --save")
+    register.add_argument("--notes", default="")
+    register.add_argument("--activate", action="store_true", help="Also make it the active version")
+
+    subparsers.add_parser("list", help="List registered versions")
+
+    activate = subparsers.add_parser("activate", help="Point running servers at a version")
+    activate.add_argument("version")
+
+    args = parser.parse_args()
+    if args.command == "register":
+        metadata = model_registry.register(args.weights, args.calibration, notes=args.notes)
+        print(f"Registered {metadata['version']} (val_acc {metadata['val_acc']})")
+        if args.activate:
+            model_registry.set_active(metadata["version"])
+            print(f"Activated {metadata['version']}; running servers swap within {POLL_SECONDS:g}s")
+    elif args.command == "list":
+        active = model_registry.active_version()
+        for metadata in model_registry.versions():
+            marker = "*" if metadata["version"] == active else " "
+            thresholds = metadata["calibration"]["thresholds"]
+            print(f"{marker} {metadata['version']}  {metadata['created_at'][:19]}  val_acc={metadata['val_acc']}  "
+                  f"high>={thresholds['high']:.3f} medium>={thresholds['medium']:.3f}  {metadata.get('notes', '')}")
+    elif args.command == "activate":
+        model_registry.set_active(args.version)
+        print(f"Activated {args.version}; running servers swap within {POLL_SECONDS:g}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Shadow evaluation of a candidate X-ray model on live /xray/analyze traffic.
+
+A sampled fraction of analyses hands its already-preprocessed input tensor to
+the shadow BatchWorker after the response is computed, so the candidate never
+adds latency to the request or re-decodes the upload. The worker runs the
+candidate in micro-batches and records both models' TB probabilities, risk
+levels and per-image latency to a local SQLite store (XRAY_SHADOW_DB) for
+offline agreement/latency comparison.
+
+The candidate's forward pass would use the same torch thread pool as live
+analyses, so a batch only starts while no analysis is running in this
+process. It waits up to XRAY_SHADOW_MAX_DEFER_SECONDS for such a gap and is
+dropped (counted as deferred_dropped) if none comes.
+
+Configure with XRAY_SHADOW_VERSION (a registry version) and
+XRAY_SHADOW_SAMPLE_RATE, or at runtime via /admin/xray/shadow.
+"""
+
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import torch
+
+from app.monitoring.tracing import traced
+from .batching import BatchWorker
+from .calibration import risk_level
+from .model import autocast_context
+from .registry import model_manager
+
+SHADOW_DB_PATH = os.getenv("XRAY_SHADOW_DB", "data/shadow.db")
+SHADOW_VERSION = os.getenv("XRAY_SHADOW_VERSION") or None
+SHADOW_SAMPLE_RATE = float(os.getenv("XRAY_SHADOW_SAMPLE_RATE", "0.1"))
+SHADOW_MAX_BATCH = int(os.getenv("XRAY_SHADOW_MAX_BATCH", "8"))
+SHADOW_MAX_QUEUE = int(os.getenv("XRAY_SHADOW_MAX_QUEUE", "32"))
+SHADOW_MAX_DEFER_SECONDS = float(os.getenv("XRAY_SHADOW_MAX_DEFER_SECONDS", "5"))
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+class ShadowStore:
+    """Paired primary/shadow predictions in a small local SQLite database"""
+
+    def __init__(self, path: str = SHADOW_DB_PATH):
+        self.path = path
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _init(self, conn):
+        if self._initialized:
+            return
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS shadow_results (
+                id INTEGER PRIMARY KEY,
+                created_at TEXT NOT NULL,
+                primary_version TEXT NOT NULL,
+                primary_prob REAL NOT NULL,
+                primary_risk TEXT NOT NULL,
+                primary_ms REAL NOT NULL,
+                shadow_version TEXT NOT NULL,
+                shadow_prob REAL NOT NULL,
+                shadow_risk TEXT NOT NULL,
+                shadow_ms REAL NOT NULL,
+                batch_size INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_shadow_versions '
+                     'ON shadow_results(primary_version, shadow_version, created_at)')
+        self._initialized = True
+
+    def record(self, rows):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as conn:
+            self._init(conn)
+            with conn:
+                conn.executemany('''
+                    INSERT INTO shadow_results
+                    (created_at, primary_version, primary_prob, primary_risk, primary_ms,
+                     shadow_version, shadow_prob, shadow_risk, shadow_ms, batch_size)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+
+    def report(self, since: str = None) -> list:
+        """Agreement and latency per (primary, shadow) version pair"""
+        if not os.path.exists(self.path):
+            return []
+        where, params = ("WHERE created_at >= ?", [since]) if since else ("", [])
+        with self._connect() as conn:
+            self._init(conn)
+            pairs = conn.execute(f'''
+                SELECT primary_version, shadow_version, COUNT(*),
+                       AVG(primary_risk = shadow_risk),
+                       AVG((primary_prob >= 0.5) = (shadow_prob >= 0.5)),
+                       AVG(ABS(primary_prob - shadow_prob)),
+                       MAX(ABS(primary_prob - shadow_prob)),
+                       AVG(batch_size),
+                       MIN(created_at), MAX(created_at)
+                FROM shadow_results {where}
+                GROUP BY primary_version, shadow_version
+            ''', params).fetchall()
+
+            report = []
+            for primary, shadow, count, risk_agree, label_agree, mean_diff, max_diff, batch, first, last in pairs:
+                latency = {}
+                for column in ("primary_ms", "shadow_ms"):
+                    values = [row[0] for row in conn.execute(
+                        f'SELECT {column} FROM shadow_results WHERE primary_version = ? AND shadow_version = ?'
+                        f'{" AND created_at >= ?" if since else ""} ORDER BY {column}',
+                        [primary, shadow] + params)]
+                    latency[column] = {"p50": _percentile(values, 0.50), "p95": _percentile(values, 0.95)}
+                report.append({
+                    "primary_version": primary,
+                    "shadow_version": shadow,
+                    "samples": count,
+                    "risk_agreement": risk_agree,
+                    "label_agreement": label_agree,
+                    "mean_abs_prob_diff": mean_diff,
+                    "max_abs_prob_diff": max_diff,
+                    # primary_ms is the Grad-CAM forward+backward pass, shadow_ms a batched forward per image
+                    "primary_ms": latency["primary_ms"],
+                    "shadow_ms": latency["shadow_ms"],
+                    "mean_batch_size": batch,
+                    "first": first,
+                    "last": last,
+                })
+            return report
+
+class ShadowRunner:
+    """Samples analyses and evaluates the shadow model on them in the background"""
+
+    def __init__(self, manager, store: ShadowStore):
+        self.manager = manager
+        self.store = store
+        self.shadow = None
+        self.sample_rate = SHADOW_SAMPLE_RATE
+        self.worker = BatchWorker("xray-shadow", self._process_batch,
+                                  max_batch=SHADOW_MAX_BATCH, max_queue=SHADOW_MAX_QUEUE)
+        self.max_defer = SHADOW_MAX_DEFER_SECONDS
+        self.deferred_dropped = 0
+        self._live = 0  # primary analyses in progress
+        self._idle = threading.Condition()
+
+    def configure(self, version: str, sample_rate: float = None) -> dict:
+        """Load and warm up a registered version as the shadow model"""
+        if sample_rate is not None and not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        candidate = self.shadow
+        if candidate is None or candidate.version != version:
+            candidate = self.manager.load_version(version)
+            current = self.manager.current()
+            if current and candidate.metadata["preprocessing"] != current.metadata["preprocessing"]:
+                raise ValueError(f"Shadow model {version} expects different preprocessing than the active model")
+        # Only once the candidate is loaded and compatible: a failed call leaves the running shadow as it was
+        self.shadow = candidate
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        return self.status()
+
+    def disable(self) -> dict:
+        self.shadow = None
+        return self.status()
+
+    def maybe_submit(self, x: torch.Tensor, primary, prob_tb: float, risk: str, primary_ms: float):
+        """Called by quick_screen after the primary analysis; never blocks"""
+        shadow = self.shadow
+        if shadow is None or shadow.version == primary.version or random.random() >= self.sample_rate:
+            return
+        self.worker.submit((x.detach(), primary.version, prob_tb, risk, primary_ms))
+
+    @contextmanager
+    def live_analysis(self):
+        """Wraps a primary analysis; shadow batches wait while any is in progress"""
+        with self._idle:
+            self._live += 1
+        try:
+            yield
+        finally:
+            with self._idle:
+                self._live -= 1
+                if self._live == 0:
+                    self._idle.notify_all()
+
+    def _process_batch(self, items):
+        with self._idle:
+            idle = self._idle.wait_for(lambda: self._live == 0, self.max_defer)
+        if not idle:
+            self.deferred_dropped += len(items)
+            return
+        self._evaluate(items)
+
+    @traced("xray.shadow_batch")
+    def _evaluate(self, items):
+        shadow = self.shadow
+        if shadow is None:
+            return
+        batch = torch.cat([item[0] for item in items])
+        start = time.perf_counter()
+        with torch.inference_mode(), autocast_context():
+            logits = shadow.compiled_model(batch).float()
+        per_image_ms = (time.perf_counter() - start) * 1000 / len(items)
+        probabilities = torch.softmax(logits / shadow.calibration["temperature"], dim=1)[:, 1].tolist()
+
+        now = datetime.now().isoformat()
+        thresholds = shadow.calibration["thresholds"]
+        self.store.record([
+            (now, primary_version, primary_prob, primary_risk, primary_ms,
+             shadow.version, prob, risk_level(prob, thresholds), per_image_ms, len(items))
+            for (_, primary_version, primary_prob, primary_risk, primary_ms), prob in zip(items, probabilities)
+        ])
+
+    def status(self) -> dict:
+        return {
+            "shadow_version": self.shadow.version if self.shadow else None,
+            "sample_rate": self.sample_rate,
+            "deferred_dropped": self.deferred_dropped,
+            "worker": self.worker.stats(),
+        }
+
+shadow_store = ShadowStore()
+shadow_runner = ShadowRunner(model_manager, shadow_store)
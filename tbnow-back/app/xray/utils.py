@@ -1,15 +1,2 @@
-from PIL import Image
-import torchvision.transforms as transforms
-
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.Grayscale(num_output_channels=3),
-    transforms.ToTensor(),
-    transforms.Normalize(
-        mean=[0.485, 0.456, 0.406],
-        std=[0.229, 0.224, 0.225]
-    )
-])
-
-def preprocess(image: Image.Image):
-    return transform(image).unsqueeze(0)
+# Kept for existing imports; training and serving share preprocessing.py
+from .preprocessing import preprocess
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Record chat prompt size per turn: the old history (last five question/answer
+pairs verbatim) against the conversation memory (app/rag/memory.py: rolling
+summary plus the last turn verbatim), offline (no Gemini).
+
+A consultation of --turns turns is replayed. Before each turn the history part
+of the record prompt is built both ways; after it, the summary is updated as
+the background task would. Conversations come from a records export (the
+longest chat histories in it) or are synthetic, with answers shaped like
+Gemini's (Assessment → Recommendations → Next Steps → Disclaimer, about
+--answer-chars long).
+
+The serving side records the same sizes in tbnow_llm_prompt_chars{prompt=...}
+on /metrics.
+
+Usage (from tbnow-back/):
+    python benchmarks/chat_memory_bench.py --turns 20
+    python -m app.records.bulk export --output records.ndjson
+    python benchmarks/chat_memory_bench.py --records records.ndjson --output chat-$(git rev-parse --short HEAD).json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.rag.memory import VERBATIM_TURNS, conversation_context, summarize
+
+LEGACY_TURNS = 5
+
+QUESTIONS = [
+    "Pasien batuk 3 minggu dengan demam malam hari, pemeriksaan apa yang perlu dilakukan?",
+    "Hasil TCM MTB detected rifampisin sensitif, paduan pengobatan apa yang dianjurkan?",
+    "Bagaimana pemantauan efek samping OAT pada pasien ini?",
+    "Apakah kontak serumah perlu diberikan TPT?",
+    "Pasien mengeluh mual setelah minum obat, apa yang harus dilakukan?",
+    "Kapan pemeriksaan dahak ulang dilakukan?",
+    "Bagaimana jika pasien juga HIV positif?",
+    "Apa tanda bahaya yang memerlukan rujukan segera?",
+]
+
+SECTIONS = [
+    ("Penilaian", "Berdasarkan data pasien, keluhan {topic} sesuai dengan kriteria terduga TBC menurut pedoman "
+                  "Kemenkes dan WHO. Riwayat kontak dan gejala sistemik meningkatkan kemungkinan TBC aktif. "),
+    ("Rekomendasi", "Lakukan pemeriksaan tes cepat molekuler dari spesimen dahak, foto toraks bila tersedia, "
+                    "dan evaluasi klinis menyeluruh terkait {topic}. Catat hasil pada rekam medis. "),
+    ("Langkah Selanjutnya", "Jadwalkan kunjungan ulang, edukasi pasien dan keluarga tentang {topic}, serta "
+                            "pastikan kepatuhan minum obat dengan pengawas menelan obat. "),
+    ("Disclaimer", "Informasi ini bukan diagnosis medis dan harus dikonfirmasi oleh tenaga kesehatan. "),
+]
+
+def synthetic_history(turns: int, answer_chars: int) -> list:
+    history = []
+    for turn in range(turns):
+        question = QUESTIONS[turn % len(QUESTIONS)]
+        topic = question.split(",")[0].lower()
+        parts = []
+        while sum(len(part) for part in parts) < answer_chars:
+            for heading, body in SECTIONS:
+                parts.append(f"**{heading}**\n{body.format(topic=topic)}\n")
+        history.append({"question": question, "response": "".join(parts)[:answer_chars]})
+    return history
+
+def exported_histories(path: str, count: int) -> list:
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    histories = sorted((record.get("chatHistory") or [] for record in records), key=len, reverse=True)
+    return [history for history in histories[:count] if history]
+
+def legacy_context(history: list) -> list:
+    """The history block build_record_context produced before the conversation memory"""
+    lines = ["\nRIWAYAT KONSULTASI SEBELUMNYA:"]
+    for chat in history[-LEGACY_TURNS:]:
+        lines += [f"Q: {chat.get('question', '')}", f"A: {chat.get('response', '')}", "---"]
+    return lines
+
+def replay(history: list, mode: str) -> list:
+    rows, summary = [], {"text": "", "turns": 0}
+    for turn in range(1, len(history) + 1):
+        # The prompt for this turn sees the turns before it
+        record = {"chatHistory": history[:turn - 1], "conversationSummary": summary}
+        before = len("\n".join(legacy_context(record["chatHistory"]))) if turn > 1 else 0
+        after = len("\n".join(conversation_context(record)))
+        # Then the background task folds everything but the newest turns in
+        start = time.perf_counter()
+        target = turn - VERBATIM_TURNS
+        if target > summary["turns"]:
+            summary = {"text": summarize(summary["text"], history[summary["turns"]:target], mode), "turns": target}
+        rows.append({"turn": turn, "before_chars": before, "after_chars": after,
+                     "summary_chars": len(summary["text"]), "summary_ms": (time.perf_counter() - start) * 1000})
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20, help="Turns per synthetic consultation")
+    parser.add_argument("--answer-chars", type=int, default=2500, help="Length of synthetic answers")
+    parser.add_argument("--records", help="Replay the longest chat histories of this NDJSON records export")
+    parser.add_argument("--conversations", type=int, default=5, help="Histories taken from --records")
+    parser.add_argument("--mode", default="extractive", choices=["extractive", "llm"],
+                        help="Summary mode (llm calls Gemini)")
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    histories = (exported_histories(args.records, args.conversations) if args.records
+                 else [synthetic_history(args.turns, args.answer_chars)])
+    if not histories:
+        raise SystemExit(f"No chat history in {args.records}")
+
+    runs = [replay(history, args.mode) for history in histories]
+    longest = max(len(rows) for rows in runs)
+    print(f"{'turn':>4}  {'before':>8}  {'after':>8}  {'summary':>8}  (history chars in the prompt, mean)")
+    per_turn = []
+    for turn in range(longest):
+        rows = [rows[turn] for rows in runs if len(rows) > turn]
+        mean = {key: statistics.mean(row[key] for row in rows)
+                for key in ("before_chars", "after_chars", "summary_chars", "summary_ms")}
+        per_turn.append({"turn": turn + 1, **{key: round(value, 1) for key, value in mean.items()}})
+        print(f"{turn + 1:4d}  {mean['before_chars']:8.0f}  {mean['after_chars']:8.0f}  {mean['summary_chars']:8.0f}")
+
+    summary_ms = [row["summary_ms"] for rows in runs for row in rows]
+    print(f"summary update: mean {statistics.mean(summary_ms):.2f} ms, max {max(summary_ms):.2f} ms ({args.mode})")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"mode": args.mode, "verbatim_turns": VERBATIM_TURNS, "conversations": len(runs),
+                       "per_turn": per_turn}, f, indent=2)
+        print(f"Report written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Grad-CAM microbenchmark: per-stage timings for one X-ray analysis.
+
+Compares the capped-resolution overlay path against the previous
+full-resolution upsample/blend. Uses an untrained ResNet18, so timings
+don't depend on model_tb.pth being present.
+
+Usage (from tbnow-back/):
+    python benchmarks/gradcam_bench.py --size 3000 --iterations 20
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+import torchvision.models as models
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.xray.gradcam import compute_cam, render_overlay
+from app.xray.heatmaps import HeatmapStore
+from app.xray.preprocessing import preprocess
+
+def synthetic_xray(size: int) -> bytes:
+    """A smooth grayscale image encoded as PNG, roughly X-ray-like in size"""
+    rng = np.random.default_rng(0)
+    small = rng.integers(0, 255, (32, 32), dtype=np.uint8)
+    image = cv2.resize(small, (size, size), interpolation=cv2.INTER_CUBIC)
+    ok, buffer = cv2.imencode(".png", image)
+    return buffer.tobytes()
+
+def legacy_overlay(cam, original_image):
+    """The previous full-resolution post-processing, for comparison"""
+    cam = cv2.resize(cam, original_image.size)
+    cam = np.nan_to_num(cam, nan=0.0, posinf=1.0, neginf=0.0)
+    cam = np.clip(cam, 0.0, 1.0)
+    heatmap = cv2.applyColorMap((cam*255).astype("uint8"), cv2.COLORMAP_JET)
+    if original_image.mode != 'RGB':
+        original_image = original_image.convert('RGB')
+    return cv2.addWeighted(np.array(original_image), 0.6, heatmap, 0.4, 0)
+
+def timed(timings, stage, fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    timings.setdefault(stage, []).append((time.perf_counter() - start) * 1000)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=2048, help="Synthetic image side in pixels")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--max-dim", type=int, default=768, help="Overlay size cap")
+    args = parser.parse_args()
+
+    model = models.resnet18(weights=None)
+    model.fc = nn.Linear(model.fc.in_features, 2)
+    model.eval()
+    model.requires_grad_(False)
+
+    store = HeatmapStore(directory=os.devnull)  # encode only, never written
+    legacy_store = HeatmapStore(directory=os.devnull, max_dim=10**9)
+    data = synthetic_xray(args.size)
+    timings = {}
+
+    for i in range(args.iterations + 1):
+        run = {} if i == 0 else timings  # first iteration is warmup
+        image = timed(run, "decode", lambda: Image.open(io.BytesIO(data)).convert("L"))
+        x = timed(run, "preprocess", preprocess, image)
+        x.requires_grad = True
+        cam, _ = timed(run, "forward+backward", compute_cam, model, x)
+        overlay = timed(run, "render (capped)", render_overlay, cam, image, args.max_dim)
+        timed(run, "encode webp (capped)", store.encode, overlay)
+        full = timed(run, "render (legacy full-res)", legacy_overlay, cam, image)
+        timed(run, "encode png (legacy full-res)", lambda: cv2.imencode(".png", full))
+        timed(run, "encode webp (uncapped)", legacy_store.encode, full)
+
+    print(f"Image {args.size}x{args.size}, overlay cap {args.max_dim}px, {args.iterations} iterations")
+    print(f"{'stage':32s} {'median ms':>10s} {'p95 ms':>10s}")
+    for stage, values in timings.items():
+        values = sorted(values)
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        print(f"{stage:32s} {statistics.median(values):10.2f} {p95:10.2f}")
+
+if __name__ == "__main__":
+    main()
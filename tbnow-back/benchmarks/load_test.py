@@ -0,0 +1,534 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test for the API.
+
+Starts uvicorn in a throwaway workspace (fresh SQLite database, heatmap
+directory and RAG index) with Gemini pointed at a local fake that answers
+after --llm-latency-ms, seeds synthetic records, then drives each scenario
+at --concurrency and reports throughput and p50/p95/p99 per endpoint. The
+JSON report also carries the commit and the server-side mean per pipeline
+stage from /metrics, so runs can be compared across commits with --compare.
+
+Scenarios: records_create, records_get, records_query, records_update,
+records_chat, rag_query, xray_analyze, xray_analyze_cam, records_delete.
+
+The X-ray model comes from XRAY_MODEL_REGISTRY (default data/models) or
+app/xray/model_tb.pth; the RAG index is copied from data/faiss.index and
+its chunk store, or built from synthetic chunks if they don't exist. X-ray
+uploads are the test set if present, otherwise synthetic JPEGs.
+
+Usage (from tbnow-back/):
+    python benchmarks/load_test.py --concurrency 8 --requests 200 --output load-$(git rev-parse --short HEAD).json
+    python benchmarks/load_test.py --scenarios xray_analyze,rag_query --duration 30 --workers 2
+    python benchmarks/load_test.py --url http://localhost:8000 --scenarios records_get,records_query
+    python benchmarks/load_test.py --compare load-abc123.json load-def456.json
+"""
+
+import argparse
+import http.client
+import io
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import numpy as np
+from PIL import Image
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_SCENARIOS = ["records_create", "records_get", "records_query", "records_update", "records_chat",
+                     "rag_query", "xray_analyze", "records_delete"]
+
+QUESTIONS = [
+    "Apa gejala utama tuberkulosis paru pada orang dewasa?",
+    "Kapan pemeriksaan GeneXpert direkomendasikan?",
+    "Bagaimana alur diagnosis TB pada anak?",
+    "Apa kriteria TB resisten obat?",
+    "Berapa lama pengobatan TB sensitif obat?",
+    "Apa yang harus dilakukan pada kontak serumah pasien TB?",
+    "Bagaimana interpretasi hasil BTA positif?",
+    "Apa faktor risiko TB pada pasien diabetes?",
+]
+SYMPTOMS = ["batuk berdahak 3 minggu", "demam dan keringat malam", "penurunan berat badan",
+            "sesak napas", "batuk darah", "nyeri dada", "tidak ada gejala"]
+SYNTHETIC_CHUNKS = [
+    "Tuberkulosis paru didiagnosis dengan pemeriksaan dahak mikroskopis, tes cepat molekuler dan foto toraks.",
+    "Tes cepat molekuler (GeneXpert) direkomendasikan sebagai tes diagnosis awal untuk semua terduga TB.",
+    "Pengobatan TB sensitif obat terdiri dari fase intensif 2 bulan dan fase lanjutan 4 bulan.",
+    "Kontak serumah pasien TB harus diskrining gejala dan diberikan terapi pencegahan bila memenuhi syarat.",
+    "TB resisten obat ditegakkan bila terdapat resistansi terhadap rifampisin atau isoniazid.",
+    "Gejala TB meliputi batuk lebih dari dua minggu, demam, keringat malam dan penurunan berat badan.",
+]
+
+# --- Fake Gemini ------------------------------------------------------------
+
+class FakeGemini:
+    """Answers generateContent calls with a fixed text after a configurable delay"""
+
+    def __init__(self, latency_ms: float, jitter_ms: float, error_rate: float):
+        fake = self
+        self.calls = 0
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with fake._lock:
+                    fake.calls += 1
+                time.sleep(max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000)
+                if random.random() < error_rate:
+                    self._reply(503, {"error": {"code": 503, "message": "overloaded", "status": "UNAVAILABLE"}})
+                    return
+                self._reply(200, {
+                    "candidates": [{
+                        "content": {"role": "model", "parts": [{"text": "**Penilaian** Jawaban uji beban. "
+                                                                        "Konfirmasi dengan GeneXpert. Bukan diagnosis."}]},
+                        "finishReason": "STOP",
+                    }],
+                    "usageMetadata": {"promptTokenCount": 1, "candidatesTokenCount": 1, "totalTokenCount": 2},
+                })
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, name="fake-gemini", daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+
+# --- Workspace and server ---------------------------------------------------
+
+def build_synthetic_index(data_dir: str, copies: int = 50):
+    """A small FAISS index over synthetic guideline chunks, as ingest_pdfs would write it"""
+    import faiss
+    from sentence_transformers import SentenceTransformer
+    sys.path.insert(0, BACKEND_DIR)
+    from app.rag.store import ChunkStore
+
+    texts = [f"{text} (bagian {i})" for i in range(copies) for text in SYNTHETIC_CHUNKS]
+    embeddings = SentenceTransformer("all-MiniLM-L6-v2").encode(texts)
+    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index.add(embeddings)
+    faiss.write_index(index, os.path.join(data_dir, "faiss.index"))
+    chunks = [{"doc": "synthetic.pdf", "page": i + 1, "text": text} for i, text in enumerate(texts)]
+    ChunkStore.from_chunks(chunks).save(os.path.join(data_dir, "chunks.npz"))
+
+def prepare_workspace() -> str:
+    workspace = tempfile.mkdtemp(prefix="tbnow-load-")
+    data_dir = os.path.join(workspace, "data")
+    os.makedirs(data_dir)
+    os.makedirs(os.path.join(workspace, "static"))
+    source = os.path.join(BACKEND_DIR, "data")
+    chunk_files = [name for name in ("chunks.npz", "chunks.pkl") if os.path.exists(os.path.join(source, name))]
+    if os.path.exists(os.path.join(source, "faiss.index")) and chunk_files:
+        for name in ("faiss.index", chunk_files[0]):
+            shutil.copy(os.path.join(source, name), data_dir)
+        print("RAG index: copied from data/")
+    else:
+        build_synthetic_index(data_dir)
+        print("RAG index: synthetic (data/faiss.index not found)")
+    return workspace
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(workspace: str, llm_url: str, workers: int, timeout: float, rate_limits: bool = False):
+    port = free_port()
+    env = {
+        **os.environ,
+        "PYTHONPATH": BACKEND_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""),
+        "GEMINI_API_KEY": "load-test",
+        "GEMINI_BASE_URL": llm_url,
+        "XRAY_MODEL_REGISTRY": os.path.abspath(os.environ.get("XRAY_MODEL_REGISTRY",
+                                                              os.path.join(BACKEND_DIR, "data", "models"))),
+        "XRAY_MODEL_POLL_SECONDS": "0",
+        # Every load thread is the same client, which the per-client limits would throttle
+        "TBNOW_RATE_LIMITING": "1" if rate_limits else "0",
+    }
+    log = open(os.path.join(workspace, "server.log"), "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=workspace, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            status, _ = Client(url).request("GET", "/records/cache/stats")
+            if status == 200:
+                return process, url
+        except OSError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    with open(log.name) as f:
+        print(f.read()[-3000:])
+    raise SystemExit(f"Server did not become ready within {timeout:g}s")
+
+# --- HTTP client ------------------------------------------------------------
+
+class Client:
+    """One keep-alive connection per load thread"""
+
+    def __init__(self, url: str, timeout: float = 120):
+        parsed = urlparse(url)
+        self.host, self.port, self.timeout = parsed.hostname, parsed.port or 80, timeout
+        self.conn = None
+
+    def request(self, method: str, path: str, body: bytes = None, headers: dict = None):
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body=body, headers=headers or {})
+                response = self.conn.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, ConnectionError):
+                # Server closed an idle keep-alive connection; retry once on a new one
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+    def json(self, method: str, path: str, payload=None):
+        body = json.dumps(payload).encode() if payload is not None else None
+        status, data = self.request(method, path, body, {"Content-Type": "application/json"} if body else None)
+        return status, (json.loads(data) if data and status < 500 else None)
+
+    def upload(self, path: str, filename: str, data: bytes):
+        boundary = uuid.uuid4().hex
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                f'Content-Type: image/jpeg\r\n\r\n').encode() + data + f"\r\n--{boundary}--\r\n".encode()
+        return self.request("POST", path, body, {"Content-Type": f"multipart/form-data; boundary={boundary}"})
+
+# --- Scenarios --------------------------------------------------------------
+
+def load_images(data_dir: str, limit: int, synthetic_size: int):
+    paths = []
+    for root, _, files in os.walk(data_dir):
+        paths += [os.path.join(root, f) for f in files if f.lower().endswith((".jpg", ".jpeg", ".png"))]
+    if paths:
+        paths = sorted(paths)[:limit]
+        return [open(path, "rb").read() for path in paths], f"{len(paths)} images from {data_dir}"
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(min(limit, 8)):
+        small = rng.integers(0, 255, (24, 24), dtype=np.uint8)
+        image = Image.fromarray(small).resize((synthetic_size, synthetic_size), Image.BICUBIC).convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images, f"{len(images)} synthetic {synthetic_size}px JPEGs"
+
+def synthetic_record(rng: random.Random) -> dict:
+    return {
+        "patientInfo": {
+            "name": f"Pasien Uji {rng.randint(1, 10**6)}",
+            "age": str(rng.randint(5, 85)),
+            "gender": rng.choice(["Laki-laki", "Perempuan"]),
+            "symptoms": rng.choice(SYMPTOMS),
+            "duration": f"{rng.randint(1, 12)} minggu",
+        },
+        "assessment": rng.choice(["Risiko tinggi TB", "Risiko rendah", "Perlu konfirmasi"]),
+        "xrayResult": {"risk_level": rng.choice(["High", "Medium", "Low"]), "confidence": round(rng.random(), 2)},
+    }
+
+class Context:
+    """State shared by the load threads: seeded record ids, records created for deletion, uploads"""
+
+    def __init__(self, images):
+        self.images = images
+        self.record_ids = []
+        self.created = []
+        self.lock = threading.Lock()
+
+    def record_id(self, i: int) -> str:
+        return self.record_ids[i % len(self.record_ids)]
+
+def records_create(client, ctx, i, rng):
+    status, body = client.json("POST", "/records", synthetic_record(rng))
+    if status == 200:
+        with ctx.lock:
+            ctx.created.append(body["record"]["id"])
+    return status
+
+def records_get(client, ctx, i, rng):
+    return client.request("GET", f"/records/{ctx.record_id(i)}")[0]
+
+def records_query(client, ctx, i, rng):
+    risk = ["High", "Medium", "Low"][i % 3]
+    return client.request("GET", f"/records/query?risk_level={risk}&limit=50")[0]
+
+def records_update(client, ctx, i, rng):
+    status = rng.choice(["follow-up", "normal", "treatment", "completed"])
+    return client.json("PUT", f"/records/{ctx.record_id(i)}", {"status": status})[0]
+
+def records_chat(client, ctx, i, rng):
+    payload = {"question": QUESTIONS[i % len(QUESTIONS)], "query_type": "quick"}
+    return client.json("POST", f"/records/{ctx.record_id(i)}/chat", payload)[0]
+
+def rag_query(client, ctx, i, rng):
+    payload = {"question": QUESTIONS[i % len(QUESTIONS)], "query_type": ("quick", "diagnosis")[i % 2]}
+    return client.json("POST", "/rag/query", payload)[0]
+
+def xray_analyze(client, ctx, i, rng):
+    return client.upload("/xray/analyze", "xray.jpg", ctx.images[i % len(ctx.images)])[0]
+
+def xray_analyze_cam(client, ctx, i, rng):
+    return client.upload("/xray/analyze?heatmap=cam", "xray.jpg", ctx.images[i % len(ctx.images)])[0]
+
+def records_delete(client, ctx, i, rng):
+    with ctx.lock:
+        record_id = ctx.created.pop() if ctx.created else None
+    if record_id is None:
+        return None  # nothing left that this run created; not counted
+    return client.request("DELETE", f"/records/{record_id}")[0]
+
+SCENARIOS = {fn.__name__: fn for fn in (records_create, records_get, records_query, records_update, records_chat,
+                                         rag_query, xray_analyze, xray_analyze_cam, records_delete)}
+
+# --- Runner -----------------------------------------------------------------
+
+def summarize(latencies, statuses, elapsed: float, concurrency: int) -> dict:
+    ok = [ms for ms, status in zip(latencies, statuses) if status is not None and status < 400]
+    errors = sum(1 for status in statuses if status is None or status >= 400)
+    summary = {
+        "requests": len(latencies),
+        "errors": errors,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "status_counts": {str(s): statuses.count(s) for s in sorted(set(statuses), key=str)},
+    }
+    if ok:
+        p50, p95, p99 = np.percentile(ok, [50, 95, 99])
+        summary.update(p50_ms=round(p50, 2), p95_ms=round(p95, 2), p99_ms=round(p99, 2),
+                       mean_ms=round(float(np.mean(ok)), 2), max_ms=round(max(ok), 2))
+    return summary
+
+def run_scenario(name: str, url: str, ctx: Context, concurrency: int, requests: int, duration: float,
+                 warmup: int, seed: int) -> dict:
+    fn = SCENARIOS[name]
+    warm = Client(url)
+    for i in range(warmup):
+        fn(warm, ctx, i, random.Random(seed + i))
+
+    counter = iter(range(10**9))
+    counter_lock = threading.Lock()
+    latencies, statuses = [], []
+    results_lock = threading.Lock()
+    deadline = time.perf_counter() + duration if duration else None
+
+    def worker(thread_index):
+        client = Client(url)
+        rng = random.Random(seed * 1000 + thread_index)
+        while True:
+            with counter_lock:
+                i = next(counter)
+            if (deadline is None and i >= requests) or (deadline is not None and time.perf_counter() >= deadline):
+                return
+            start = time.perf_counter()
+            try:
+                status = fn(client, ctx, i, rng)
+            except Exception:
+                status = 0
+            if status is None:
+                continue
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with results_lock:
+                latencies.append(elapsed_ms)
+                statuses.append(status or None)
+
+    threads = [threading.Thread(target=worker, args=(t,), daemon=True) for t in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, statuses, time.perf_counter() - start, concurrency)
+
+def seed_records(url: str, ctx: Context, count: int):
+    client, rng = Client(url), random.Random(0)
+    for _ in range(count):
+        status, body = client.json("POST", "/records", synthetic_record(rng))
+        if status != 200:
+            raise SystemExit(f"Seeding records failed with HTTP {status}")
+        ctx.record_ids.append(body["record"]["id"])
+
+def server_stage_means(url: str) -> dict:
+    """Mean ms per tbnow_stage_seconds stage from /metrics (one worker's view with --workers > 1)"""
+    status, body = Client(url).request("GET", "/metrics")
+    if status != 200:
+        return {}
+    sums, counts = {}, {}
+    for match in re.finditer(r'^tbnow_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$', body.decode(), re.M):
+        kind, stage, value = match.groups()
+        (sums if kind == "sum" else counts)[stage] = float(value)
+    return {stage: {"count": int(counts[stage]), "mean_ms": round(sums[stage] / counts[stage] * 1000, 3)}
+            for stage in sorted(counts) if counts[stage]}
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BACKEND_DIR,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def print_report(report: dict):
+    print(f"\n{'scenario':18s} {'reqs':>6s} {'err':>4s} {'rps':>8s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    for name, r in report["scenarios"].items():
+        print(f"{name:18s} {r['requests']:6d} {r['errors']:4d} {r['throughput_rps']:8.2f} "
+              f"{r.get('p50_ms', float('nan')):9.1f} {r.get('p95_ms', float('nan')):9.1f} "
+              f"{r.get('p99_ms', float('nan')):9.1f}")
+    if report.get("server_stages"):
+        print("\nServer-side stage means: " + ", ".join(
+            f"{stage} {s['mean_ms']:.1f}ms" for stage, s in report["server_stages"].items()))
+
+def compare(before_path: str, after_path: str):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{(before['meta'].get('commit') or '?')[:10]} -> {(after['meta'].get('commit') or '?')[:10]}\n")
+    print(f"{'scenario':18s} {'metric':>14s} {'before':>10s} {'after':>10s} {'change':>8s}")
+    for name, new in after["scenarios"].items():
+        old = before["scenarios"].get(name)
+        if old is None:
+            continue
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            if metric in old and metric in new and old[metric]:
+                change = (new[metric] - old[metric]) / old[metric] * 100
+                print(f"{name:18s} {metric:>14s} {old[metric]:10.2f} {new[metric]:10.2f} {change:+7.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(DEFAULT_SCENARIOS),
+                        help=f"Comma-separated, run in order; available: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=100, help="Per scenario (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="Seconds per scenario instead of --requests")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed requests per scenario")
+    parser.add_argument("--seed-records", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--llm-latency-ms", type=float, default=800, help="Fake Gemini response time")
+    parser.add_argument("--llm-jitter-ms", type=float, default=200)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Fraction of fake Gemini 503s")
+    parser.add_argument("--image-dir", default="data/xray/test")
+    parser.add_argument("--image-limit", type=int, default=32)
+    parser.add_argument("--synthetic-size", type=int, default=2048)
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--rate-limits", action="store_true",
+                        help="Keep the server's rate limits and concurrency caps on (off by default)")
+    parser.add_argument("--url", help="Load an already running server instead (no fake LLM or workspace)")
+    parser.add_argument("--keep-workspace", action="store_true")
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout only)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two JSON reports")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+
+    images, image_description = load_images(os.path.join(BACKEND_DIR, args.image_dir), args.image_limit,
+                                            args.synthetic_size)
+    print(f"Uploads: {image_description}")
+
+    fake_llm = process = workspace = None
+    try:
+        if args.url:
+            url = args.url.rstrip("/")
+        else:
+            fake_llm = FakeGemini(args.llm_latency_ms, args.llm_jitter_ms, args.llm_error_rate)
+            workspace = prepare_workspace()
+            print(f"Starting server in {workspace} ({args.workers} worker(s))...")
+            process, url = start_server(workspace, fake_llm.url, args.workers, args.startup_timeout,
+                                        args.rate_limits)
+
+        ctx = Context(images)
+        seed_records(url, ctx, args.seed_records)
+        print(f"Seeded {args.seed_records} records; running {', '.join(scenarios)} at concurrency {args.concurrency}")
+
+        results = {}
+        for index, name in enumerate(scenarios):
+            results[name] = run_scenario(name, url, ctx, args.concurrency, args.requests, args.duration,
+                                         args.warmup, seed=index)
+            r = results[name]
+            print(f"  {name}: {r['throughput_rps']} req/s, p50 {r.get('p50_ms')}ms, p99 {r.get('p99_ms')}ms, "
+                  f"{r['errors']} errors")
+
+        commit, dirty = git_commit()
+        report = {
+            "meta": {
+                "timestamp": datetime.now().isoformat(),
+                "commit": commit,
+                "dirty": dirty,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "url": args.url,
+                "workers": None if args.url else args.workers,
+                "llm_latency_ms": None if args.url else args.llm_latency_ms,
+                "llm_calls": fake_llm.calls if fake_llm else None,
+                "uploads": image_description,
+                "args": vars(args),
+            },
+            "scenarios": results,
+            "server_stages": server_stage_means(url),
+        }
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        if fake_llm is not None:
+            fake_llm.close()
+        if workspace and not args.keep_workspace:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+    else:
+        print(json.dumps(report["scenarios"], indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Throughput and parity benchmark for the ResNet18 X-ray model across
+precision (fp32 / bf16 autocast), channels_last and torch.compile.
+
+Every combination is run over the same test-set batch; images/sec is reported
+next to agreement with the fp32 eager baseline (prediction match rate and max
+absolute difference in TB probability).
+
+Usage (from tbnow-back/):
+    python benchmarks/precision_bench.py --limit 128 --batch-size 16
+    python benchmarks/precision_bench.py --mode train   # forward+backward steps
+"""
+
+import argparse
+import itertools
+import os
+import sys
+import time
+from contextlib import nullcontext
+
+import torch
+import torch.nn as nn
+import torchvision.models as models
+from PIL import Image
+from torchvision import datasets
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.xray.preprocessing import batch_buffer, load_gray, normalize_into
+
+MODEL_PATH = "app/xray/model_tb.pth"
+
+def load_state_dict(path):
+    if not os.path.exists(path):
+        print(f"⚠️  {path} not found, benchmarking an untrained model")
+        return None
+    checkpoint = torch.load(path, map_location="cpu")
+    if isinstance(checkpoint, dict) and 'model_state_dict' in checkpoint:
+        return checkpoint['model_state_dict']
+    return checkpoint
+
+def build_model(state_dict):
+    model = models.resnet18(weights=None)
+    if state_dict is not None and 'fc.1.weight' in state_dict:
+        # Checkpoint from train_tb_model.py (Dropout + Linear head)
+        model.fc = nn.Sequential(nn.Dropout(0.5), nn.Linear(model.fc.in_features, 2))
+    else:
+        model.fc = nn.Linear(model.fc.in_features, 2)
+    if state_dict is not None:
+        model.load_state_dict(state_dict)
+    return model
+
+def load_images(data_dir, limit):
+    dataset = datasets.ImageFolder(data_dir)  # lists files only
+    samples = dataset.samples[:limit]
+    images = batch_buffer(len(samples))
+    for i, (path, _) in enumerate(samples):
+        with Image.open(path) as image:
+            normalize_into(images[i], load_gray(image))
+    labels = torch.tensor([label for _, label in samples])
+    return images, labels
+
+def run(model, images, batch_size, precision, channels_last, mode, repeats):
+    autocast = (torch.autocast(device_type="cpu", dtype=torch.bfloat16)
+                if precision == "bf16" else nullcontext())
+    batches = list(images.split(batch_size))
+    if channels_last:
+        batches = [b.contiguous(memory_format=torch.channels_last) for b in batches]
+
+    def one_pass():
+        outputs = []
+        for batch in batches:
+            if mode == "train":
+                with autocast:
+                    logits = model(batch)
+                logits.float().sum().backward()
+            else:
+                with torch.inference_mode(), autocast:
+                    logits = model(batch)
+            outputs.append(torch.softmax(logits.detach().float(), dim=1)[:, 1])
+        return torch.cat(outputs)
+
+    one_pass()  # warmup (and compilation, if enabled)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        probs = one_pass()
+    elapsed = time.perf_counter() - start
+    return probs, len(images) * repeats / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default="data/xray/test")
+    parser.add_argument("--model-path", default=MODEL_PATH)
+    parser.add_argument("--limit", type=int, default=128, help="Number of test images")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--mode", choices=["infer", "train"], default="infer")
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    state_dict = load_state_dict(args.model_path)
+    images, labels = load_images(args.data_dir, args.limit)
+    print(f"{len(images)} images, batch {args.batch_size}, mode {args.mode}, {torch.get_num_threads()} threads\n")
+
+    baseline = None
+    print(f"{'precision':10s} {'chan_last':10s} {'compile':8s} {'img/s':>8s} {'speedup':>8s} {'agree':>7s} {'max|Δp|':>8s}")
+    for precision, channels_last, compile_model in itertools.product(["fp32", "bf16"], [False, True], [False, True]):
+        model = build_model(state_dict)
+        # eval() even in train mode: dropout/BN updates would make parity meaningless,
+        # and the backward pass cost is what's being measured
+        model.eval()
+        if channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        if compile_model:
+            try:
+                model = torch.compile(model)
+            except Exception as e:
+                print(f"{precision:10s} {str(channels_last):10s} {'True':8s} skipped: {e}")
+                continue
+
+        torch.manual_seed(0)
+        probs, throughput = run(model, images, args.batch_size, precision, channels_last, args.mode, args.repeats)
+        if baseline is None:
+            baseline = (probs, throughput)
+        agree = ((probs > 0.5) == (baseline[0] > 0.5)).float().mean().item()
+        max_diff = (probs - baseline[0]).abs().max().item()
+        print(f"{precision:10s} {str(channels_last):10s} {str(compile_model):8s} "
+              f"{throughput:8.1f} {throughput / baseline[1]:7.2f}x {agree:7.1%} {max_diff:8.4f}")
+
+    accuracy = ((baseline[0] > 0.5).long() == labels).float().mean().item()
+    print(f"\nfp32 eager test accuracy on these {len(images)} images: {accuracy:.4f}")
+
+if __name__ == "__main__":
+    main()
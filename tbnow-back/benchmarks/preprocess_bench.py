@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Per-image X-ray preprocessing cost: the previous torchvision pipeline
+(Resize on the decoded image, Grayscale(3), ToTensor, Normalize) against the
+shared grayscale path (draft-mode decode to L, one resize, broadcast
+normalize into a preallocated batch tensor).
+
+Both start from the encoded bytes, like an upload. Uses the test set if
+present, otherwise a synthetic JPEG.
+
+Usage (from tbnow-back/):
+    python benchmarks/preprocess_bench.py --limit 64 --repeats 5
+    python benchmarks/preprocess_bench.py --synthetic-size 3000
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+import torch
+import torchvision.transforms as T
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.xray.preprocessing import batch_buffer, load_gray, normalize_into
+
+legacy_transform = T.Compose([
+    T.Resize((224, 224)),
+    T.Grayscale(3),
+    T.ToTensor(),
+    T.Normalize([0.485,0.456,0.406], [0.229,0.224,0.225])
+])
+
+def load_inputs(data_dir, limit, synthetic_size):
+    paths = []
+    for root, _, files in os.walk(data_dir):
+        paths += [os.path.join(root, f) for f in sorted(files) if f.lower().endswith((".jpg", ".jpeg", ".png"))]
+    if paths:
+        return [open(path, "rb").read() for path in sorted(paths)[:limit]], f"{min(limit, len(paths))} images from {data_dir}"
+    rng = np.random.default_rng(0)
+    small = rng.integers(0, 255, (32, 32), dtype=np.uint8)
+    image = cv2.cvtColor(cv2.resize(small, (synthetic_size, synthetic_size), interpolation=cv2.INTER_CUBIC),
+                         cv2.COLOR_GRAY2BGR)
+    ok, buffer = cv2.imencode(".jpg", image)
+    return [buffer.tobytes()] * limit, f"{limit} synthetic {synthetic_size}px RGB JPEGs"
+
+def legacy(data, out, i):
+    with Image.open(io.BytesIO(data)) as image:
+        out[i] = legacy_transform(image)
+
+def shared(data, out, i):
+    with Image.open(io.BytesIO(data)) as image:
+        normalize_into(out[i], load_gray(image))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default="data/xray/test")
+    parser.add_argument("--limit", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--synthetic-size", type=int, default=2048)
+    parser.add_argument("--threads", type=int, default=1, help="torch.set_num_threads")
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    inputs, description = load_inputs(args.data_dir, args.limit, args.synthetic_size)
+    out = batch_buffer(len(inputs))
+    print(f"{description}, {args.repeats} repeats, {torch.get_num_threads()} threads\n")
+
+    results = {}
+    for name, fn in (("torchvision Grayscale(3)", legacy), ("shared grayscale", shared)):
+        per_image = []
+        for repeat in range(args.repeats + 1):
+            start = time.perf_counter()
+            for i, data in enumerate(inputs):
+                fn(data, out, i)
+            if repeat:  # first pass is warmup
+                per_image.append((time.perf_counter() - start) * 1000 / len(inputs))
+        results[name] = (statistics.median(per_image), out.clone())
+
+    baseline = next(iter(results.values()))
+    print(f"{'pipeline':26s} {'ms/image':>9s} {'speedup':>8s} {'max|Δ| vs legacy':>17s}")
+    for name, (ms, tensor) in results.items():
+        print(f"{name:26s} {ms:9.3f} {baseline[0] / ms:7.2f}x {(tensor - baseline[1]).abs().max().item():17.4f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Retrieval quality and latency benchmark for the RAG index, offline (no Gemini).
+
+The questions in benchmarks/rag_eval_set.json are labelled with the guideline
+pages that answer them. For every chunking strategy (app/rag/chunking.py) and
+index type, the chunks of data/guidelines are embedded with the serving model
+and indexed; each question is formatted the way rag_answer formats it, embedded
+one at a time and searched. Per configuration it reports
+
+    recall@k   share of a question's labelled pages covered by the top k, averaged
+    hit@k      share of questions with at least one relevant chunk in the top k
+    MRR        mean reciprocal rank of the first relevant chunk (0 past the largest k)
+    latency    search and encode+search p50/p95 per question in ms
+
+Served configuration (the reference): page chunks, IndexFlatL2, top 5.
+Index types: flat_l2, flat_ip (cosine on normalized embeddings), hnsw, ivf.
+
+Run it as a gate before switching index types or chunking strategies:
+--candidate fails (exit 1) when a configuration's recall@top-k or MRR is more
+than --tolerance below the reference, --baseline when any configuration lost
+that much against an earlier --output report (e.g. after changing ingest).
+
+Usage (from tbnow-back/):
+    python benchmarks/rag_retrieval_bench.py --output rag-$(git rev-parse --short HEAD).json
+    python benchmarks/rag_retrieval_bench.py --chunking window --window-size 800 --index flat_l2,hnsw
+    python benchmarks/rag_retrieval_bench.py --candidate window/flat_ip
+    python benchmarks/rag_retrieval_bench.py --baseline rag-abc123.json
+"""
+
+import argparse
+import functools
+import hashlib
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import time
+
+import faiss
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.rag.chunking import CHUNKERS, extract_pages, window_chunks
+from app.rag.prompt import format_question
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+EVAL_SET = os.path.join(os.path.dirname(__file__), "rag_eval_set.json")
+REFERENCE = "page/flat_l2"
+CACHE_DIR = "data/cache/rag_bench"
+
+def _normalized(text: str) -> str:
+    # pypdf output has irregular runs of spaces and line breaks
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+# Index builders: embeddings -> (index, whether vectors are L2-normalized first)
+
+def build_flat_l2(embeddings, args):
+    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index.add(embeddings)
+    return index, False
+
+def build_flat_ip(embeddings, args):
+    index = faiss.IndexFlatIP(embeddings.shape[1])
+    index.add(normalize(embeddings))
+    return index, True
+
+def build_hnsw(embeddings, args):
+    index = faiss.IndexHNSWFlat(embeddings.shape[1], args.hnsw_m)
+    index.hnsw.efSearch = args.hnsw_ef_search
+    index.add(embeddings)
+    return index, False
+
+def build_ivf(embeddings, args):
+    nlist = max(1, int(math.sqrt(len(embeddings))))
+    quantizer = faiss.IndexFlatL2(embeddings.shape[1])
+    index = faiss.IndexIVFFlat(quantizer, embeddings.shape[1], nlist)
+    index.train(embeddings)
+    index.add(embeddings)
+    index.nprobe = min(args.ivf_nprobe, nlist)
+    return index, False
+
+INDEXES = {
+    "flat_l2": build_flat_l2,
+    "flat_ip": build_flat_ip,
+    "hnsw": build_hnsw,
+    "ivf": build_ivf,
+}
+
+def normalize(vectors):
+    vectors = np.array(vectors, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def load_eval_set(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        questions = json.load(f)["questions"]
+    for question in questions:
+        question.setdefault("query_type", "quick")
+        question["targets"] = {(r["doc"], page) for r in question["relevant"] for page in r["pages"]}
+    return questions
+
+def relevant_pages(question: dict, chunk: dict) -> set:
+    """Labelled (doc, page) targets of the question this chunk supports"""
+    text = None
+    pages = set()
+    for r in question["relevant"]:
+        if chunk["doc"] != r["doc"] or chunk["page"] not in r["pages"]:
+            continue
+        if r.get("evidence"):
+            text = text if text is not None else _normalized(chunk["text"])
+            if not any(_normalized(phrase) in text for phrase in r["evidence"]):
+                continue
+        pages.add((chunk["doc"], chunk["page"]))
+    return pages
+
+def embed_chunks(model, model_name: str, strategy: str, chunks: list, batch_size: int):
+    """Chunk embeddings, cached per model and chunk texts"""
+    digest = hashlib.sha1(model_name.encode())
+    for chunk in chunks:
+        digest.update(chunk["text"].encode("utf-8", "replace") + b"\0")
+    path = os.path.join(CACHE_DIR, f"{strategy}-{digest.hexdigest()[:16]}.npy")
+    if os.path.exists(path):
+        return np.load(path), 0.0
+    start = time.perf_counter()
+    embeddings = np.asarray(model.encode([chunk["text"] for chunk in chunks], batch_size=batch_size),
+                            dtype=np.float32)
+    elapsed = time.perf_counter() - start
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    np.save(path, embeddings)
+    return embeddings, elapsed
+
+def encode_questions(model, questions: list):
+    """One encode call per question, like rag_answer; returns (embeddings, ms per question)"""
+    model.encode([format_question("warmup")])
+    embeddings, latencies = [], []
+    for question in questions:
+        text = format_question(question["question"], question["query_type"])
+        start = time.perf_counter()
+        embedding = model.encode([text])
+        latencies.append((time.perf_counter() - start) * 1000)
+        embeddings.append(np.asarray(embedding, dtype=np.float32)[0])
+    return np.stack(embeddings), np.array(latencies)
+
+def percentiles(values) -> dict:
+    return {"p50": round(float(np.percentile(values, 50)), 3), "p95": round(float(np.percentile(values, 95)), 3)}
+
+def evaluate(index, normalized: bool, chunks: list, questions: list, query_embeddings, encode_ms,
+             ks: list, top_k: int, repeat: int) -> dict:
+    queries = normalize(query_embeddings) if normalized else query_embeddings
+    max_k = min(max(ks), index.ntotal)
+    recall = {k: [] for k in ks}
+    hits = {k: [] for k in ks}
+    reciprocal_ranks, misses, search_ms = [], [], []
+    for i, question in enumerate(questions):
+        query = queries[i:i + 1]
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            index.search(query, top_k)
+            timings.append((time.perf_counter() - start) * 1000)
+        search_ms.append(float(np.median(timings)))
+
+        _, ids = index.search(query, max_k)
+        found = [relevant_pages(question, chunks[j]) if j >= 0 else set() for j in ids[0]]
+        first = next((rank for rank, pages in enumerate(found, start=1) if pages), None)
+        reciprocal_ranks.append(1.0 / first if first else 0.0)
+        for k in ks:
+            covered = set().union(*found[:k])
+            recall[k].append(len(covered) / len(question["targets"]))
+            hits[k].append(1.0 if covered else 0.0)
+        if first is None or first > top_k:
+            misses.append(question["id"])
+
+    search_ms = np.array(search_ms)
+    result = {f"recall@{k}": round(float(np.mean(recall[k])), 4) for k in ks}
+    result.update({f"hit@{k}": round(float(np.mean(hits[k])), 4) for k in ks})
+    result["mrr"] = round(float(np.mean(reciprocal_ranks)), 4)
+    result["search_ms"] = percentiles(search_ms)
+    result["encode_search_ms"] = percentiles(encode_ms + search_ms)
+    result[f"misses@{top_k}"] = misses
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_report(report: dict, ks: list):
+    top_k = report["meta"]["top_k"]
+    columns = [f"recall@{k}" for k in ks] + [f"hit@{top_k}", "mrr"]
+    print(f"\n{'config':18s} {'chunks':>6s} " + " ".join(f"{c:>9s}" for c in columns)
+          + f" {'search p50':>10s} {'enc+search p50/p95 ms':>22s}")
+    for name, r in report["configs"].items():
+        latency = r["encode_search_ms"]
+        print(f"{name:18s} {r['chunks']:6d} " + " ".join(f"{r[c]:9.3f}" for c in columns)
+              + f" {r['search_ms']['p50']:10.3f} {latency['p50']:10.1f} / {latency['p95']:9.1f}")
+
+def gate_failures(report: dict, candidates: list, baseline_path: str, tolerance: float) -> list:
+    top_k = report["meta"]["top_k"]
+    metrics = (f"recall@{top_k}", "mrr")
+    configs = report["configs"]
+    failures = []
+    for name in candidates:
+        for metric in metrics:
+            if configs[name][metric] < configs[REFERENCE][metric] - tolerance:
+                failures.append(f"{name} {metric} {configs[name][metric]:.3f} < "
+                                f"{REFERENCE} {configs[REFERENCE][metric]:.3f}")
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        for name, old in baseline["configs"].items():
+            new = configs.get(name)
+            if new is None:
+                continue
+            for metric in metrics:
+                if metric in old and new[metric] < old[metric] - tolerance:
+                    failures.append(f"{name} {metric} {new[metric]:.3f} < baseline {old[metric]:.3f} "
+                                    f"({(baseline['meta'].get('commit') or '?')[:10]})")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf-dir", default="data/guidelines")
+    parser.add_argument("--eval-set", default=EVAL_SET)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2", help="SentenceTransformer used to embed")
+    parser.add_argument("--chunking", default=",".join(CHUNKERS),
+                        help=f"Comma-separated; available: {', '.join(CHUNKERS)}")
+    parser.add_argument("--index", default=",".join(INDEXES),
+                        help=f"Comma-separated; available: {', '.join(INDEXES)}")
+    parser.add_argument("--top-k", type=int, default=5, help="Chunks rag_answer puts in the prompt")
+    parser.add_argument("--ks", default="1,3,5,10", help="Cut-offs for recall@k and hit@k")
+    parser.add_argument("--window-size", type=int, default=1000, help="Characters per window chunk")
+    parser.add_argument("--window-overlap", type=int, default=200)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--hnsw-ef-search", type=int, default=64)
+    parser.add_argument("--ivf-nprobe", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=5, help="Timed searches per question (median kept)")
+    parser.add_argument("--candidate", action="append", default=[], metavar="CHUNKING/INDEX",
+                        help=f"Fail if worse than {REFERENCE}; repeatable")
+    parser.add_argument("--baseline", help="Fail on regressions against this earlier --output report")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="Allowed drop in recall@top-k and MRR")
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    strategies = [name.strip() for name in args.chunking.split(",") if name.strip()]
+    index_types = [name.strip() for name in args.index.split(",") if name.strip()]
+    unknown = [name for name in strategies if name not in CHUNKERS] + \
+              [name for name in index_types if name not in INDEXES]
+    if unknown:
+        parser.error(f"Unknown chunking or index: {', '.join(unknown)}")
+    # The reference is always evaluated so every run can be compared against it
+    if "page" not in strategies:
+        strategies.insert(0, "page")
+    if "flat_l2" not in index_types:
+        index_types.insert(0, "flat_l2")
+    configs = [f"{s}/{i}" for s in strategies for i in index_types]
+    missing = [name for name in args.candidate if name not in configs]
+    if missing:
+        parser.error(f"Candidates not evaluated: {', '.join(missing)} (add them to --chunking / --index)")
+    ks = sorted({int(k) for k in args.ks.split(",")} | {args.top_k})
+
+    questions = load_eval_set(args.eval_set)
+    pages = extract_pages(args.pdf_dir)
+    print(f"{len(questions)} questions, {len(pages)} pages from {args.pdf_dir}")
+
+    model = SentenceTransformer(args.model)
+    query_embeddings, encode_ms = encode_questions(model, questions)
+    print(f"Question encode: p50 {np.percentile(encode_ms, 50):.1f} ms, p95 {np.percentile(encode_ms, 95):.1f} ms")
+
+    chunkers = dict(CHUNKERS, window=functools.partial(window_chunks, size=args.window_size,
+                                                       overlap=args.window_overlap))
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "model": args.model,
+            "top_k": args.top_k,
+            "questions": len(questions),
+            "reference": REFERENCE,
+            "window": {"size": args.window_size, "overlap": args.window_overlap},
+            "hnsw": {"m": args.hnsw_m, "ef_search": args.hnsw_ef_search},
+            "ivf_nprobe": args.ivf_nprobe,
+        },
+        "encode_ms": percentiles(encode_ms),
+        "configs": {},
+    }
+    for strategy in strategies:
+        chunks = chunkers[strategy](pages)
+        unanswerable = [q["id"] for q in questions if not any(relevant_pages(q, c) for c in chunks)]
+        if unanswerable:
+            print(f"⚠️  {strategy}: no chunk matches the labels of {', '.join(unanswerable)}")
+        embeddings, embed_seconds = embed_chunks(model, args.model, strategy, chunks, args.batch_size)
+        print(f"{strategy}: {len(chunks)} chunks" + (f", embedded in {embed_seconds:.1f}s" if embed_seconds else
+                                                     " (cached embeddings)"))
+        for index_type in index_types:
+            start = time.perf_counter()
+            index, normalized = INDEXES[index_type](embeddings, args)
+            build_seconds = time.perf_counter() - start
+            result = evaluate(index, normalized, chunks, questions, query_embeddings, encode_ms,
+                              ks, args.top_k, args.repeat)
+            report["configs"][f"{strategy}/{index_type}"] = {
+                "chunks": len(chunks), "build_s": round(build_seconds, 4), **result}
+
+    print_report(report, ks)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+    failures = gate_failures(report, args.candidate, args.baseline, args.tolerance)
+    if failures:
+        print("\n❌ Retrieval gate failed:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+    if args.candidate or args.baseline:
+        print("\n✅ Retrieval gate passed")
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,8 @@
+import argparse
+import time
+
 import numpy as np
+from app.xray.calibration import CALIBRATION_PATH, DEFAULT_CALIBRATION, save_calibration
 from sklearn.metrics import f1_score, precision_score, recall_score, classification_report
 
 def evaluate_model(y_true, y_pred, class_names=None):
@@ -16,11 +20,12 @@ def evaluate_model(y_true, y_pred, class_names=None):
     # Convert to numpy arrays
     y_true = np.array(y_true)
     y_pred = np.array(y_pred)
+    average = 'binary' if len(np.unique(y_true)) == 2 else 'macro'
 
     # Calculate metrics
-    f1 = f1_score(y_true, y_pred, average='binary' if len(np.unique(y_true)) == 2 else 'macro')
-    precision = precision_score(y_true, y_pred, average='binary' if len(np.unique(y_true)) == 2 else 'macro')
-    recall = recall_score(y_true, y_pred, average='binary' if len(np.unique(y_true)) == 2 else 'macro')
+    f1 = f1_score(y_true, y_pred, average=average)
+    precision = precision_score(y_true, y_pred, average=average)
+    recall = recall_score(y_true, y_pred, average=average)
 
     # Classification report
     report = classification_report(y_true, y_pred, target_names=class_names)
@@ -34,38 +39,211 @@ def evaluate_model(y_true, y_pred, class_names=None):
 
     return results
 
-def tune_for_precision(y_true, y_proba, thresholds=np.arange(0.1, 0.9, 0.1)):
+def _confusion_metrics(tp, fp, positives, negatives):
+    """Vectorized metrics from true/false positive counts at each threshold"""
+    tp = np.asarray(tp, dtype=np.float64)
+    fp = np.asarray(fp, dtype=np.float64)
+    fn = positives - tp
+    tn = negatives - fp
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 1.0)
+        recall = tp / positives if positives else np.zeros_like(tp)
+        specificity = tn / negatives if negatives else np.zeros_like(tp)
+        f1 = np.where(2 * tp + fp + fn > 0, 2 * tp / (2 * tp + fp + fn), 0.0)
+    return {
+        'tp': tp.astype(np.int64), 'fp': fp.astype(np.int64),
+        'fn': fn.astype(np.int64), 'tn': tn.astype(np.int64),
+        'precision': precision, 'recall': recall,
+        'specificity': specificity, 'f1_score': f1,
+        'fpr': 1.0 - specificity,
+    }
+
+def threshold_sweep(y_true, y_proba):
+    """
+    Metrics at every distinct predicted probability, in O(n log n).
+
+    Probabilities are sorted once (descending); cumulative sums of the labels
+    give the true/false positive counts when predicting positive for
+    y_proba >= threshold, read off at the last occurrence of each value.
+
+    Returns:
+        dict of arrays ordered by decreasing threshold: 'threshold', 'tp',
+        'fp', 'fn', 'tn', 'precision', 'recall', 'specificity', 'f1_score', 'fpr'
+    """
+    y_true = np.asarray(y_true).astype(bool)
+    y_proba = np.asarray(y_proba, dtype=np.float64)
+    order = np.argsort(-y_proba, kind='mergesort')
+    proba_sorted = y_proba[order]
+    tp_cumulative = np.cumsum(y_true[order])
+    fp_cumulative = np.arange(1, len(y_proba) + 1) - tp_cumulative
+
+    # Last index of each run of equal probabilities
+    last = np.r_[np.flatnonzero(np.diff(proba_sorted)), len(y_proba) - 1]
+    positives = int(tp_cumulative[-1]) if len(y_proba) else 0
+    negatives = len(y_proba) - positives
+
+    sweep = _confusion_metrics(tp_cumulative[last], fp_cumulative[last], positives, negatives)
+    sweep['threshold'] = proba_sorted[last]
+    return sweep
+
+def metrics_at(y_true, y_proba, thresholds):
+    """Same metrics as threshold_sweep at arbitrary thresholds (y_proba >= threshold), via binary search"""
+    y_true = np.asarray(y_true).astype(bool)
+    y_proba = np.asarray(y_proba, dtype=np.float64)
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype=np.float64))
+    positive_scores = np.sort(y_proba[y_true])
+    negative_scores = np.sort(y_proba[~y_true])
+    tp = len(positive_scores) - np.searchsorted(positive_scores, thresholds, side='left')
+    fp = len(negative_scores) - np.searchsorted(negative_scores, thresholds, side='left')
+    metrics = _confusion_metrics(tp, fp, len(positive_scores), len(negative_scores))
+    metrics['threshold'] = thresholds
+    return metrics
+
+def tune_for_precision(y_true, y_proba, thresholds=None, min_recall=0.0):
     """
     Tune decision threshold to maximize precision (reduce false positives).
 
     Args:
         y_true: Ground truth labels
         y_proba: Predicted probabilities for positive class
-        thresholds: Array of thresholds to test
+        thresholds: Thresholds to test (default: every distinct probability)
+        min_recall: Only consider thresholds that keep at least this recall
 
     Returns:
         dict: Best threshold and corresponding metrics
     """
-    best_precision = 0
-    best_thresh = 0.5
-    best_metrics = {}
-
-    for thresh in thresholds:
-        y_pred = (y_proba > thresh).astype(int)
-        precision = precision_score(y_true, y_pred)
-        if precision > best_precision:
-            best_precision = precision
-            best_thresh = thresh
-            best_metrics = evaluate_model(y_true, y_pred)
+    if thresholds is None:
+        metrics = threshold_sweep(y_true, y_proba)
+    else:
+        metrics = metrics_at(y_true, y_proba, thresholds)
+
+    candidates = np.flatnonzero(metrics['recall'] >= min_recall)
+    if len(candidates) == 0:
+        candidates = np.arange(len(metrics['threshold']))
+    # Highest precision; among ties, the lowest threshold (most recall)
+    precision = metrics['precision'][candidates]
+    tied = candidates[precision == precision.max()]
+    best = tied[np.argmin(metrics['threshold'][tied])]
 
     return {
-        'best_threshold': best_thresh,
-        'best_precision': best_precision,
-        'metrics': best_metrics
+        'best_threshold': float(metrics['threshold'][best]),
+        'best_precision': float(metrics['precision'][best]),
+        'metrics': {name: values[best].item() for name, values in metrics.items()}
     }
 
-# Example usage
-if __name__ == "__main__":
+def lowest_threshold_for_precision(sweep, target_precision):
+    """The lowest threshold whose precision reaches the target (maximum recall), or None"""
+    reaching = np.flatnonzero(sweep['precision'] >= target_precision)
+    if len(reaching) == 0:
+        return None
+    return float(sweep['threshold'][reaching[-1]])
+
+def roc_pr_curves(y_true, y_proba):
+    """
+    ROC and precision-recall curves from a single sweep, with ROC AUC and
+    average precision. Returns (sweep, roc_auc, average_precision).
+    """
+    sweep = threshold_sweep(y_true, y_proba)
+    tpr = np.r_[0.0, sweep['recall']]
+    fpr = np.r_[0.0, sweep['fpr']]
+    roc_auc = float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+    average_precision = float(np.sum(np.diff(tpr) * sweep['precision']))
+    return sweep, roc_auc, average_precision
+
+def export_curves(path, sweep):
+    """Write a sweep as CSV (one row per threshold) for plotting ROC/PR curves"""
+    columns = ['threshold', 'tp', 'fp', 'fn', 'tn', 'precision', 'recall', 'specificity', 'fpr', 'f1_score']
+    np.savetxt(path, np.column_stack([sweep[c] for c in columns]), delimiter=',',
+               header=','.join(columns), comments='', fmt='%.6g')
+    return path
+
+def softmax_tb_probability(logits, temperature=1.0):
+    """P(TB) from 2-class logits: softmax(logits / T)[:, 1] == sigmoid((l1 - l0) / T)"""
+    logits = np.asarray(logits, dtype=np.float64)
+    margin = (logits[:, 1] - logits[:, 0]) / temperature
+    return 1.0 / (1.0 + np.exp(-margin))
+
+def _nll(margin, y_true, temperature):
+    # log(1 + exp(-y * z / T)) with y in {-1, +1}, computed stably
+    signs = np.where(y_true, 1.0, -1.0)
+    return float(np.mean(np.logaddexp(0.0, -signs * margin / temperature)))
+
+def fit_temperature(logits, y_true, bounds=(0.05, 20.0), iterations=60):
+    """
+    Temperature scaling: the T minimizing the negative log-likelihood of
+    softmax(logits / T), by golden-section search over log T (NLL is unimodal in T).
+    """
+    logits = np.asarray(logits, dtype=np.float64)
+    y_true = np.asarray(y_true).astype(bool)
+    margin = logits[:, 1] - logits[:, 0]
+    low, high = np.log(bounds[0]), np.log(bounds[1])
+    ratio = (np.sqrt(5) - 1) / 2
+    a = high - ratio * (high - low)
+    b = low + ratio * (high - low)
+    loss_a = _nll(margin, y_true, np.exp(a))
+    loss_b = _nll(margin, y_true, np.exp(b))
+    for _ in range(iterations):
+        if loss_a < loss_b:
+            high, b, loss_b = b, a, loss_a
+            a = high - ratio * (high - low)
+            loss_a = _nll(margin, y_true, np.exp(a))
+        else:
+            low, a, loss_a = a, b, loss_b
+            b = low + ratio * (high - low)
+            loss_b = _nll(margin, y_true, np.exp(b))
+    return float(np.exp((low + high) / 2))
+
+def expected_calibration_error(y_true, y_proba, bins=10):
+    """Weighted mean |accuracy - confidence| over equal-width confidence bins of P(TB)"""
+    y_true = np.asarray(y_true).astype(np.float64)
+    y_proba = np.asarray(y_proba, dtype=np.float64)
+    bin_ids = np.minimum((y_proba * bins).astype(np.int64), bins - 1)
+    counts = np.bincount(bin_ids, minlength=bins)
+    observed = np.bincount(bin_ids, weights=y_true, minlength=bins)
+    predicted = np.bincount(bin_ids, weights=y_proba, minlength=bins)
+    return float(np.sum(np.abs(observed - predicted)) / max(len(y_proba), 1))
+
+def load_outputs(path):
+    """Cached model outputs: an .npz with 'logits' (n x 2) and 'labels' (n,)"""
+    with np.load(path) as data:
+        return data['logits'], data['labels']
+
+def calibrate(logits, labels, high_precision=0.95, medium_precision=0.85):
+    """
+    Fit the temperature and pick the quick_screen cutoffs on calibrated
+    probabilities: High is the lowest threshold reaching high_precision,
+    Medium the lowest reaching medium_precision. Returns (calibration, sweep).
+    """
+    temperature = fit_temperature(logits, labels)
+    proba = softmax_tb_probability(logits, temperature)
+    sweep = threshold_sweep(labels, proba)
+
+    defaults = DEFAULT_CALIBRATION['thresholds']
+    high = lowest_threshold_for_precision(sweep, high_precision)
+    medium = lowest_threshold_for_precision(sweep, medium_precision)
+    if high is None:
+        print(f"⚠️  No threshold reaches precision {high_precision}; keeping High at {defaults['high']}")
+        high = defaults['high']
+    if medium is None:
+        print(f"⚠️  No threshold reaches precision {medium_precision}; keeping Medium at {defaults['medium']}")
+        medium = defaults['medium']
+    medium = min(medium, high)
+
+    at_cutoffs = metrics_at(labels, proba, [high, medium])
+    calibration = {
+        'temperature': temperature,
+        'thresholds': {'high': high, 'medium': medium},
+        'targets': {'high_precision': high_precision, 'medium_precision': medium_precision},
+        'metrics': {
+            level: {name: at_cutoffs[name][i].item()
+                    for name in ('precision', 'recall', 'specificity', 'f1_score')}
+            for i, level in enumerate(('high', 'medium'))
+        },
+        'samples': int(len(labels)),
+    }
+    return calibration, sweep
+
+def run_example():
     # Example for TB detection (0 = Normal, 1 = TB)
     y_true_example = [0, 1, 1, 0, 1, 0, 1, 1, 0, 0]
     y_pred_example = [0, 1, 0, 0, 1, 0, 1, 1, 1, 0]
@@ -88,4 +266,54 @@ if __name__ == "__main__":
     print("Metrics at best threshold:")
     print("F1 Score:", tune_results['metrics']['f1_score'])
     print("Precision:", tune_results['metrics']['precision'])
-    print("Recall:", tune_results['metrics']['recall'])
\ No newline at end of file
+    print("Recall:", tune_results['metrics']['recall'])
+
+def main():
+    parser = argparse.ArgumentParser(description="Threshold sweep and calibration on cached X-ray model outputs")
+    parser.add_argument("--outputs", help="Cached test-set outputs (.npz with logits and labels); "
+                                          "without it, run the built-in example")
+    parser.add_argument("--temperature", type=float, default=None,
+                        help="Evaluate at this temperature instead of fitting one")
+    parser.add_argument("--high-precision", type=float, default=0.95, help="Target precision for High risk")
+    parser.add_argument("--medium-precision", type=float, default=0.85, help="Target precision for Medium risk")
+    parser.add_argument("--curves", help="Write the ROC/PR sweep as CSV")
+    parser.add_argument("--save", nargs="?", const=CALIBRATION_PATH, default=None,
+                        help=f"Write the calibration artifact (default path: {CALIBRATION_PATH})")
+    args = parser.parse_args()
+
+    if not args.outputs:
+        run_example()
+        return
+
+    logits, labels = load_outputs(args.outputs)
+    start = time.perf_counter()
+    calibration, _ = calibrate(logits, labels, args.high_precision, args.medium_precision)
+    if args.temperature is not None:
+        calibration['temperature'] = args.temperature
+    temperature = calibration['temperature']
+
+    raw_proba = softmax_tb_probability(logits)
+    proba = softmax_tb_probability(logits, temperature)
+    sweep, roc_auc, average_precision = roc_pr_curves(labels, proba)
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(labels)} samples ({int(np.sum(labels))} TB), {len(sweep['threshold'])} thresholds "
+          f"swept in {elapsed * 1000:.1f} ms")
+    print(f"Temperature: {temperature:.4f}")
+    print(f"ECE: {expected_calibration_error(labels, raw_proba):.4f} (T=1) -> "
+          f"{expected_calibration_error(labels, proba):.4f} (T={temperature:.3f})")
+    print(f"ROC AUC: {roc_auc:.4f}, average precision: {average_precision:.4f}")
+    best_f1 = int(np.argmax(sweep['f1_score']))
+    print(f"Best F1 {sweep['f1_score'][best_f1]:.4f} at threshold {sweep['threshold'][best_f1]:.4f}")
+    for level, threshold in calibration['thresholds'].items():
+        m = calibration['metrics'][level]
+        print(f"{level.capitalize():6s} >= {threshold:.4f}: precision {m['precision']:.4f}, "
+              f"recall {m['recall']:.4f}, specificity {m['specificity']:.4f}")
+
+    if args.curves:
+        print(f"Curves written to {export_curves(args.curves, sweep)}")
+    if args.save:
+        print(f"Calibration written to {save_calibration(calibration, args.save)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Cached-logits evaluation for the X-ray model.
+
+Batched inference runs once per (image, model version): logits are stored in
+data/cache/logits/<model_version>.npz, keyed by the SHA-256 of each image
+file, so a re-run only infers new or changed images. Metric, threshold and
+calibration experiments (see evaluate_model.py) then read the cache instead
+of re-running the model. The model version is the hash of the weights file.
+
+Usage (from tbnow-back/):
+    python evaluate_xray_model.py run                                 # app/xray/model_tb.pth on data/xray/test
+    python evaluate_xray_model.py run --model other.pth --batch-size 64
+    python evaluate_xray_model.py metrics --threshold 0.5
+    python evaluate_xray_model.py compare app/xray/model_tb.pth other.pth
+    python evaluate_model.py --outputs data/cache/xray_test_logits.npz --save
+"""
+
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app.xray.registry import weights_version
+from evaluate_model import metrics_at, roc_pr_curves, softmax_tb_probability
+
+DATA_DIR = "data/xray/test"
+MODEL_PATH = "app/xray/model_tb.pth"
+LOGITS_DIR = "data/cache/logits"
+EXPORT_PATH = "data/cache/xray_test_logits.npz"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+def file_digest(path: str) -> bytes:
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+def model_version(path: str) -> str:
+    """Same version as the model registry; identical weights share cached logits"""
+    return weights_version(path)
+
+def list_split(split_dir: str):
+    """(paths, labels, classes) in ImageFolder order, without importing torchvision"""
+    classes = sorted(entry.name for entry in os.scandir(split_dir) if entry.is_dir())
+    paths, labels = [], []
+    for label, name in enumerate(classes):
+        class_dir = os.path.join(split_dir, name)
+        for root, _, files in sorted(os.walk(class_dir)):
+            for filename in sorted(files):
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(root, filename))
+                    labels.append(label)
+    return paths, np.array(labels, dtype=np.int64), classes
+
+class LogitCache:
+    """Logits of one model version, keyed by image digest, stored as a single .npz"""
+
+    def __init__(self, version: str, directory: str = LOGITS_DIR):
+        self.version = version
+        self.path = os.path.join(directory, f"{version}.npz")
+        self.entries = {}
+        if os.path.exists(self.path):
+            with np.load(self.path) as data:
+                # Digests are stored as uint8 rows: fixed-width bytes dtypes strip trailing NULs
+                for digest, logits in zip(data["hashes"], data["logits"]):
+                    self.entries[digest.tobytes()] = logits
+
+    def __len__(self):
+        return len(self.entries)
+
+    def missing(self, digests):
+        return [i for i, digest in enumerate(digests) if digest not in self.entries]
+
+    def update(self, digests, logits):
+        for digest, row in zip(digests, logits):
+            self.entries[digest] = np.asarray(row, dtype=np.float32)
+
+    def lookup(self, digests) -> np.ndarray:
+        missing = len(self.missing(digests))
+        if missing:
+            raise KeyError(f"{missing} images have no cached logits for model {self.version}; "
+                           f"run `python evaluate_xray_model.py run` first")
+        return np.stack([self.entries[digest] for digest in digests])
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        hashes = np.frombuffer(b"".join(self.entries), dtype=np.uint8).reshape(-1, 32)
+        logits = np.stack(list(self.entries.values())).astype(np.float32)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp.npz")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, hashes=hashes, logits=logits)
+        os.replace(tmp_path, self.path)
+
+def infer_logits(model_path: str, paths, batch_size: int = 32, workers: int = 4) -> np.ndarray:
+    """Batched, gradient-free inference with the serving preprocessing"""
+    import torch
+    import torch.nn as nn
+    import torchvision.models as models
+    from PIL import Image
+    from app.xray.preprocessing import batch_buffer, load_gray, normalize_into
+
+    checkpoint = torch.load(model_path, map_location="cpu")
+    if isinstance(checkpoint, dict) and 'model_state_dict' in checkpoint:
+        checkpoint = checkpoint['model_state_dict']
+    model = models.resnet18(weights=None)
+    if 'fc.1.weight' in checkpoint:
+        # Checkpoint from train_tb_model.py (Dropout + Linear head)
+        model.fc = nn.Sequential(nn.Dropout(0.5), nn.Linear(model.fc.in_features, 2))
+    else:
+        model.fc = nn.Linear(model.fc.in_features, 2)
+    model.load_state_dict(checkpoint)
+    model.eval()
+
+    def load(path):
+        with Image.open(path) as image:
+            return load_gray(image)
+
+    outputs = []
+    buffer = batch_buffer(batch_size)  # filled in place for every batch
+    # PIL decoding releases the GIL, so threads overlap decode with inference
+    with ThreadPoolExecutor(workers) as pool, torch.inference_mode():
+        for start in range(0, len(paths), batch_size):
+            planes = list(pool.map(load, paths[start:start + batch_size]))
+            for i, plane in enumerate(planes):
+                normalize_into(buffer[i], plane)
+            outputs.append(model(buffer[:len(planes)]).float().numpy())
+    return np.concatenate(outputs) if outputs else np.empty((0, 2), dtype=np.float32)
+
+def resolve_version(model: str) -> str:
+    """A weights path or an already-computed version string"""
+    return model_version(model) if os.path.exists(model) else model
+
+def load_split_logits(model: str, data_dir: str):
+    paths, labels, _ = list_split(data_dir)
+    digests = [file_digest(path) for path in paths]
+    cache = LogitCache(resolve_version(model))
+    return cache.lookup(digests), labels, cache.version
+
+def summarize(logits, labels, threshold: float) -> dict:
+    proba = softmax_tb_probability(logits)
+    metrics = metrics_at(labels, proba, threshold)
+    _, roc_auc, average_precision = roc_pr_curves(labels, proba)
+    return {
+        "accuracy": float(np.mean((proba >= threshold) == labels.astype(bool))),
+        **{name: metrics[name][0].item() for name in ("precision", "recall", "specificity", "f1_score")},
+        "roc_auc": roc_auc,
+        "average_precision": average_precision,
+    }
+
+def cmd_run(args):
+    start = time.perf_counter()
+    paths, labels, classes = list_split(args.data_dir)
+    digests = [file_digest(path) for path in paths]
+    cache = LogitCache(model_version(args.model))
+    missing = cache.missing(digests)
+    print(f"Model {args.model} (version {cache.version}): {len(paths)} images in {args.data_dir}, "
+          f"{len(paths) - len(missing)} cached, {len(missing)} to infer")
+
+    if missing:
+        infer_start = time.perf_counter()
+        logits = infer_logits(args.model, [paths[i] for i in missing], args.batch_size, args.workers)
+        cache.update([digests[i] for i in missing], logits)
+        cache.save()
+        elapsed = time.perf_counter() - infer_start
+        print(f"Inferred {len(missing)} images in {elapsed:.1f}s ({len(missing) / elapsed:.1f} img/s)")
+
+    logits = cache.lookup(digests)
+    os.makedirs(os.path.dirname(os.path.abspath(args.export)), exist_ok=True)
+    np.savez(args.export, logits=logits, labels=labels, classes=np.array(classes),
+             hashes=np.frombuffer(b"".join(digests), dtype=np.uint8).reshape(-1, 32),
+             paths=np.array(paths), model_version=cache.version)
+    print(f"Test-set outputs written to {args.export} ({time.perf_counter() - start:.1f}s total)")
+
+def cmd_metrics(args):
+    start = time.perf_counter()
+    logits, labels, version = load_split_logits(args.model, args.data_dir)
+    summary = summarize(logits, labels, args.threshold)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"Model {version}, {len(labels)} images, threshold {args.threshold} ({elapsed:.1f} ms)")
+    for name, value in summary.items():
+        print(f"  {name:18s} {value:.4f}")
+
+def cmd_compare(args):
+    start = time.perf_counter()
+    columns = ("accuracy", "precision", "recall", "specificity", "f1_score", "roc_auc")
+    print(f"{'version':14s} " + " ".join(f"{c[:11]:>11s}" for c in columns) + f" {'agree':>7s}")
+    reference = None
+    for model in args.models:
+        logits, labels, version = load_split_logits(model, args.data_dir)
+        predictions = softmax_tb_probability(logits) >= args.threshold
+        if reference is None:
+            reference = predictions
+        summary = summarize(logits, labels, args.threshold)
+        agreement = float(np.mean(predictions == reference))
+        print(f"{version:14s} " + " ".join(f"{summary[c]:11.4f}" for c in columns) + f" {agreement:7.1%}")
+    print(f"\nCompared {len(args.models)} models in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="Infer uncached images and export test-set outputs")
+    run.add_argument("--model", default=MODEL_PATH)
+    run.add_argument("--data-dir", default=DATA_DIR)
+    run.add_argument("--batch-size", type=int, default=32)
+    run.add_argument("--workers", type=int, default=4, help="Image decoding threads")
+    run.add_argument("--export", default=EXPORT_PATH, help="Outputs for evaluate_model.py --outputs")
+    run.set_defaults(func=cmd_run)
+
+    metrics = subparsers.add_parser("metrics", help="Metrics from cached logits")
+    metrics.add_argument("--model", default=MODEL_PATH, help="Weights path or model version")
+    metrics.add_argument("--data-dir", default=DATA_DIR)
+    metrics.add_argument("--threshold", type=float, default=0.5)
+    metrics.set_defaults(func=cmd_metrics)
+
+    compare = subparsers.add_parser("compare", help="Compare models from cached logits")
+    compare.add_argument("models", nargs="+", help="Weights paths or model versions")
+    compare.add_argument("--data-dir", default=DATA_DIR)
+    compare.add_argument("--threshold", type=float, default=0.5)
+    compare.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
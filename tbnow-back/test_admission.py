@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Admission control checks (app/admission/limits.py): token bucket refill,
+429 with Retry-After, the tracked-client cap and client identification.
+
+Usage (from tbnow-back/):
+    python test_admission.py
+"""
+
+import asyncio
+import types
+
+from app.admission.limits import ClientRateLimiter, Policy, Rejected, TokenBucket, client_key
+
+def test_bucket_refill():
+    """A drained bucket refills at rate tokens per second, up to burst"""
+    bucket = TokenBucket(rate=2, burst=3, now=0)
+    assert [bucket.take(0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take(0) == 0.5  # one token arrives after 1 / rate seconds
+    assert bucket.take(0.5) == 0.0
+    assert bucket.take(100) == 0.0 and bucket.tokens == 2  # capped at burst, minus the one taken
+    print("✅ Token bucket refills at its rate up to the burst")
+
+def test_rate_limited_with_retry_after():
+    """The request over the burst is rejected with 429 and a whole-second Retry-After"""
+    policy = Policy("/test", per_minute=6, burst=2, max_concurrency=4, max_wait=1)
+
+    async def run():
+        for _ in range(2):
+            await policy.acquire("ip:10.0.0.1")
+            policy.release()
+        try:
+            await policy.acquire("ip:10.0.0.1")
+        except Rejected as e:
+            return e
+        return None
+
+    rejected = asyncio.run(run())
+    assert rejected is not None and rejected.status_code == 429
+    assert rejected.headers == {"Retry-After": "10"}  # 6 per minute: a token every 10 s
+    assert asyncio.run(policy.acquire("ip:10.0.0.2")) is None  # other clients are unaffected
+    print("✅ Over-limit client gets 429 with Retry-After")
+
+def test_tracked_clients_capped():
+    """Key churn can't grow the bucket table past max_clients; the least recently used go first"""
+    limiter = ClientRateLimiter(per_minute=60, burst=5, max_clients=100)
+    limiter.take("key:regular")
+    for i in range(1000):
+        limiter.take(f"key:{i}")
+        if i % 50 == 0:
+            limiter.take("key:regular")
+    assert len(limiter) == 100, len(limiter)
+    assert "key:regular" in limiter._buckets and "key:0" not in limiter._buckets
+    print(f"✅ Tracked clients capped at {len(limiter)} after 1000 distinct keys")
+
+def test_client_key():
+    """Only configured API keys identify a client; anything else falls back to the IP"""
+    client = types.SimpleNamespace(host="10.0.0.7")
+    keys = {"clinic-a"}
+    assert client_key({"x-api-key": "clinic-a"}, client, keys) == "key:clinic-a"
+    assert client_key({"x-api-key": "made-up"}, client, keys) == "ip:10.0.0.7"
+    assert client_key({}, client, keys) == "ip:10.0.0.7"
+    assert client_key({}, None, keys) == "ip:unknown"
+    print("✅ Unknown API keys are keyed by IP")
+
+def main():
+    print("🧪 Testing admission control")
+    print("=" * 50)
+    test_bucket_refill()
+    test_rate_limited_with_retry_after()
+    test_tracked_clients_capped()
+    test_client_key()
+
+if __name__ == "__main__":
+    main()
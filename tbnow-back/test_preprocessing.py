@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Train/serve preprocessing parity check for the X-ray model.
+
+Serving (app/xray/preprocessing.preprocess) and the training cache
+(app/scripts/xray_dataset.py with eval_transforms) must feed the model
+bit-identical tensors for the same file.
+
+Usage (from tbnow-back/):
+    python test_preprocessing.py [--data-dir data/xray/test] [--limit 64]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+import torch
+import torchvision.transforms.functional as TF
+from torchvision import datasets
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "app", "scripts"))
+
+from app.xray.preprocessing import MEAN, STD, batch_buffer, load_gray, preprocess, preprocess_batch
+from xray_dataset import CachedXrayDataset, build_cache, eval_transforms
+
+def test_train_serve_parity(data_dir="data/xray/test", limit=64):
+    """Evaluation tensors from the training cache equal serving tensors exactly"""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        array_path = build_cache(data_dir, cache_dir, workers=2)
+        dataset = CachedXrayDataset(array_path, transform=eval_transforms())
+        samples = datasets.ImageFolder(data_dir).samples
+
+        count = min(limit, len(dataset))
+        for i in range(count):
+            train_input, label = dataset[i]
+            with Image.open(samples[i][0]) as image:
+                serve_input = preprocess(image)[0]
+            assert label == samples[i][1]
+            assert torch.equal(train_input, serve_input), \
+                f"{samples[i][0]}: max |diff| {(train_input - serve_input).abs().max().item()}"
+    print(f"✅ Train/serve parity: {count} images bit-identical")
+
+def test_matches_torchvision_normalize(data_dir="data/xray/test", limit=8):
+    """The broadcast normalization equals ToTensor + 3-channel expand + Normalize"""
+    samples = datasets.ImageFolder(data_dir).samples[:limit]
+    for path, _ in samples:
+        with Image.open(path) as image:
+            gray = load_gray(image)
+        reference = TF.normalize(TF.to_tensor(Image.fromarray(gray)).expand(3, -1, -1), MEAN, STD)
+        ours = preprocess(Image.fromarray(gray))[0]
+        assert torch.allclose(ours, reference, atol=1e-5), f"{path}: {(ours - reference).abs().max().item()}"
+    print(f"✅ Normalization matches torchvision on {len(samples)} images")
+
+def test_batch_buffer_reuse(data_dir="data/xray/test"):
+    """preprocess_batch fills a caller-provided buffer in place"""
+    path = datasets.ImageFolder(data_dir).samples[0][0]
+    buffer = batch_buffer(4)
+    with Image.open(path) as a, Image.open(path) as b:
+        batch = preprocess_batch([a, b], out=buffer)
+    assert batch.shape == (2, 3, 224, 224)
+    assert batch.data_ptr() == buffer.data_ptr()
+    assert torch.equal(batch[0], batch[1])
+    print("✅ Batch buffer reused in place")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default="data/xray/test")
+    parser.add_argument("--limit", type=int, default=64)
+    args = parser.parse_args()
+
+    print("🧪 Testing X-ray preprocessing")
+    print("=" * 50)
+    test_matches_torchvision_normalize(args.data_dir)
+    test_batch_buffer_reuse(args.data_dir)
+    test_train_serve_parity(args.data_dir, args.limit)
+
+if __name__ == "__main__":
+    main()
@@ -27,8 +27,8 @@ def test_xray_model(image_path):
         print(f"   Image size: {image.size}")
         print(f"   Image mode: {image.mode}")
 
-        # Run analysis
-        result = quick_screen(image)
+        # Run analysis (raw CAM only: don't render and store a heatmap per test image)
+        result = quick_screen(image, heatmap="cam")
 
         print("\n📋 Analysis Results:")
         print(f"   Risk Level: {result['risk_level']}")
@@ -81,6 +81,8 @@ def main():
     print("   - Normal X-rays should show 'Low' risk with confidence < 0.8")
     print("   - TB X-rays should show 'High' risk with confidence > 0.9")
     print("   - If normal X-rays show TB risk, the model needs retraining")
+    print("   - For metrics over the whole test set, use: python evaluate_xray_model.py run && "
+          "python evaluate_xray_model.py metrics")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file